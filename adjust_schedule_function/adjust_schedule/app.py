@@ -1,39 +1,401 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-import boto3
+from lib.accounts import AssumedRoleSessionCache, parse_role_arns
 from lib.events import EventBus
+from lib.metrics import MetricsCollector, NullMetricsCollector
 from lib.processors.autoscaling import AutoScalingGroupProcessor
 from lib.processors.eventbridge import EventBridgeProcessor
-from lib.recurrence import RecurrenceCalculator
-from lib.services import AutoScalingService, EventBridgeService
-from lib import utils
+from lib.processors.runner import MultiAccountRunner, MultiRegionRunner, ProcessorRunner
+from lib.ratelimit import AdaptiveRateLimiter
+from lib.recurrence import CachingRecurrenceCalculator, TimeSource
+from lib.services import AutoScalingService, EventBridgeService, SecurityTokenService, TaggingService
+from lib.state import DynamoDBStateStore, ResourceState
+from lib.timezones import TransitionWindow
+from lib.trigger import TransitionTriggerScheduler
+from lib import logs
+from lib import timezones
+from datetime import timedelta
 import logging
 import os
+import threading
 
+logger = logging.getLogger(__name__)
+
+
+# The lowest level of the records written to the log. At DEBUG, every
+# resource, action and recurrence calculation is logged.
+log_level = logs.DEFAULT_LEVEL
+if 'LOG_LEVEL' in os.environ and os.environ['LOG_LEVEL'].strip():
+    log_level = os.environ['LOG_LEVEL'].strip().upper()
+logs.configure(log_level)
 
 tag_prefix = ''
 if 'TAG_PREFIX' in os.environ and os.environ['TAG_PREFIX'].strip():
     tag_prefix = os.environ['TAG_PREFIX'].strip()
 
-asg_service = AutoScalingService(boto3.client('autoscaling'))
-eventbridge_service = EventBridgeService(boto3.client('events'))
-processors = [
-    AutoScalingGroupProcessor(tag_prefix, asg_service, RecurrenceCalculator()),
-    EventBridgeProcessor(tag_prefix, eventbridge_service, RecurrenceCalculator()),
-]
-bus = EventBus(boto3.client('events'))
+asg_max_workers = 8
+if 'ASG_MAX_WORKERS' in os.environ and os.environ['ASG_MAX_WORKERS'].strip():
+    asg_max_workers = int(os.environ['ASG_MAX_WORKERS'].strip())
+
+rule_max_workers = 8
+if 'RULE_MAX_WORKERS' in os.environ and os.environ['RULE_MAX_WORKERS'].strip():
+    rule_max_workers = int(os.environ['RULE_MAX_WORKERS'].strip())
+
+asg_prefetch_threshold = 20
+if 'ASG_PREFETCH_THRESHOLD' in os.environ and os.environ['ASG_PREFETCH_THRESHOLD'].strip():
+    asg_prefetch_threshold = int(os.environ['ASG_PREFETCH_THRESHOLD'].strip())
+
+# When set, the resources of these regions (a comma-separated list) are
+# processed, in parallel, instead of those of the region of the function.
+# Events are still emitted in the region of the function.
+regions = [None]
+if 'REGIONS' in os.environ and os.environ['REGIONS'].strip():
+    regions = [region.strip() for region in os.environ['REGIONS'].split(',') if region.strip()]
+
+region_max_workers = 4
+if 'REGION_MAX_WORKERS' in os.environ and os.environ['REGION_MAX_WORKERS'].strip():
+    region_max_workers = int(os.environ['REGION_MAX_WORKERS'].strip())
+
+# When set, the resources of the accounts of these IAM roles (a
+# comma-separated list of role ARNs) are processed instead of those of the
+# account of the function, by assuming the roles.
+accounts = None
+if 'TARGET_ROLE_ARNS' in os.environ and os.environ['TARGET_ROLE_ARNS'].strip():
+    accounts = parse_role_arns(os.environ['TARGET_ROLE_ARNS'])
+
+account_max_workers = 8
+if 'ACCOUNT_MAX_WORKERS' in os.environ and os.environ['ACCOUNT_MAX_WORKERS'].strip():
+    account_max_workers = int(os.environ['ACCOUNT_MAX_WORKERS'].strip())
+
+# When set, a ProcessCompletedSummary event with the number of updates and
+# failures is emitted before the ProcessCompleted events which detail them.
+emit_summary = False
+if 'EMIT_SUMMARY_EVENT' in os.environ and os.environ['EMIT_SUMMARY_EVENT'].strip():
+    emit_summary = os.environ['EMIT_SUMMARY_EVENT'].strip().lower() == 'true'
+
+# When set, the state of the resources is kept in this DynamoDB table, so
+# that those which have not changed since they were last verified can be
+# skipped.
+state_table_name = None
+if 'STATE_TABLE_NAME' in os.environ and os.environ['STATE_TABLE_NAME'].strip():
+    state_table_name = os.environ['STATE_TABLE_NAME'].strip()
+
+# When set, this EventBridge rule is scheduled after every run to invoke the
+# function around the next offset transition of the timezones in use.
+transition_trigger_rule_name = None
+if 'TRANSITION_TRIGGER_RULE_NAME' in os.environ and os.environ['TRANSITION_TRIGGER_RULE_NAME'].strip():
+    transition_trigger_rule_name = os.environ['TRANSITION_TRIGGER_RULE_NAME'].strip()
+
+# When set, resources are only evaluated if the UTC offset of their timezone
+# changes within this many days before or after the current run.
+dst_horizon = None
+if 'DST_HORIZON_DAYS' in os.environ and os.environ['DST_HORIZON_DAYS'].strip():
+    if float(os.environ['DST_HORIZON_DAYS'].strip()) > 0:
+        dst_horizon = timedelta(days=float(os.environ['DST_HORIZON_DAYS'].strip()))
+
+if 'TIMEZONE_PROVIDER' in os.environ and os.environ['TIMEZONE_PROVIDER'].strip():
+    timezone_provider = os.environ['TIMEZONE_PROVIDER'].strip()
+    if timezone_provider not in timezones.PROVIDERS:
+        raise ValueError("Unknown TIMEZONE_PROVIDER '{}'. Supported providers are: {}".format(
+            timezone_provider, ', '.join(sorted(timezones.PROVIDERS))))
+    timezones.set_provider(timezones.PROVIDERS[timezone_provider]())
+
+# When set, metrics about each run are written to the log in the CloudWatch
+# Embedded Metric Format, under this namespace.
+metrics = NullMetricsCollector()
+if 'METRICS_NAMESPACE' in os.environ and os.environ['METRICS_NAMESPACE'].strip():
+    metrics = MetricsCollector(os.environ['METRICS_NAMESPACE'].strip(), {'Service': 'scheduled-event-adjuster'})
+
+recurrence_calculator = CachingRecurrenceCalculator(metrics=metrics)
+
+# A single limiter paces the calls of every service and of the bus, so that
+# the rates it learns apply to all calls made to the same operation. As API
+# limits apply per account and region, other accounts and regions get a
+# limiter of their own.
+rate_limiter = AdaptiveRateLimiter(metrics=metrics)
+
+# Clients, processors and the bus are created on first use rather than at
+# import time, so that cold starts do not pay for them (nor for importing
+# boto3) before the first invocation needs them.
+_clients = {}
+_rate_limiters = {}
+_runners = {}
+_region_runner = None
+_session_cache = None
+_account_region_runners = {}
+_account_runner = None
+_bus = None
+_state = None
+_trigger_scheduler = None
+# Guards what accounts, which are processed from several threads, create on
+# first use.
+_lock = threading.Lock()
+
+
+def get_client(service_name, region_name=None):
+    """Returns the boto3 client for the given service and region (by
+    default, that of the function), creating it on first use. Clients are
+    shared by everything that uses the same service in the same region."""
+    key = (service_name, region_name)
+    if key not in _clients:
+        import boto3
+        if region_name is None:
+            _clients[key] = boto3.client(service_name)
+        else:
+            _clients[key] = boto3.client(service_name, region_name=region_name)
+    return _clients[key]
+
+
+def get_rate_limiter(region_name=None, account_id=None):
+    """Returns the rate limiter of the given region and account (by default,
+    those of the function), creating it on first use."""
+    if region_name is None and account_id is None:
+        return rate_limiter
+    with _lock:
+        if (account_id, region_name) not in _rate_limiters:
+            _rate_limiters[(account_id, region_name)] = AdaptiveRateLimiter(metrics=metrics)
+        return _rate_limiters[(account_id, region_name)]
+
+
+def get_throttle_count():
+    """Returns how many calls have been throttled, in every account and
+    region."""
+    with _lock:
+        limiters = list(_rate_limiters.values())
+    return rate_limiter.get_throttle_count() + sum(limiter.get_throttle_count() for limiter in limiters)
+
+
+def _build_runner(get_service_client, limiter):
+    """Builds the runner of the resource processors, whose services use the
+    clients returned by get_service_client(service_name) and the given rate
+    limiter."""
+    return ProcessorRunner([
+        AutoScalingGroupProcessor(tag_prefix, AutoScalingService(get_service_client('autoscaling'), limiter),
+                                  recurrence_calculator, asg_max_workers, asg_prefetch_threshold, get_state(),
+                                  metrics),
+        EventBridgeProcessor(tag_prefix, EventBridgeService(get_service_client('events'), limiter),
+                             recurrence_calculator,
+                             TaggingService(get_service_client('resourcegroupstaggingapi'), limiter), get_state(),
+                             metrics, rule_max_workers),
+    ], metrics=metrics)
+
+
+def get_runner(region_name=None):
+    """Returns the runner of the resource processors of the given region
+    (by default, that of the function), creating them on first use."""
+    if region_name not in _runners:
+        _runners[region_name] = _build_runner(lambda service_name: get_client(service_name, region_name),
+                                              get_rate_limiter(region_name))
+    return _runners[region_name]
+
+
+def get_region_runner():
+    """Returns the runner of the processors of every configured region,
+    creating it on first use."""
+    global _region_runner
+    if _region_runner is None:
+        _region_runner = MultiRegionRunner(get_runner, regions, region_max_workers)
+    return _region_runner
+
+
+def get_session_cache():
+    """Returns the cache of the credentials of the roles of the target
+    accounts, creating it on first use."""
+    global _session_cache
+    if _session_cache is None:
+        _session_cache = AssumedRoleSessionCache(SecurityTokenService(get_client('sts'), rate_limiter))
+    return _session_cache
+
+
+def get_account_region_runner(account):
+    """Returns the MultiRegionRunner of the given Account, whose clients use
+    the credentials of its role.
+
+    The runner is reused while the cached credentials of the role remain
+    valid. Once the role is assumed again, the runner is rebuilt with
+    clients which use the new credentials; its rate limiters are kept.
+    """
+    credentials = get_session_cache().get_credentials(account.role_arn)
+    with _lock:
+        cached = _account_region_runners.get(account.account_id)
+    if cached is not None and cached[0] == credentials['AccessKeyId']:
+        return cached[1]
+
+    # Each account has a session of its own, so that their clients can be
+    # created from several threads.
+    import boto3
+    session = boto3.session.Session(aws_access_key_id=credentials['AccessKeyId'],
+                                    aws_secret_access_key=credentials['SecretAccessKey'],
+                                    aws_session_token=credentials['SessionToken'])
+    runners = {}
+
+    def get_runner_of_region(region_name):
+        if region_name not in runners:
+            runners[region_name] = _build_runner(
+                lambda service_name: session.client(service_name, region_name=region_name),
+                get_rate_limiter(region_name, account.account_id))
+        return runners[region_name]
+
+    runner = MultiRegionRunner(get_runner_of_region, regions, region_max_workers)
+    with _lock:
+        _account_region_runners[account.account_id] = (credentials['AccessKeyId'], runner)
+    return runner
+
+
+def get_account_runner():
+    """Returns the runner of the processors of every target account,
+    creating it on first use."""
+    global _account_runner
+    if _account_runner is None:
+        _account_runner = MultiAccountRunner(get_account_region_runner, accounts, account_max_workers)
+    return _account_runner
+
+
+def get_processors(region_name=None):
+    """Returns the resource processors of the given region (by default,
+    that of the function), creating them on first use."""
+    return get_runner(region_name).get_processors()
+
+
+def get_bus():
+    """Returns the event bus, creating it on first use."""
+    global _bus
+    if _bus is None:
+        _bus = EventBus(get_client('events'), rate_limiter, emit_summary)
+    return _bus
+
+
+def get_state():
+    """Returns the ResourceState, creating it on first use, or None if no
+    state table is configured."""
+    global _state
+    if _state is None and state_table_name:
+        _state = ResourceState(DynamoDBStateStore(state_table_name, get_client('dynamodb'), rate_limiter))
+    return _state
+
+
+def get_trigger_scheduler():
+    """Returns the TransitionTriggerScheduler, creating it on first use, or
+    None if the function is not triggered around offset transitions."""
+    global _trigger_scheduler
+    if _trigger_scheduler is None and transition_trigger_rule_name:
+        _trigger_scheduler = TransitionTriggerScheduler(EventBridgeService(get_client('events'), rate_limiter),
+                                                        transition_trigger_rule_name)
+    return _trigger_scheduler
+
+
+def is_forced_run(event):
+    """Returns whether the event requests every resource to be evaluated,
+    with '"Force": true' in its detail."""
+    return bool(event and (event.get('detail') or {}).get('Force'))
+
+
+def get_transition_window(event):
+    """Returns the TransitionWindow for the current run, or None if every
+    resource must be evaluated (i.e., no horizon is configured, or the run is
+    forced)."""
+    if dst_horizon is None or is_forced_run(event):
+        return None
+    return TransitionWindow.around(TimeSource().get_current_utc_datetime(), dst_horizon)
 
 
 def lambda_handler(event, context):
-    updates = []
-    for processor in processors:
-        print("Using processor '{}'".format(processor.__class__.__name__))
-        updates = updates + processor.process_resources()
-        print("Processor has completed")
+    # The metrics are written even if the run fails.
+    try:
+        _handle(event)
+    finally:
+        metrics.flush()
+
+
+def _handle(event):
+    if is_forced_run(event):
+        logger.info("Forced run: all resources will be evaluated")
+
+    state = get_state()
+    if state is not None:
+        state.start_run(is_forced_run(event))
+
+    region_summaries = None
+    account_summaries = None
+    failed_accounts = []
+    if accounts is not None:
+        # The STS client is created before the accounts are processed
+        # concurrently.
+        get_session_cache()
+        runner = get_account_runner()
+        account_results = runner.run(get_transition_window(event))
+        region_results = [region_result for account_result in account_results
+                          for region_result in account_result.region_results]
+        updates = MultiAccountRunner.merge_changes(account_results)
+        failures = MultiAccountRunner.merge_failures(account_results)
+        account_summaries = MultiAccountRunner.summarize(account_results)
+        failed_accounts = [account_result for account_result in account_results if account_result.error is not None]
+    else:
+        runner = get_region_runner()
+        region_results = runner.run(get_transition_window(event))
+        updates = MultiRegionRunner.merge_changes(region_results)
+        failures = MultiRegionRunner.merge_failures(region_results)
+        # The regions are only summarized when they are configured
+        # explicitly.
+        if regions != [None]:
+            region_summaries = MultiRegionRunner.summarize(region_results)
+    results = [result for region_result in region_results for result in region_result.results]
+    skipped_count = sum(result.skipped_count for result in results)
+
+    if len(updates) or len(failures) or failed_accounts:
+        logger.info("Emitting event to bus")
+        get_bus().emit_process_completed(updates, failures, region_summaries, account_summaries)
+
+    unchanged_count = 0
+    recorded_count = 0
+    if state is not None:
+        unchanged_count = state.get_unchanged_count()
+        recorded_count = state.save()
+
+    trigger_scheduler = get_trigger_scheduler()
+    if trigger_scheduler is not None:
+        used_timezones = set()
+        for processor in runner.get_processors():
+            used_timezones.update(processor.get_timezones())
+        trigger_scheduler.schedule_next_run(used_timezones, TimeSource().get_current_utc_datetime())
+
+    # The changes made before any failure have been reported, so the
+    # invocation can now fail.
+    errors = [result for result in results if result.error is not None]
+
+    cache_info = recurrence_calculator.cache_info()
+    summary = {
+        'Forced': is_forced_run(event),
+        'UpdateCount': len(updates),
+        'FailureCount': len(failures),
+        'FailedProcessorCount': len(errors),
+        'SkippedCount': skipped_count,
+        'UnchangedCount': unchanged_count,
+        'RecordedCount': recorded_count,
+        'ThrottledCount': get_throttle_count(),
+        'RecurrenceCacheHits': cache_info.hits,
+        'RecurrenceCacheMisses': cache_info.misses
+    }
+    if region_summaries is not None:
+        summary['Regions'] = region_summaries
+    if account_summaries is not None:
+        summary['Accounts'] = account_summaries
+    logger.info("Run completed", extra=summary)
+
+    if errors or failures or failed_accounts:
+        cause = (errors or failed_accounts)[0].error if errors or failed_accounts else None
+        raise Exception(get_failure_message(errors, failures, failed_accounts)) from cause
 
-    if len(updates):
-        print('Emitting event to bus')
-        bus.emit_process_completed(updates)
 
-    print("All resources have been processed. No further work to do.")
+def get_failure_message(failed_results, failures, failed_accounts=()):
+    """Returns a message which describes the accounts, the processors and the
+    resources which failed in the current run."""
+    messages = ["Account '{}' failed: {}".format(result.account_id, str(result.error)) for result in failed_accounts]
+    messages.extend("Processor '{}' failed: {}".format(result.processor_name, str(result.error))
+                    for result in failed_results)
+    if failures:
+        messages.append("{} resources failed to be processed: {}".format(
+            len(failures), ', '.join("'{}' ({})".format(failure['ResourceName'], failure['Error'])
+                                     for failure in failures)))
+    return '. '.join(messages)
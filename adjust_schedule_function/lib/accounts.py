@@ -0,0 +1,114 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import namedtuple
+from datetime import timedelta
+from lib.recurrence import TimeSource
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+Account = namedtuple('Account', ['account_id', 'role_arn'])
+
+
+def parse_role_arns(text):
+    """Parses a comma-separated list of IAM role ARNs into the accounts they
+    belong to.
+
+    Args:
+        text: The list of role ARNs (e.g.,
+            'arn:aws:iam::111111111111:role/Adjuster,arn:aws:iam::...').
+
+    Returns:
+        A list of Account tuples, in the order of the list.
+
+    Raises:
+        ValueError: An item is not the ARN of an IAM role, or two roles
+            belong to the same account.
+    """
+    accounts = []
+    for role_arn in (item.strip() for item in text.split(',')):
+        if not role_arn:
+            continue
+        parts = role_arn.split(':', 5)
+        if len(parts) != 6 or parts[0] != 'arn' or parts[2] != 'iam' or not parts[4].isdigit() \
+                or not parts[5].startswith('role/'):
+            raise ValueError("'{}' is not the ARN of an IAM role".format(role_arn))
+        if any(account.account_id == parts[4] for account in accounts):
+            raise ValueError("Account '{}' is listed more than once".format(parts[4]))
+        accounts.append(Account(parts[4], role_arn))
+    return accounts
+
+
+class AssumedRoleSessionCache:
+    """Assumes IAM roles and caches their temporary credentials until
+    shortly before they expire, so that warm invocations do not assume them
+    again.
+
+    The cache is safe to use from several threads. Concurrent requests for
+    the credentials of the same role wait for a single call to STS, while
+    those of other roles are not held back.
+    """
+    SESSION_NAME = 'scheduled-event-adjuster'
+    DEFAULT_DURATION = timedelta(hours=1)
+    # Credentials which expire within this margin are renewed, so that they
+    # do not expire during a run.
+    DEFAULT_REFRESH_MARGIN = timedelta(minutes=10)
+
+    def __init__(self, sts_service, time_source=None, duration=DEFAULT_DURATION,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN):
+        """Initializes the cache.
+
+        Args:
+            sts_service: The SecurityTokenService used to assume the roles.
+            time_source: The time source used to tell whether credentials
+                are about to expire.
+            duration: How long the credentials which are requested remain
+                valid.
+            refresh_margin: How long before their expiration credentials are
+                renewed.
+        """
+        self._sts_service = sts_service
+        self._time_source = time_source or TimeSource()
+        self._duration = duration
+        self._refresh_margin = refresh_margin
+        self._credentials = {}
+        self._role_locks = {}
+        self._lock = threading.Lock()
+        self._assume_count = 0
+
+    def get_assume_count(self):
+        """Returns how many times a role has been assumed."""
+        return self._assume_count
+
+    def get_credentials(self, role_arn):
+        """Returns valid credentials of the role, assuming it if there are no
+        cached credentials or they are about to expire.
+
+        Args:
+            role_arn: The ARN of the role.
+
+        Returns:
+            A dict with the 'AccessKeyId', 'SecretAccessKey', 'SessionToken'
+            and 'Expiration' of the credentials.
+
+        Raises:
+            Exception: The role could not be assumed.
+        """
+        with self._lock:
+            role_lock = self._role_locks.setdefault(role_arn, threading.Lock())
+        with role_lock:
+            credentials = self._credentials.get(role_arn)
+            if credentials is None or self._is_expiring(credentials):
+                logger.info("Assuming role '%s'", role_arn)
+                credentials = self._sts_service.assume_role(role_arn, self.SESSION_NAME,
+                                                            int(self._duration.total_seconds()))
+                with self._lock:
+                    self._credentials[role_arn] = credentials
+                    self._assume_count += 1
+            return credentials
+
+    def _is_expiring(self, credentials):
+        return credentials['Expiration'] - self._refresh_margin <= self._time_source.get_current_utc_datetime()
@@ -0,0 +1,361 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timedelta
+from lib import timezones
+import bisect
+import functools
+
+
+MONTH_NAMES = {name: number for number, name in enumerate(
+    ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'], 1)}
+
+# Unix cron (as used by Auto Scaling) numbers weekdays from 0 (Sunday) to 6,
+# and also accepts 7 for Sunday. AWS cron (as used by EventBridge) numbers
+# them from 1 (Sunday) to 7.
+UNIX_WEEKDAY_NAMES = {name: number for number, name in enumerate(
+    ['SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT'])}
+AWS_WEEKDAY_NAMES = {name: number + 1 for name, number in UNIX_WEEKDAY_NAMES.items()}
+
+# The number of years after which the calendar repeats itself. If an
+# expression does not run in this many years, it will never run.
+CALENDAR_CYCLE_YEARS = 28
+
+
+class UnsupportedFieldError(ValueError):
+    """A cron field uses syntax which cannot be compiled (e.g., 'L', 'W' or
+    '#'), and must be evaluated by CronTab instead."""
+
+
+def _parse_value(value, names):
+    value = value.upper()
+    if value in names:
+        return names[value]
+    if not value.isdigit():
+        raise UnsupportedFieldError("Unsupported value '{}'".format(value))
+    return int(value)
+
+
+def parse_field(field, minimum, maximum, names=None):
+    """Parses a cron field made of values, ranges, steps and lists thereof.
+
+    Args:
+        field: The field, as a string (e.g., '*/15', '8-17' or 'MON,WED').
+        minimum: The minimum value of the field.
+        maximum: The maximum value of the field.
+        names: An optional dict mapping names (e.g., 'JAN') to values.
+
+    Returns:
+        A sorted tuple with every value the field matches, or None if the
+        field matches every value ('*' or '?').
+
+    Raises:
+        UnsupportedFieldError: The field uses unsupported syntax, or values
+            outside of the allowed range.
+    """
+    names = names or {}
+    if field in ('*', '?'):
+        return None
+
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = _parse_value(step, {})
+            if step == 0:
+                raise UnsupportedFieldError("Invalid step in field '{}'".format(field))
+
+        if part in ('*', '?'):
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = [_parse_value(value, names) for value in part.split('-', 1)]
+        else:
+            start = _parse_value(part, names)
+            end = maximum if step != 1 else start
+
+        if start > end or start < minimum or end > maximum:
+            raise UnsupportedFieldError("Unsupported range in field '{}'".format(field))
+        values.update(range(start, end + 1, step))
+
+    return tuple(sorted(values))
+
+
+def format_field(values, minimum, maximum, names=None, is_aws=False):
+    """Returns the most compact cron field which matches the given values.
+
+    Args:
+        values: A sorted sequence of the values the field must match.
+        minimum: The minimum value of the field.
+        maximum: The maximum value of the field.
+        names: An optional dict mapping names (e.g., 'MON') to values. If
+            given, values are written with their names.
+        is_aws: Whether the field belongs to an AWS cron expression, which
+            accepts steps without an end (e.g., '5/15').
+
+    Returns:
+        A string with the field (e.g., '*', '*/15', '8-17' or '1,3,5').
+    """
+    values = list(values)
+    if values == list(range(minimum, maximum + 1)):
+        return '*'
+
+    labels = {value: name for name, value in (names or {}).items()}
+    runs = []
+    for value in values:
+        if runs and runs[-1][1] == value - 1:
+            runs[-1][1] = value
+        else:
+            runs.append([value, value])
+    parts = []
+    for start, end in runs:
+        start_label, end_label = labels.get(start, str(start)), labels.get(end, str(end))
+        if end - start >= 2:
+            parts.append('{}-{}'.format(start_label, end_label))
+        else:
+            parts.extend(labels.get(value, str(value)) for value in range(start, end + 1))
+    candidates = [','.join(parts)]
+
+    if not names and len(values) >= 3:
+        step = values[1] - values[0]
+        if step > 1 and values == list(range(values[0], values[-1] + 1, step)):
+            if values[-1] + step > maximum:
+                if values[0] == minimum:
+                    candidates.append('*/{}'.format(step))
+                elif is_aws:
+                    candidates.append('{}/{}'.format(values[0], step))
+            candidates.append('{}-{}/{}'.format(values[0], values[-1], step))
+
+    return min(candidates, key=len)
+
+
+class CronExpression:
+    """A cron expression compiled into the sets of values of its fields, so
+    that its next run can be computed with integer arithmetic.
+
+    Expressions with 5 fields are interpreted as Unix cron expressions (as
+    used by Auto Scaling), and expressions with 6 fields as AWS cron
+    expressions (as used by EventBridge), whose last field is the year.
+    Expressions which use syntax that cannot be compiled (e.g., 'L', 'W' or
+    '#') are evaluated by CronTab instead.
+
+    Instances are immutable (shifted expressions are memoized); use
+    compile_cron_expression to get cached ones.
+    """
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) not in (5, 6):
+            raise ValueError("String '{}' is not a valid cron expression".format(expression))
+
+        self.expression = expression
+        self.minute = fields[0]
+        self.hour = fields[1]
+        self.rest = ' '.join(fields[2:])
+        self.is_aws = len(fields) == 6
+        self._fields = fields
+        self._shifts = {}
+
+        try:
+            self.minutes = parse_field(fields[0], 0, 59) or tuple(range(60))
+            self.hours = parse_field(fields[1], 0, 23) or tuple(range(24))
+        except UnsupportedFieldError as e:
+            raise ValueError("String '{}' is not a valid cron expression: {}".format(expression, str(e)))
+        # The times of the day at which the expression runs, in minutes.
+        self.times = tuple(hour * 60 + minute for hour in self.hours for minute in self.minutes)
+
+        try:
+            self.days_of_month = parse_field(fields[2], 1, 31)
+            self.months = parse_field(fields[3], 1, 12, MONTH_NAMES)
+            self.weekdays = self._parse_weekdays(fields[4])
+            self.years = parse_field(fields[5], 1970, 2199) if self.is_aws else None
+            # As in Vixie cron, a day is matched by either of the day of month
+            # and the weekday only if both are restricted and neither of them
+            # starts with '*' (e.g., '1,15 * MON'). Otherwise, both must match
+            # (e.g., '*/2 * MON-FRI').
+            self._matches_either_day = self.days_of_month is not None and self.weekdays is not None \
+                and not fields[2].startswith('*') and not fields[4].startswith('*')
+            self._crontab = None
+        except UnsupportedFieldError:
+            # CronTab is only needed (and imported) for the few expressions
+            # that cannot be compiled.
+            from crontab import CronTab
+            self.days_of_month = self.months = self.weekdays = self.years = None
+            self._crontab = CronTab(expression)
+
+    def is_compiled(self):
+        """Returns whether the next run is computed by this class, rather than
+        by CronTab."""
+        return self._crontab is None
+
+    def runs_every_day(self):
+        """Returns whether the expression runs on every day."""
+        return self.is_compiled() and self.days_of_month is None and self.weekdays is None \
+            and self.months is None and self.years is None
+
+    def runs_every_week(self):
+        """Returns whether the expression runs at least once a week, on the
+        same weekdays."""
+        return self.is_compiled() and self.days_of_month is None and self.months is None \
+            and self.years is None
+
+    def shift(self, delta):
+        """Returns the expression that runs the given number of minutes later
+        (or earlier, if negative) than this one.
+
+        Only the fields that change are rewritten, in their most compact
+        form. If some runs move to another day, the weekdays are shifted
+        accordingly.
+
+        Args:
+            delta: The number of minutes to shift the expression by.
+
+        Returns:
+            A string with the shifted cron expression.
+
+        Raises:
+            NotImplementedError: The shifted runs cannot be expressed as a
+                single cron expression: the times of the day are not every
+                combination of a set of hours and a set of minutes, or they
+                move to another day but the expression is selective on
+                anything other than the weekday.
+        """
+        if delta not in self._shifts:
+            self._shifts[delta] = self._shift(delta)
+        return self._shifts[delta]
+
+    def _shift(self, delta):
+        shifted_times = set()
+        day_shifts = set()
+        for time in self.times:
+            day_shift, shifted_time = divmod(time + delta, 1440)
+            shifted_times.add(shifted_time)
+            day_shifts.add(day_shift)
+
+        hours = tuple(sorted({time // 60 for time in shifted_times}))
+        minutes = tuple(sorted({time % 60 for time in shifted_times}))
+        if len(hours) * len(minutes) != len(shifted_times):
+            raise NotImplementedError("Recurrence '{}' cannot be shifted by {} minutes into a single cron expression".format(self.expression, delta))
+
+        fields = list(self._fields)
+        if minutes != self.minutes:
+            fields[0] = self._format_field(minutes, 0, 59)
+        if hours != self.hours:
+            fields[1] = self._format_field(hours, 0, 23)
+        if day_shifts != {0} and not self.runs_every_day():
+            fields[4] = self._shift_weekdays(day_shifts)
+
+        return ' '.join(fields)
+
+    def get_next_run(self, now):
+        """Returns the first time the expression runs strictly after now.
+
+        Args:
+            now: A datetime. Naive datetimes are assumed to be in UTC.
+
+        Returns:
+            A datetime, in UTC (naive if now is naive), or None if the
+            expression will not run again.
+        """
+        naive_now = timezones.to_naive_utc(now)
+
+        if self._crontab is None:
+            next_run = self._find_next_run(naive_now.replace(second=0, microsecond=0) + timedelta(minutes=1))
+        else:
+            delay = self._crontab.next(now=naive_now, default_utc=True)
+            next_run = None
+            if delay is not None:
+                # CronTab returns the delay as a float, which might land a
+                # few microseconds before the actual run: round it to the
+                # minute.
+                next_run = naive_now + timedelta(seconds=delay)
+                next_run = (next_run + timedelta(seconds=30)).replace(second=0, microsecond=0)
+
+        if next_run is None or now.tzinfo is None:
+            return next_run
+        return next_run.replace(tzinfo=timezones.UTC)
+
+    def _parse_weekdays(self, field):
+        if self.is_aws:
+            weekdays = parse_field(field, 1, 7, AWS_WEEKDAY_NAMES)
+        else:
+            weekdays = parse_field(field, 0, 7, UNIX_WEEKDAY_NAMES)
+        if weekdays is None:
+            return None
+        # Convert to Python's numbering, from 0 (Monday) to 6 (Sunday).
+        return frozenset((weekday - self._get_weekday_offset()) % 7 for weekday in weekdays)
+
+    def _get_weekday_offset(self):
+        return 2 if self.is_aws else 1
+
+    def _shift_weekdays(self, day_shifts):
+        if len(day_shifts) != 1 or not self.runs_every_week():
+            raise NotImplementedError("Recurrence '{}' cannot be shifted to another day".format(self.expression))
+
+        day_shift = next(iter(day_shifts))
+        offset = self._get_weekday_offset()
+        names = AWS_WEEKDAY_NAMES if self.is_aws else UNIX_WEEKDAY_NAMES
+        minimum = min(names.values())
+        # Convert back from Python's numbering to the expression's one.
+        weekdays = sorted((weekday + day_shift + offset - minimum) % 7 + minimum for weekday in self.weekdays)
+        if any(character.isalpha() for character in self._fields[4]):
+            return format_field(weekdays, minimum, minimum + 6, names=names)
+        return format_field(weekdays, minimum, minimum + 6)
+
+    def _format_field(self, values, minimum, maximum):
+        return format_field(values, minimum, maximum, is_aws=self.is_aws)
+
+    def _find_next_run(self, start):
+        day = start.date()
+        minute_of_day = start.hour * 60 + start.minute
+
+        if self._matches_day(day):
+            index = bisect.bisect_left(self.times, minute_of_day)
+            if index < len(self.times):
+                return self._at(day, self.times[index])
+
+        day = self._find_next_day(day + timedelta(days=1))
+        if day is None:
+            return None
+        return self._at(day, self.times[0])
+
+    def _find_next_day(self, day):
+        limit = day.year + CALENDAR_CYCLE_YEARS
+        while day.year <= limit:
+            if self.years is not None and day.year not in self.years:
+                later_years = [year for year in self.years if year > day.year]
+                if not later_years:
+                    return None
+                day = day.replace(year=later_years[0], month=1, day=1)
+                continue
+            if self.months is not None and day.month not in self.months:
+                if day.month == 12:
+                    day = day.replace(year=day.year + 1, month=1, day=1)
+                else:
+                    day = day.replace(month=day.month + 1, day=1)
+                continue
+            if self._matches_day(day):
+                return day
+            day += timedelta(days=1)
+        return None
+
+    def _matches_day(self, day):
+        if self.years is not None and day.year not in self.years:
+            return False
+        if self.months is not None and day.month not in self.months:
+            return False
+
+        matches_day_of_month = self.days_of_month is None or day.day in self.days_of_month
+        matches_weekday = self.weekdays is None or day.weekday() in self.weekdays
+        if self._matches_either_day:
+            return matches_day_of_month or matches_weekday
+        return matches_day_of_month and matches_weekday
+
+    def _at(self, day, minute_of_day):
+        return datetime(day.year, day.month, day.day, minute_of_day // 60, minute_of_day % 60)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_cron_expression(expression):
+    """Returns the CronExpression for the given string, reusing previously
+    compiled ones."""
+    return CronExpression(expression)
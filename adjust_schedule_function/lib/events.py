@@ -1,26 +1,211 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import collections
+import itertools
 import json
+import logging
+import time
+
+from lib.ratelimit import UnlimitedRateLimiter
+
+logger = logging.getLogger(__name__)
 
 class Event:
     PROCESS_COMPLETED = 'ProcessCompleted'
+    PROCESS_COMPLETED_SUMMARY = 'ProcessCompletedSummary'
 
 class EventBus:
     SOURCE = 'scheduled-event-adjuster'
     BUS_NAME = 'default'
+    # EventBridge limits both the size of each entry and the total size of a
+    # put_events call to 256 KB, and a call to 10 entries.
+    MAX_ENTRY_SIZE = 256 * 1024
+    MAX_REQUEST_SIZE = 256 * 1024
+    MAX_ENTRIES_PER_REQUEST = 10
+    # EventBridge counts 14 bytes for the time of every entry, even if it is
+    # not given. The size of the 'Part' and 'PartCount' keys is reserved too.
+    ENTRY_OVERHEAD_SIZE = 14
+    PART_KEYS_SIZE = len(', "Part": , "PartCount": ') + 2 * 10
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY = 0.1
+
+    def __init__(self, eventbridge_client, rate_limiter=None, summary=False, sleep=time.sleep):
+        """Initializes the bus.
 
-    def __init__(self, eventbridge_client):
+        Args:
+            eventbridge_client: The boto3 EventBridge client.
+            rate_limiter: An optional rate limiter which paces the calls to
+                put_events.
+            summary: Whether to emit a ProcessCompletedSummary event, with
+                the number of updates and failures, before the
+                ProcessCompleted events which detail them.
+            sleep: A function which waits for the given number of seconds,
+                used between retries of failed entries.
+        """
         self._eventbridge_client = eventbridge_client
+        self._rate_limiter = rate_limiter or UnlimitedRateLimiter()
+        self._summary = summary
+        self._sleep = sleep
+
+    def emit_process_completed(self, updates, failures=None, regions=None, accounts=None):
+        """Emits the ProcessCompleted event.
+
+        If the updates and failures do not fit in a single event, they are
+        split across several ones, whose details also hold their 1-based
+        'Part' number and the 'PartCount'. Events are sent in as few
+        put_events calls as the limits of EventBridge allow, and entries
+        which fail are retried.
+
+        Args:
+            updates: The list of changes made to the resources.
+            failures: An optional list of the resources which failed to be
+                processed, included in the events as 'Failures'.
+            regions: An optional dict with a summary of each processed
+                region, included in every event as 'Regions'.
+            accounts: An optional dict with a summary of each processed
+                account, included in every event as 'Accounts'.
+
+        Returns:
+            A dict shaped like the response of put_events, with the
+            'FailedEntryCount' and the 'Entries' of every event, in the order
+            in which they were built.
+
+        Raises:
+            Exception: Some events could not be emitted after MAX_ATTEMPTS.
+        """
+        summaries = {}
+        if regions is not None:
+            summaries['Regions'] = regions
+        if accounts is not None:
+            summaries['Accounts'] = accounts
+        details = self._build_details(updates, failures or [], summaries)
+        entries = [self._build_entry(Event.PROCESS_COMPLETED, detail) for detail in details]
+        if self._summary:
+            summary = self._build_summary(updates, failures or [], len(entries), summaries)
+            entries.insert(0, self._build_entry(Event.PROCESS_COMPLETED_SUMMARY, json.dumps(summary)))
+
+        results = self._put_entries(entries)
+        failed_results = [result for result in results if 'ErrorCode' in result]
+        if failed_results:
+            raise Exception('{} of {} events failed to be emitted: {}'.format(
+                len(failed_results), len(results), ', '.join(sorted(set(result['ErrorCode'] for result in failed_results)))))
+        return {'FailedEntryCount': 0, 'Entries': results}
+
+    def _build_entry(self, detail_type, detail):
+        return {
+            'Source': self.SOURCE,
+            'DetailType': detail_type,
+            'Detail': detail,
+            'EventBusName': self.BUS_NAME
+        }
+
+    def _get_entry_size(self, entry):
+        return self.ENTRY_OVERHEAD_SIZE + sum(len(entry[key].encode('utf-8'))
+                                              for key in ('Source', 'DetailType', 'Detail'))
+
+    def _build_summary(self, updates, failures, part_count, summaries=None):
+        updates_by_type = collections.Counter(update.get('Type') for update in updates)
+        summary = {
+            'UpdateCount': len(updates),
+            'FailureCount': len(failures),
+            'UpdateCountByType': dict(updates_by_type),
+            'PartCount': part_count
+        }
+        summary.update(summaries or {})
+        return summary
+
+    def _build_details(self, updates, failures, summaries=None):
+        """Splits the updates and failures into as few event details as fit
+        within MAX_ENTRY_SIZE, each serialized as a JSON string.
+
+        Every update and failure is serialized once, and the details are
+        assembled from those pieces, so that their size is known exactly
+        while packing them. The summaries of the regions and accounts, if
+        any, are repeated in every detail.
+        """
+        summaries_text = None
+        if summaries:
+            summaries_text = ', '.join('{}: {}'.format(json.dumps(key), json.dumps(value))
+                                       for key, value in summaries.items())
+        fixed_size = self.ENTRY_OVERHEAD_SIZE + len(self.SOURCE) + len(Event.PROCESS_COMPLETED) \
+            + len('{"Updates": []}') + self.PART_KEYS_SIZE
+        if summaries_text is not None:
+            fixed_size += len(', ') + len(summaries_text.encode('utf-8'))
+        failures_key_size = len(', "Failures": []')
+
+        chunks = []
+        chunk = {'Updates': [], 'Failures': []}
+        size = fixed_size
+        items = itertools.chain((('Updates', update) for update in updates),
+                                (('Failures', failure) for failure in failures))
+        for key, item in items:
+            text = json.dumps(item)
+            cost = len(text.encode('utf-8')) + (2 if chunk[key] else 0)
+            if key == 'Failures' and not chunk[key]:
+                cost += failures_key_size
+            if size + cost > self.MAX_ENTRY_SIZE and (chunk['Updates'] or chunk['Failures']):
+                chunks.append(chunk)
+                chunk = {'Updates': [], 'Failures': []}
+                size = fixed_size
+                cost = len(text.encode('utf-8')) + (failures_key_size if key == 'Failures' else 0)
+            chunk[key].append(text)
+            size += cost
+        chunks.append(chunk)
+
+        if len(chunks) == 1:
+            return [self._format_detail(chunks[0], summaries_text)]
+        return [self._format_detail(chunk, summaries_text, part, len(chunks)) for part, chunk in enumerate(chunks, 1)]
+
+    def _format_detail(self, chunk, summaries_text=None, part=None, part_count=None):
+        # Matches the output of json.dumps for the same dict.
+        fields = ['"Updates": [' + ', '.join(chunk['Updates']) + ']']
+        if chunk['Failures']:
+            fields.append('"Failures": [' + ', '.join(chunk['Failures']) + ']')
+        if summaries_text is not None:
+            fields.append(summaries_text)
+        if part_count is not None:
+            fields.append('"Part": {}, "PartCount": {}'.format(part, part_count))
+        return '{' + ', '.join(fields) + '}'
+
+    def _put_entries(self, entries):
+        """Sends the entries in batches, retrying those which fail, and
+        returns the result of each entry in the same order."""
+        results = [None] * len(entries)
+        pending = list(range(len(entries)))
+        for attempt in range(self.MAX_ATTEMPTS):
+            if attempt:
+                logger.warning('Retrying %d events which failed to be emitted', len(pending))
+                self._sleep(self.RETRY_DELAY * 2 ** (attempt - 1))
+            failed = []
+            for batch in self._batch(pending, entries):
+                response = self._rate_limiter.call(
+                    'put_events',
+                    self._eventbridge_client.put_events,
+                    Entries=[entries[index] for index in batch]
+                )
+                for index, result in zip(batch, response['Entries']):
+                    results[index] = result
+                    if 'ErrorCode' in result:
+                        failed.append(index)
+            pending = failed
+            if not pending:
+                break
+        return results
+
+    def _batch(self, indexes, entries):
+        """Groups the indexes of the entries into batches which fit in a
+        single put_events call."""
+        batch = []
+        batch_size = 0
+        for index in indexes:
+            size = self._get_entry_size(entries[index])
+            if batch and (len(batch) >= self.MAX_ENTRIES_PER_REQUEST or batch_size + size > self.MAX_REQUEST_SIZE):
+                yield batch
+                batch = []
+                batch_size = 0
+            batch.append(index)
+            batch_size += size
+        if batch:
+            yield batch
 
-    def emit_process_completed(self, updates):
-        return self._eventbridge_client.put_events(
-            Entries=[
-                {
-                    'Source': self.SOURCE,
-                    'DetailType': Event.PROCESS_COMPLETED,
-                    'Detail': json.dumps({'Updates': updates}),
-                    'EventBusName': self.BUS_NAME
-                }
-            ]
-        )
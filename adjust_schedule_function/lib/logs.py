@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timezone
+import json
+import logging
+import sys
+
+
+# The loggers of the adjuster. Modules log through logging.getLogger(__name__),
+# so their loggers are children of these.
+LOGGER_NAMES = ('lib', 'adjust_schedule')
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+DEFAULT_LEVEL = 'INFO'
+
+# The attributes of every LogRecord. Any other attribute of a record was given
+# through 'extra', and is written as a field of its own.
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as a single line of JSON, with its time, level,
+    logger and message, along with any fields given through 'extra':
+
+        logger.info("Run completed", extra={'UpdateCount': 3})
+
+        {"timestamp": "...", "level": "INFO", "logger": "adjust_schedule.app",
+         "message": "Run completed", "UpdateCount": 3}
+    """
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StdoutHandler(logging.StreamHandler):
+    """A handler which writes to sys.stdout as it is when each record is
+    emitted, as print does, so that the output ends up wherever the standard
+    output is redirected to (e.g., the log of a Lambda function)."""
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def configure(level=DEFAULT_LEVEL):
+    """Makes the loggers of the adjuster write JSON records of the given level
+    and above to the standard output.
+
+    Args:
+        level: The name of the lowest level that is written (one of LEVELS).
+
+    Raises:
+        ValueError: The level is not one of LEVELS.
+    """
+    if level not in LEVELS:
+        raise ValueError("Unknown LOG_LEVEL '{}'. Supported levels are: {}".format(level, ', '.join(LEVELS)))
+
+    handler = StdoutHandler()
+    handler.setFormatter(JsonFormatter())
+    for name in LOGGER_NAMES:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.handlers = [handler]
+        logger.propagate = False
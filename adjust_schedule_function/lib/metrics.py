@@ -0,0 +1,150 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import threading
+import time
+
+
+class NullMetricsCollector:
+    """A metrics collector which records nothing. It is used by the
+    components which are not given a collector, and when metrics are
+    disabled, so that instrumented code only pays for a method call."""
+    enabled = False
+
+    def increment(self, name, value=1):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def flush(self):
+        return []
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, collector, name):
+        self._collector = collector
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = self._collector._clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._collector.add_time(self._name, self._collector._clock() - self._start)
+        return False
+
+
+class MetricsCollector:
+    """Collects counters and timers over a run, and flushes them as
+    CloudWatch Embedded Metric Format (EMF) documents.
+
+    When printed to the log of a Lambda function, EMF documents are turned
+    into CloudWatch metrics without any call to the CloudWatch API. Counters
+    are reported with the 'Count' unit, and timers with the total of their
+    measurements, in 'Milliseconds'.
+
+    The collector is safe to use from several threads.
+    """
+    # CloudWatch accepts at most 100 metrics per EMF document.
+    MAX_METRICS_PER_DOCUMENT = 100
+
+    enabled = True
+
+    def __init__(self, namespace, dimensions=None, clock=time.perf_counter, wall_clock=time.time, output=print):
+        """Initializes the collector.
+
+        Args:
+            namespace: The CloudWatch namespace of the metrics.
+            dimensions: An optional dict of dimension names and values, which
+                all metrics are reported with.
+            clock: A function which returns a monotonic time, in seconds,
+                used by timers.
+            wall_clock: A function which returns the current time, in
+                seconds since the epoch, used as the timestamp of the
+                documents.
+            output: A function which writes a line to the log.
+        """
+        self._namespace = namespace
+        self._dimensions = dict(dimensions or {})
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._output = output
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        """Adds the value to the counter with the given name."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        """Adds a measurement, in seconds, to the timer with the given name."""
+        with self._lock:
+            self._timers[name] = self._timers.get(name, 0.0) + seconds
+
+    def timer(self, name):
+        """Returns a context manager which adds the time spent within it to
+        the timer with the given name."""
+        return _Timer(self, name)
+
+    def get_values(self):
+        """Returns the current counters and timers (in milliseconds), as a
+        dict indexed by metric name."""
+        with self._lock:
+            values = dict(self._counters)
+            values.update((name, round(seconds * 1000, 3)) for name, seconds in self._timers.items())
+        return values
+
+    def flush(self):
+        """Writes the collected metrics as EMF documents and resets them.
+
+        Returns:
+            The list of documents that were written, as dicts.
+        """
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            timers, self._timers = self._timers, {}
+
+        metrics = [(name, 'Count', value) for name, value in sorted(counters.items())]
+        metrics.extend((name, 'Milliseconds', round(seconds * 1000, 3)) for name, seconds in sorted(timers.items()))
+
+        documents = []
+        timestamp = int(self._wall_clock() * 1000)
+        for start in range(0, len(metrics), self.MAX_METRICS_PER_DOCUMENT):
+            documents.append(self._build_document(metrics[start:start + self.MAX_METRICS_PER_DOCUMENT], timestamp))
+        for document in documents:
+            self._output(json.dumps(document))
+        return documents
+
+    def _build_document(self, metrics, timestamp):
+        document = {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': self._namespace,
+                    'Dimensions': [sorted(self._dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit, value in metrics]
+                }]
+            }
+        }
+        document.update(self._dimensions)
+        document.update((name, value) for name, unit, value in metrics)
+        return document
@@ -1,61 +1,207 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-from lib import utils
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import itertools
+import logging
 from lib.processors.base import ResourceProcessor
+from lib.state import get_fingerprint
+
+logger = logging.getLogger(__name__)
 
 class AutoScalingGroupProcessor(ResourceProcessor):
-    def __init__(self, tag_prefix, asg_service, recurrence_calculator):
-        super().__init__(tag_prefix)
+    STATE_RESOURCE_TYPE = 'AutoScalingGroup'
+
+    def __init__(self, tag_prefix, asg_service, recurrence_calculator, max_workers=1, prefetch_threshold=None,
+                 state=None, metrics=None):
+        """Creates a new processor for Auto Scaling Groups.
+
+        Args:
+            tag_prefix: The prefix of the tags which configure the adjuster.
+            asg_service: The AutoScalingService used to access the ASGs.
+            recurrence_calculator: The RecurrenceCalculator used to compute
+                the correct recurrences.
+            max_workers: The maximum number of ASGs processed concurrently.
+                If 1 (the default), ASGs are processed one after another.
+            prefetch_threshold: The number of enabled ASGs from which all
+                scheduled actions in the account are retrieved in a single
+                sweep, instead of once per ASG. If None (the default), actions
+                are always retrieved once per ASG.
+            state: An optional ResourceState. If provided, ASGs whose tags
+                have not changed since they were last verified are skipped
+                without looking at their scheduled actions.
+            metrics: An optional MetricsCollector, which records how many
+                ASGs are evaluated, skipped, updated and failed.
+        """
+        super().__init__(tag_prefix, state, metrics)
         self._asg_service = asg_service
         self._recurrence_calculator = recurrence_calculator
+        self._max_workers = max(1, max_workers)
+        self._prefetch_threshold = prefetch_threshold
 
-    def process_resources(self):
-        changes = []
+    def process_resources(self, transition_window=None):
+        return list(self.iter_changes(transition_window))
 
-        asgs = self._asg_service.get_asgs()
-        for asg in asgs:
-            changes = changes + self._process_asg(asg)
+    def iter_changes(self, transition_window=None):
+        """Processes all ASGs, yielding changes as soon as they are made.
+
+        ASGs are consumed lazily from the service, so that the memory used
+        does not depend on the size of the fleet.
+
+        Args:
+            transition_window: An optional TransitionWindow. If provided,
+                ASGs whose timezone has no offset change within it are
+                skipped without looking at their scheduled actions.
+        """
+        self._start_run(transition_window)
+
+        asgs = self._asg_service.get_asgs(self._enabled_tag)
+        asgs, scheduled_actions = self._prefetch_scheduled_actions(asgs)
+
+        if self._max_workers == 1:
+            for asg in asgs:
+                yield from self._process_asg_isolated(asg, scheduled_actions)
+            return
 
-        return changes
+        yield from self._process_asgs_concurrently(asgs, scheduled_actions)
 
-    def _process_asg(self, asg):
+    def _prefetch_scheduled_actions(self, asgs):
+        """Retrieves the scheduled actions of all ASGs at once, if there are
+        enough enabled ASGs for a single account-wide sweep to be cheaper than
+        retrieving them once per ASG.
+
+        At most prefetch_threshold ASGs are read ahead to make the decision.
+
+        Returns:
+            A tuple with an iterable over all of the given ASGs, and a dict
+            mapping ASG names to their scheduled actions (or None, if the
+            actions must be retrieved once per ASG).
+        """
+        if self._prefetch_threshold is None:
+            return asgs, None
+
+        asgs = iter(asgs)
+        read_ahead = []
+        enabled_count = 0
+        for asg in asgs:
+            read_ahead.append(asg)
+            tags = self._index_tags(asg['Tags'])
+            if tags.get(self._enabled_tag) == None:
+                continue
+            timezone = tags.get(self._local_timezone_tag)
+            if self._transition_window is None or (timezone and self._transition_window.includes(timezone)):
+                enabled_count += 1
+                if enabled_count >= self._prefetch_threshold:
+                    break
+
+        asgs = itertools.chain(read_ahead, asgs)
+        if enabled_count < self._prefetch_threshold:
+            return asgs, None
+
+        logger.info("Prefetching scheduled actions for at least %d enabled ASGs", enabled_count)
+        return asgs, self._asg_service.get_all_scheduled_actions()
+
+    def _process_asgs_concurrently(self, asgs, scheduled_actions=None):
+        """Processes the given ASGs using a bounded pool of worker threads.
+
+        Changes are yielded in the same order as the ASGs were listed,
+        regardless of the order in which the workers complete. Only a bounded
+        number of ASGs are in flight at any given time.
+        """
+        max_in_flight = self._max_workers * 2
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            in_flight = collections.deque()
+
+            for asg in asgs:
+                in_flight.append(executor.submit(self._process_asg_isolated, asg, scheduled_actions))
+                if len(in_flight) >= max_in_flight:
+                    yield from in_flight.popleft().result()
+
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def _process_asg_isolated(self, asg, prefetched_scheduled_actions=None):
+        """Processes the given ASG, recording any error as a failure of the
+        ASG instead of raising it, so that a failure in one ASG does not
+        prevent the others from being processed. Failures can be retrieved
+        with get_failures().
+
+        Returns:
+            The changes made to the ASG. If some of its actions failed to
+            update, the changes of the actions which were updated are still
+            returned.
+        """
+        try:
+            return self._process_asg(asg, prefetched_scheduled_actions)
+        except Exception as e:
+            logger.warning("ASG '%s' failed to be processed: %s", asg['AutoScalingGroupName'], e)
+            self._add_failure(asg['AutoScalingGroupName'], e)
+            return []
+
+    def _process_asg(self, asg, prefetched_scheduled_actions=None):
         result = []
         asg_name = asg['AutoScalingGroupName']
 
-        print("Processing ASG '{}'".format(asg_name))
+        logger.debug("Processing ASG '%s'", asg_name)
 
-        if utils.get_tag_by_key(asg['Tags'], self._get_enabled_tag()) == None:
-            print("Skipping: ASG '{}' is not enabled (missing tag '{}')".format(asg_name,
-                                                                                self._get_enabled_tag()))
+        tags = self._index_tags(asg['Tags'])
+        if tags.get(self._enabled_tag) == None:
+            logger.debug("Skipping: ASG '%s' is not enabled (missing tag '%s')", asg_name, self._enabled_tag)
             return result
 
-        local_timezone = utils.get_tag_by_key(asg['Tags'], self._get_local_timezone_tag())
+        local_timezone = tags.get(self._local_timezone_tag)
         if not local_timezone:
-            print("Skipping: ASG '{}' has no timezone defined (missing tag '{}')".format(asg_name,
-                                                                                         self._get_local_timezone_tag()))
+            logger.debug("Skipping: ASG '%s' has no timezone defined (missing tag '%s')", asg_name,
+                         self._local_timezone_tag)
             return result
 
-        scheduled_actions = self._asg_service.get_asg_scheduled_actions(asg_name)
+        if self._is_outside_transition_window(local_timezone):
+            logger.debug("Skipping: ASG '%s' has no offset change in timezone '%s' since the last run or within the "
+                         "horizon", asg_name, local_timezone)
+            return result
+
+        # The scheduled actions are not known until they are retrieved, so
+        # only the tags are part of the fingerprint.
+        fingerprint = self._get_fingerprint(tags, local_timezone)
+        if self._is_unchanged(asg['AutoScalingGroupARN'], fingerprint, local_timezone):
+            logger.debug("Skipping: ASG '%s' has not changed since it was last verified", asg_name)
+            return result
+
+        self._count('Evaluated')
+        if prefetched_scheduled_actions is None:
+            scheduled_actions = self._asg_service.get_asg_scheduled_actions(asg_name)
+        else:
+            scheduled_actions = prefetched_scheduled_actions.get(asg_name, [])
         scheduled_action_updates = []
+        candidates = []
 
         for action in scheduled_actions:
             action_name = action['ScheduledActionName']
-            current_recurrence = action['Recurrence']
 
-            local_time_tag_key = self._get_local_time_tag() + ':' + action_name
-            local_time = utils.get_tag_by_key(asg['Tags'], local_time_tag_key)
+            local_time = tags.get_local_time(action_name)
             if not local_time:
-                print("Skipping: action '{}' does not have local time tag (missing tag '{}')".format(action_name, local_time_tag_key))
+                logger.debug("Skipping: action '%s' does not have local time tag (missing tag '%s')", action_name,
+                             self._local_time_tag_prefix + action_name)
                 continue
 
-            print("Processing action '{}'".format(action_name))
+            logger.debug("Processing action '%s'", action_name)
+            candidates.append((action, local_time))
+
+        # All actions of the ASG are calculated in a single batch.
+        correct_recurrences = self._recurrence_calculator.calculate_recurrences(
+            [(action['Recurrence'], local_time, local_timezone) for action, local_time in candidates])
 
-            correct_recurrence = self._recurrence_calculator.calculate_recurrence(current_recurrence,
-                                                                                  local_time,
-                                                                                  local_timezone)
+        for (action, local_time), correct_recurrence in zip(candidates, correct_recurrences):
+            if isinstance(correct_recurrence, Exception):
+                raise correct_recurrence
+
+            action_name = action['ScheduledActionName']
+            current_recurrence = action['Recurrence']
             if correct_recurrence != current_recurrence:
-                print("Calculated recurrence '{}' does not match current recurrence '{}'. This action will be updated.".format(correct_recurrence, current_recurrence))
+                logger.debug("Calculated recurrence '%s' does not match current recurrence '%s'. This action will be "
+                             "updated.", correct_recurrence, current_recurrence)
                 scheduled_action_updates.append({
                     'ScheduledActionName': action_name,
                     'Recurrence': correct_recurrence,
@@ -75,14 +221,35 @@ class AutoScalingGroupProcessor(ResourceProcessor):
                 })
 
         if not len(scheduled_action_updates):
-            print("No scheduled actions need to be updated for ASG '{}'".format(asg_name))
+            logger.debug("No scheduled actions need to be updated for ASG '%s'", asg_name)
         else:
-            print("There are actions which need to be updated. Updating them now.")
-            update_response = self._asg_service.update_asg_scheduled_actions(asg_name,
-                                                                            scheduled_action_updates)
-
-            if len(update_response['FailedScheduledUpdateGroupActions']):
-                print(update_response['FailedScheduledUpdateGroupActions'])
-                raise Exception('{} actions failed to update'.format(len(update_response['FailedScheduledUpdateGroupActions'])))
+            logger.debug("There are actions which need to be updated. Updating them now.")
+            outcomes = self._asg_service.put_scheduled_actions(asg_name, scheduled_action_updates)
+
+            failed_outcomes = [outcome for outcome in outcomes if not outcome.succeeded]
+            if failed_outcomes:
+                logger.warning("Actions of ASG '%s' failed to update: %s", asg_name,
+                               ', '.join("'{}' ({})".format(outcome.action_name, outcome.error_code)
+                                         for outcome in failed_outcomes))
+                self._add_failure(asg_name, '{} actions failed to update'.format(len(failed_outcomes)))
+                # The other actions of the ASG were updated, so their changes
+                # are still reported.
+                failed_names = set(outcome.action_name for outcome in failed_outcomes)
+                result = [change for change in result
+                          if change['AdditionalDetails']['ActionName'] not in failed_names]
+                # The ASG is not recorded as verified, so that it is evaluated
+                # again in the next run.
+                return result
+
+        if result:
+            self._count('Updated')
+        self._record_verified(asg['AutoScalingGroupARN'], fingerprint, local_timezone, correct_recurrences)
 
         return result
+
+    def _get_fingerprint(self, tags, local_timezone):
+        """Returns the fingerprint of the ASG, given the TagIndex of its
+        tags."""
+        local_times = sorted('{}{}={}'.format(self._local_time_tag_prefix, action_name, local_time)
+                             for action_name, local_time in tags.get_local_times().items())
+        return get_fingerprint(local_timezone, *local_times)
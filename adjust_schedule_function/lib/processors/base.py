@@ -1,23 +1,113 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import threading
+
+from lib import utils
+from lib.metrics import NullMetricsCollector
+
+
 class ResourceProcessor:
-    def __init__(self, tag_prefix):
+    # The type under which the state of the resources is stored, which also
+    # prefixes the names of their metrics (e.g., 'AutoScalingGroup.Updated').
+    STATE_RESOURCE_TYPE = None
+
+    def __init__(self, tag_prefix, state=None, metrics=None):
         self._tag_prefix = tag_prefix
+        # The keys of the tags which configure the adjuster, built once rather
+        # than on every lookup. The enabled tag, when present, determines
+        # whether a resource must be processed.
+        self._enabled_tag = '%s:%s' % (tag_prefix, 'enabled')
+        # The tag that specifies the timezone of the local time.
+        self._local_timezone_tag = '%s:%s' % (tag_prefix, 'local-timezone')
+        # The tag that specifies the local time at which scheduled events
+        # must run. Resources with several events (e.g., the scheduled
+        # actions of an ASG) have one per event, under this prefix.
+        self._local_time_tag = '%s:%s' % (tag_prefix, 'local-time')
+        self._local_time_tag_prefix = self._local_time_tag + ':'
+        self._state = state
+        self._metrics = metrics or NullMetricsCollector()
+        self._failures = []
+        self._failures_lock = threading.Lock()
+        self._skipped_count = 0
+        self._run_lock = threading.Lock()
+        self._timezones = set()
+        self._transition_window = None
 
-    def _get_enabled_tag(self):
-        """Returns the tag that, when present, determines whether a resource
-        must be processed.
-        """
-        return '%s:%s' % (self._tag_prefix, 'enabled')
+    def get_skipped_count(self):
+        """Returns the number of enabled resources which were skipped in the
+        last run because their timezone had no nearby offset change."""
+        return self._skipped_count
 
-    def _get_local_timezone_tag(self):
-        """Returns the tag that specifies the timezone of the local time.
-        """
-        return '%s:%s' % (self._tag_prefix, 'local-timezone')
+    def get_timezones(self):
+        """Returns the set of timezones used by the enabled resources seen in
+        the last run, including those which were skipped."""
+        return set(self._timezones)
+
+    def _start_run(self, transition_window):
+        self._failures = []
+        self._skipped_count = 0
+        self._timezones = set()
+        self._transition_window = transition_window
+        if self._state is not None:
+            self._state.load(self.STATE_RESOURCE_TYPE)
 
-    def _get_local_time_tag(self):
-        """Returns the tag that specifies the local time at which scheduled
-        events must run.
+    def _is_outside_transition_window(self, timezone):
+        """Returns whether resources in the given timezone can be skipped in
+        the current run, as their UTC offset has no nearby change. Skipped
+        resources are counted, and the timezones of all resources are
+        recorded."""
+        with self._run_lock:
+            self._timezones.add(timezone)
+        if self._transition_window is None or self._transition_window.includes(timezone):
+            return False
+        with self._run_lock:
+            self._skipped_count += 1
+        self._count('SkippedOutsideWindow')
+        return True
+
+    def _is_unchanged(self, resource_id, fingerprint, timezone):
+        """Returns whether the resource can be skipped in the current run, as
+        it has not changed since it was last verified. Always False if no
+        state is kept."""
+        if self._state is None:
+            return False
+        if not self._state.is_unchanged(self.STATE_RESOURCE_TYPE, resource_id, fingerprint, timezone):
+            return False
+        self._count('Unchanged')
+        return True
+
+    def _count(self, name, value=1):
+        """Adds the value to the metric of the resources with the given name
+        (e.g., 'Evaluated', 'Updated')."""
+        self._metrics.increment(self.STATE_RESOURCE_TYPE + '.' + name, value)
+
+    def _record_verified(self, resource_id, fingerprint, timezone, recurrences):
+        """Records that the resource has been verified with the given correct
+        recurrences, if state is kept."""
+        if self._state is None:
+            return
+        valid_until = None
+        for recurrence in recurrences:
+            recurrence_valid_until = self._recurrence_calculator.get_valid_until(recurrence, timezone)
+            if recurrence_valid_until is not None:
+                valid_until = min(valid_until or recurrence_valid_until, recurrence_valid_until)
+        self._state.record(self.STATE_RESOURCE_TYPE, resource_id, fingerprint, timezone, valid_until)
+
+    def get_failures(self):
+        """Returns the resources which failed to be processed, as a list of
+        dicts:
+
+            [{'ResourceName': 'Foo', 'Error': 'Something went wrong'}]
         """
-        return '%s:%s' % (self._tag_prefix, 'local-time')
+        return list(self._failures)
+
+    def _add_failure(self, resource_name, error):
+        with self._failures_lock:
+            self._failures.append({'ResourceName': resource_name, 'Error': str(error)})
+        self._count('Failed')
+
+    def _index_tags(self, tags):
+        """Returns a TagIndex of the given tags of a resource, with its local
+        time tags parsed by event name."""
+        return utils.TagIndex(tags, self._local_time_tag_prefix)
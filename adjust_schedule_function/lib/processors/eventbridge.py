@@ -1,68 +1,265 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-from lib import utils
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import logging
 from lib.processors.base import ResourceProcessor
+from lib.state import get_fingerprint
+
+logger = logging.getLogger(__name__)
 
 class EventBridgeProcessor(ResourceProcessor):
-    def __init__(self, tag_prefix, eventbridge_service, recurrence_calculator):
-        super().__init__(tag_prefix)
+    RESOURCE_TYPE = 'events:rule'
+    STATE_RESOURCE_TYPE = 'EventBridgeRule'
+    # The maximum number of rules whose recurrences are calculated together.
+    BATCH_SIZE = 500
+
+    def __init__(self, tag_prefix, eventbridge_service, recurrence_calculator, tagging_service=None, state=None,
+                 metrics=None, max_workers=1):
+        """Creates a new processor for EventBridge rules.
+
+        Args:
+            tag_prefix: The prefix of the tags which configure the adjuster.
+            eventbridge_service: The EventBridgeService used to access the
+                rules.
+            recurrence_calculator: The RecurrenceCalculator used to compute
+                the correct recurrences.
+            tagging_service: An optional TaggingService. If provided, the
+                tags of all enabled rules are retrieved in bulk, instead of
+                once per rule.
+            state: An optional ResourceState. If provided, rules whose
+                schedule and tags have not changed since they were last
+                verified are skipped without calculating their recurrence.
+            metrics: An optional MetricsCollector, which records how many
+                rules are evaluated, skipped, updated and failed.
+            max_workers: The maximum number of rules updated concurrently.
+                If 1 (the default), rules are updated one after another, as
+                they are evaluated. Otherwise, updates are queued to a pool
+                of workers, so that rules are still listed and evaluated
+                while earlier ones are being updated.
+        """
+        super().__init__(tag_prefix, state, metrics)
         self._eventbridge_service = eventbridge_service
         self._recurrence_calculator = recurrence_calculator
+        self._tagging_service = tagging_service
+        self._max_workers = max(1, max_workers)
+
+    def process_resources(self, transition_window=None):
+        return list(self.iter_changes(transition_window))
+
+    def iter_changes(self, transition_window=None):
+        """Processes all scheduled rules, yielding changes as soon as they are
+        made.
 
-    def process_resources(self):
-        changes = []
+        Rules are consumed lazily from the service, so that the memory used
+        does not depend on the number of rules. Changes are yielded in the
+        order in which the rules were listed, once their update has been
+        confirmed.
 
+        Args:
+            transition_window: An optional TransitionWindow. If provided,
+                rules whose timezone has no offset change within it are
+                skipped without calculating their recurrence.
+        """
+        self._start_run(transition_window)
         rules = self._eventbridge_service.get_scheduled_rules()
+        tags_by_arn = self._get_enabled_rule_tags()
+
+        if self._max_workers == 1:
+            yield from self._process_rules(rules, tags_by_arn)
+            return
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            yield from self._process_rules(rules, tags_by_arn, _WriteQueue(executor, self._max_workers * 4))
+
+    def _process_rules(self, rules, tags_by_arn, write_queue=None):
+        """Evaluates the rules in batches, and updates those whose recurrence
+        has changed, either inline or through the given _WriteQueue."""
+        candidates = []
 
         for rule in rules:
             try:
-                print("Processing EventBridge rule '{}'".format(rule['Name']))
-
-                tags = self._eventbridge_service.get_rule_tags(rule['Arn'])
-
-                if utils.get_tag_by_key(tags, self._get_enabled_tag()) == None:
-                    print("Skipping: EventBridge rule '{}' is not enabled (missing tag '{}')".format(rule['Name'],
-                                                                                                     self._get_enabled_tag()))
-                    continue
-
-                local_timezone = utils.get_tag_by_key(tags, self._get_local_timezone_tag())
-                local_time = utils.get_tag_by_key(tags, self._get_local_time_tag())
-
-                if not local_timezone:
-                    print("Skipping: EventBridge rule '{}' has no timezone defined (missing tag '{}')".format(rule['Name'],
-                                                                                                              self._get_local_timezone_tag()))
-                    continue
-
-                if not local_time:
-                    print("Skipping: EventBridge rule '{}' does not have local time tag (missing tag '{}')".format(rule['Name'],
-                                                                                                                   self._get_local_time_tag()))
-                    continue
-
-                # Remove the 'cron()' surrounding the cron expression itself,
-                # as the calculator does not expect it.
-                # (This should probably be transparent to the caller, and the
-                # calculator should handle it instead.)
-                current_recurrence = rule['ScheduleExpression'][5:][:-1]
-
-                new_recurrence = self._recurrence_calculator.calculate_recurrence(current_recurrence,
-                                                                                  local_time,
-                                                                                  local_timezone)
-                if new_recurrence != current_recurrence:
-                    print("Calculated recurrence '{}' does not match current recurrence '{}'. This rule will be updated.".format(new_recurrence, current_recurrence))
-                    self._eventbridge_service.update_rule_schedule(rule['Name'],
-                                                                   'cron(' + new_recurrence + ')')
-                    changes.append({
-                        'Type': 'EventBridgeRule',
-                        'ResourceName': rule['Name'],
-                        'ResourceArn': rule['Arn'],
-                        'OriginalRecurrence': current_recurrence,
-                        'NewRecurrence': new_recurrence,
-                        'LocalTime': local_time,
-                        'LocalTimezone': local_timezone
-                    })
-
+                candidate = self._get_candidate(rule, tags_by_arn)
             except Exception as e:
-                print("EventBridge rule failed to be processed: {}".format(str(e)))
+                logger.warning("EventBridge rule '%s' failed to be processed: %s", rule['Name'], e)
+                self._add_failure(rule['Name'], e)
+                continue
+
+            if candidate:
+                candidates.append(candidate)
+            if len(candidates) >= self.BATCH_SIZE:
+                yield from self._process_candidates(candidates, write_queue)
+                candidates = []
+
+        yield from self._process_candidates(candidates, write_queue)
+        if write_queue is not None:
+            yield from write_queue.drain()
+
+    def _get_candidate(self, rule, tags_by_arn):
+        """Returns a (rule, current recurrence, local time, local timezone)
+        tuple if the recurrence of the rule must be calculated, or None if the
+        rule must be skipped."""
+        logger.debug("Processing EventBridge rule '%s'", rule['Name'])
+
+        if tags_by_arn is None:
+            tags = self._eventbridge_service.get_rule_tags(rule['Arn'])
+        else:
+            tags = tags_by_arn.get(rule['Arn'], [])
+        tags = self._index_tags(tags)
+
+        if tags.get(self._enabled_tag) == None:
+            logger.debug("Skipping: EventBridge rule '%s' is not enabled (missing tag '%s')", rule['Name'],
+                         self._enabled_tag)
+            return None
+
+        local_timezone = tags.get(self._local_timezone_tag)
+        local_time = tags.get(self._local_time_tag)
+
+        if not local_timezone:
+            logger.debug("Skipping: EventBridge rule '%s' has no timezone defined (missing tag '%s')", rule['Name'],
+                         self._local_timezone_tag)
+            return None
+
+        if not local_time:
+            logger.debug("Skipping: EventBridge rule '%s' does not have local time tag (missing tag '%s')",
+                         rule['Name'], self._local_time_tag)
+            return None
+
+        if self._is_outside_transition_window(local_timezone):
+            logger.debug("Skipping: EventBridge rule '%s' has no offset change in timezone '%s' since the last run "
+                         "or within the horizon", rule['Name'], local_timezone)
+            return None
+
+        if self._is_unchanged(rule['Arn'], self._get_fingerprint(rule, local_time, local_timezone), local_timezone):
+            logger.debug("Skipping: EventBridge rule '%s' has not changed since it was last verified", rule['Name'])
+            return None
+
+        # Remove the 'cron()' surrounding the cron expression itself,
+        # as the calculator does not expect it.
+        # (This should probably be transparent to the caller, and the
+        # calculator should handle it instead.)
+        current_recurrence = rule['ScheduleExpression'][5:][:-1]
+
+        self._count('Evaluated')
+        return rule, current_recurrence, local_time, local_timezone
+
+    def _process_candidates(self, candidates, write_queue=None):
+        """Calculates the recurrences of the given candidates in a single
+        batch, and updates the rules whose recurrence has changed. If a
+        _WriteQueue is given, updates are queued to it, and the changes of
+        those which have completed so far are yielded."""
+        if not candidates:
+            return
+
+        new_recurrences = self._recurrence_calculator.calculate_recurrences(
+            [(current_recurrence, local_time, local_timezone)
+             for rule, current_recurrence, local_time, local_timezone in candidates])
+
+        for (rule, current_recurrence, local_time, local_timezone), new_recurrence in zip(candidates, new_recurrences):
+            if isinstance(new_recurrence, Exception):
+                logger.warning("EventBridge rule '%s' failed to be processed: %s", rule['Name'], new_recurrence)
+                self._add_failure(rule['Name'], new_recurrence)
+                continue
+
+            if new_recurrence == current_recurrence:
+                try:
+                    self._record_verified(rule['Arn'], self._get_fingerprint(rule, local_time, local_timezone),
+                                          local_timezone, [new_recurrence])
+                except Exception as e:
+                    logger.warning("EventBridge rule '%s' failed to be processed: %s", rule['Name'], e)
+                    self._add_failure(rule['Name'], e)
+                continue
+
+            logger.debug("Calculated recurrence '%s' does not match current recurrence '%s'. This rule will be "
+                         "updated.", new_recurrence, current_recurrence)
+            if write_queue is None:
+                change = self._update_rule(rule, current_recurrence, new_recurrence, local_time, local_timezone)
+                if change:
+                    yield change
+            else:
+                yield from write_queue.submit(self._update_rule, rule, current_recurrence, new_recurrence,
+                                              local_time, local_timezone)
+
+    def _update_rule(self, rule, current_recurrence, new_recurrence, local_time, local_timezone):
+        """Updates the schedule of the rule, recording any error as a failure
+        of the rule instead of raising it.
+
+        Returns:
+            The change made to the rule, or None if it failed to update.
+        """
+        try:
+            self._eventbridge_service.update_rule_schedule(rule['Name'], 'cron(' + new_recurrence + ')')
+        except Exception as e:
+            logger.warning("EventBridge rule '%s' failed to be processed: %s", rule['Name'], e)
+            self._add_failure(rule['Name'], e)
+            return None
+
+        self._count('Updated')
+        # The rule has been updated, so its change is reported even if it
+        # cannot be recorded.
+        try:
+            self._record_verified(rule['Arn'], self._get_fingerprint(rule, local_time, local_timezone, new_recurrence),
+                                  local_timezone, [new_recurrence])
+        except Exception as e:
+            logger.warning("EventBridge rule '%s' failed to be processed: %s", rule['Name'], e)
+            self._add_failure(rule['Name'], e)
+
+        return {
+            'Type': 'EventBridgeRule',
+            'ResourceName': rule['Name'],
+            'ResourceArn': rule['Arn'],
+            'OriginalRecurrence': current_recurrence,
+            'NewRecurrence': new_recurrence,
+            'LocalTime': local_time,
+            'LocalTimezone': local_timezone
+        }
+
+    def _get_enabled_rule_tags(self):
+        """Returns the tags of all enabled rules, as a dict indexed by rule
+        ARN, or None if they must be retrieved one rule at a time (i.e., no
+        tagging service is available, or the bulk retrieval failed).
+        """
+        if not self._tagging_service:
+            return None
+
+        try:
+            return self._tagging_service.get_resource_tags_by_tag_key(self.RESOURCE_TYPE,
+                                                                      self._enabled_tag)
+        except Exception as e:
+            logger.warning("Could not retrieve rule tags in bulk, falling back to retrieving them per rule: %s", e)
+            return None
+
+    def _get_fingerprint(self, rule, local_time, local_timezone, recurrence=None):
+        """Returns the fingerprint of the rule, given its local time tags.
+        If the rule has just been updated, its new recurrence is used
+        instead of the one it was listed with."""
+        schedule_expression = rule['ScheduleExpression'] if recurrence is None else 'cron(' + recurrence + ')'
+        return get_fingerprint(schedule_expression, local_time, local_timezone)
+
+
+class _WriteQueue:
+    """Queues updates to a pool of workers, with a bounded number of them in
+    flight, and returns their changes in the order in which they were
+    queued."""
+    def __init__(self, executor, max_in_flight):
+        self._executor = executor
+        self._max_in_flight = max_in_flight
+        self._in_flight = collections.deque()
+
+    def submit(self, update, *args):
+        """Queues the update, and yields the changes of the updates at the
+        head of the queue which have completed. Waits for the oldest one if
+        the queue is full."""
+        self._in_flight.append(self._executor.submit(update, *args))
+        while self._in_flight and (len(self._in_flight) > self._max_in_flight or self._in_flight[0].done()):
+            change = self._in_flight.popleft().result()
+            if change:
+                yield change
 
-        return changes
+    def drain(self):
+        """Waits for every queued update, and yields their changes."""
+        while self._in_flight:
+            change = self._in_flight.popleft().result()
+            if change:
+                yield change
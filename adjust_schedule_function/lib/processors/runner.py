@@ -0,0 +1,320 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from lib.metrics import NullMetricsCollector
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+ProcessorResult = namedtuple('ProcessorResult', ['processor_name', 'changes', 'skipped_count', 'failures', 'error'])
+
+
+class ProcessorRunner:
+    """Runs several resource processors concurrently.
+
+    Processors touch disjoint services and spend most of their time waiting
+    on the AWS APIs, so each one runs in its own thread. Their results are
+    returned in the order in which the processors were registered,
+    regardless of which one finishes first, and an error in one processor
+    does not prevent the others from completing.
+    """
+    def __init__(self, processors, max_workers=None, metrics=None):
+        """Initializes the runner.
+
+        Args:
+            processors: The list of ResourceProcessor objects to run.
+            max_workers: The maximum number of processors which run at the
+                same time. Defaults to running all of them at once; use 1
+                to run them one after another.
+            metrics: An optional MetricsCollector, which records the time
+                each processor takes ('<processor name>.Time').
+        """
+        self._processors = list(processors)
+        self._max_workers = max_workers or max(len(self._processors), 1)
+        self._metrics = metrics or NullMetricsCollector()
+
+    def get_processors(self):
+        return self._processors
+
+    def run(self, transition_window=None):
+        """Runs every processor.
+
+        Args:
+            transition_window: An optional TransitionWindow, passed on to
+                every processor.
+
+        Returns:
+            A list with a ProcessorResult for each processor, in the order
+            in which they were registered. Each result holds the resources
+            which failed to be processed (see
+            ResourceProcessor.get_failures()). If a processor fails as a
+            whole, its result also holds the error, along with the changes it
+            made before failing.
+        """
+        if self._max_workers == 1 or len(self._processors) <= 1:
+            return [self._run_processor(processor, transition_window) for processor in self._processors]
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = [executor.submit(self._run_processor, processor, transition_window)
+                       for processor in self._processors]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def merge_changes(results):
+        """Returns the changes of all results in a single list, keeping the
+        order of the results and of the changes within each of them."""
+        return [change for result in results for change in result.changes]
+
+    @staticmethod
+    def merge_failures(results):
+        """Returns the failures of all results in a single list, keeping the
+        order of the results."""
+        return [failure for result in results for failure in result.failures]
+
+    def _run_processor(self, processor, transition_window):
+        name = processor.__class__.__name__
+        logger.info("Using processor '%s'", name)
+
+        changes = []
+        error = None
+        try:
+            with self._metrics.timer(name + '.Time'):
+                for change in processor.iter_changes(transition_window):
+                    changes.append(change)
+        except Exception as e:
+            logger.error("Processor '%s' failed: %s", name, e, exc_info=True)
+            error = e
+
+        logger.info("Processor '%s' has completed", name)
+        return ProcessorResult(name, changes, processor.get_skipped_count(), processor.get_failures(), error)
+
+
+RegionResult = namedtuple('RegionResult', ['region', 'results', 'duration'])
+
+
+class MultiRegionRunner:
+    """Runs the processors of several regions concurrently.
+
+    Each region has its own ProcessorRunner, with its own clients and
+    services, so that a slow or failing region does not hold back the
+    others. Their results are returned in the order of the regions,
+    regardless of which one finishes first.
+    """
+    def __init__(self, runner_factory, regions, max_workers=None, clock=time.perf_counter):
+        """Initializes the runner.
+
+        Args:
+            runner_factory: A function which returns the ProcessorRunner of
+                the given region. It is called from the calling thread, for
+                every region and run, as boto3 clients cannot safely be
+                created concurrently; it should reuse the runners it creates.
+            regions: The list of region names. None stands for the region of
+                the function, whose changes and failures are not labelled.
+            max_workers: The maximum number of regions which are processed at
+                the same time. Defaults to processing all of them at once.
+            clock: A function which returns a monotonic time, in seconds.
+        """
+        self._runner_factory = runner_factory
+        self._regions = list(regions)
+        self._max_workers = max_workers or max(len(self._regions), 1)
+        self._clock = clock
+
+    def get_regions(self):
+        return self._regions
+
+    def get_processors(self):
+        """Returns the processors of every region."""
+        return [processor for region in self._regions for processor in self._runner_factory(region).get_processors()]
+
+    def run(self, transition_window=None):
+        """Runs the processors of every region.
+
+        Args:
+            transition_window: An optional TransitionWindow, passed on to
+                every processor.
+
+        Returns:
+            A list with a RegionResult for each region, in the order of the
+            regions, which holds the ProcessorResult of each of its
+            processors and the time the region took, in seconds.
+        """
+        runners = [(region, self._runner_factory(region)) for region in self._regions]
+        if self._max_workers == 1 or len(runners) <= 1:
+            return [self._run_region(region, runner, transition_window) for region, runner in runners]
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = [executor.submit(self._run_region, region, runner, transition_window)
+                       for region, runner in runners]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def merge_changes(region_results):
+        """Returns the changes of all regions in a single list, each labelled
+        with its 'Region' unless it is the region of the function."""
+        return [MultiRegionRunner._label(change, region_result.region)
+                for region_result in region_results
+                for change in ProcessorRunner.merge_changes(region_result.results)]
+
+    @staticmethod
+    def merge_failures(region_results):
+        """Returns the failures of all regions in a single list, each
+        labelled with its 'Region' unless it is the region of the function."""
+        return [MultiRegionRunner._label(failure, region_result.region)
+                for region_result in region_results
+                for failure in ProcessorRunner.merge_failures(region_result.results)]
+
+    @staticmethod
+    def summarize(region_results):
+        """Returns a summary of each region, indexed by region name, with the
+        number of updates, failed resources and skipped resources, the
+        processors which failed as a whole, and the time it took, in
+        milliseconds."""
+        return {
+            region_result.region: {
+                'UpdateCount': sum(len(result.changes) for result in region_result.results),
+                'FailureCount': sum(len(result.failures) for result in region_result.results),
+                'SkippedCount': sum(result.skipped_count for result in region_result.results),
+                'FailedProcessors': [result.processor_name for result in region_result.results
+                                     if result.error is not None],
+                'DurationMs': round(region_result.duration * 1000)
+            }
+            for region_result in region_results
+        }
+
+    @staticmethod
+    def _label(item, region):
+        if region is None:
+            return item
+        return dict(item, Region=region)
+
+    def _run_region(self, region, runner, transition_window):
+        if region is not None:
+            logger.info("Processing region '%s'", region)
+        start = self._clock()
+        results = runner.run(transition_window)
+        return RegionResult(region, results, self._clock() - start)
+
+
+AccountResult = namedtuple('AccountResult', ['account_id', 'region_results', 'duration', 'error'])
+
+
+class MultiAccountRunner:
+    """Runs the processors of several accounts concurrently, on a bounded
+    number of threads.
+
+    Each account has its own MultiRegionRunner, whose clients use the
+    credentials of a role in that account. An account whose runner cannot
+    be built (e.g., its role cannot be assumed) or fails as a whole does not
+    prevent the others from completing; its error is held in its result.
+    """
+    def __init__(self, runner_factory, accounts, max_workers=None, clock=time.perf_counter):
+        """Initializes the runner.
+
+        Args:
+            runner_factory: A function which returns the MultiRegionRunner of
+                the given Account. It is called from the thread which
+                processes the account, for every run, and should reuse the
+                runners it creates while their credentials remain valid.
+            accounts: The list of Account tuples.
+            max_workers: The maximum number of accounts which are processed
+                at the same time. Defaults to processing all of them at once.
+            clock: A function which returns a monotonic time, in seconds.
+        """
+        self._runner_factory = runner_factory
+        self._accounts = list(accounts)
+        self._max_workers = max_workers or max(len(self._accounts), 1)
+        self._clock = clock
+        self._runners = {}
+        self._lock = threading.Lock()
+
+    def get_accounts(self):
+        return self._accounts
+
+    def get_processors(self):
+        """Returns the processors of every account which was processed in the
+        last run."""
+        with self._lock:
+            runners = list(self._runners.values())
+        return [processor for runner in runners for processor in runner.get_processors()]
+
+    def run(self, transition_window=None):
+        """Runs the processors of every account.
+
+        Args:
+            transition_window: An optional TransitionWindow, passed on to
+                every processor.
+
+        Returns:
+            A list with an AccountResult for each account, in the order of
+            the accounts, which holds the RegionResult of each of its regions
+            (empty if the account failed before they ran), the time the
+            account took, in seconds, and the error which made it fail as a
+            whole, if any.
+        """
+        with self._lock:
+            self._runners = {}
+        if self._max_workers == 1 or len(self._accounts) <= 1:
+            return [self._run_account(account, transition_window) for account in self._accounts]
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = [executor.submit(self._run_account, account, transition_window) for account in self._accounts]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def merge_changes(account_results):
+        """Returns the changes of all accounts in a single list, each labelled
+        with its 'AccountId' (and its 'Region', if regions are given)."""
+        return [dict(change, AccountId=account_result.account_id)
+                for account_result in account_results
+                for change in MultiRegionRunner.merge_changes(account_result.region_results)]
+
+    @staticmethod
+    def merge_failures(account_results):
+        """Returns the failures of all accounts in a single list, each
+        labelled with its 'AccountId' (and its 'Region', if regions are
+        given)."""
+        return [dict(failure, AccountId=account_result.account_id)
+                for account_result in account_results
+                for failure in MultiRegionRunner.merge_failures(account_result.region_results)]
+
+    @staticmethod
+    def summarize(account_results):
+        """Returns a summary of each account, indexed by account ID, with the
+        number of updates, failed resources and skipped resources, the
+        processors which failed as a whole, the error which made the account
+        fail, if any, and the time it took, in milliseconds."""
+        summaries = {}
+        for account_result in account_results:
+            results = [result for region_result in account_result.region_results
+                       for result in region_result.results]
+            summaries[account_result.account_id] = {
+                'UpdateCount': sum(len(result.changes) for result in results),
+                'FailureCount': sum(len(result.failures) for result in results),
+                'SkippedCount': sum(result.skipped_count for result in results),
+                'FailedProcessors': [result.processor_name for result in results if result.error is not None],
+                'Error': str(account_result.error) if account_result.error is not None else None,
+                'DurationMs': round(account_result.duration * 1000)
+            }
+        return summaries
+
+    def _run_account(self, account, transition_window):
+        logger.info("Processing account '%s'", account.account_id)
+        start = self._clock()
+        region_results = []
+        error = None
+        try:
+            runner = self._runner_factory(account)
+            with self._lock:
+                self._runners[account.account_id] = runner
+            region_results = runner.run(transition_window)
+        except Exception as e:
+            logger.error("Account '%s' failed: %s", account.account_id, e, exc_info=True)
+            error = e
+        duration = self._clock() - start
+        logger.info("Account '%s' has completed in %.3f seconds", account.account_id, duration)
+        return AccountResult(account.account_id, region_results, duration, error)
@@ -0,0 +1,303 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import collections
+import logging
+import threading
+import time
+
+from lib.metrics import NullMetricsCollector
+
+logger = logging.getLogger(__name__)
+
+
+# Error codes with which AWS APIs report that a caller is being throttled.
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'SlowDown',
+])
+
+
+def is_throttling_error(error):
+    """Returns whether the exception is an AWS throttling error (i.e., a
+    botocore ClientError with one of the THROTTLING_ERROR_CODES)."""
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """A token bucket which paces calls to the given rate, allowing bursts of
+    up to a second's worth of calls. A bucket without a rate lets every call
+    through, but keeps track of how many calls it let through in the last
+    second.
+
+    The bucket is safe to use from several threads: each caller reserves a
+    token under a lock and then waits, outside of it, until the token is due.
+    """
+    def __init__(self, rate=None, clock=time.monotonic, sleep=time.sleep):
+        self._rate = float(rate) if rate else None
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self._get_capacity()
+        self._updated = clock()
+        self._recent_calls = collections.deque()
+        self._lock = threading.Lock()
+
+    def get_rate(self):
+        """Returns the rate of the bucket, in tokens per second, or None if it
+        does not pace calls."""
+        return self._rate
+
+    def get_recent_rate(self):
+        """Returns how many calls went through the bucket in the last
+        second."""
+        with self._lock:
+            self._forget_old_calls(self._clock())
+            return len(self._recent_calls)
+
+    def set_rate(self, rate):
+        """Changes the rate of the bucket, in tokens per second."""
+        with self._lock:
+            self._refill()
+            self._rate = float(rate)
+            self._tokens = min(self._tokens, self._get_capacity())
+
+    def drain(self):
+        """Empties the bucket, so that the next call waits for a new token."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0)
+
+    def acquire(self):
+        """Takes a token from the bucket, waiting until one is available."""
+        with self._lock:
+            now = self._clock()
+            self._forget_old_calls(now)
+            self._recent_calls.append(now)
+            if self._rate is None:
+                return
+            self._refill()
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            self._sleep(wait)
+
+    def _forget_old_calls(self, now):
+        while self._recent_calls and self._recent_calls[0] <= now - 1:
+            self._recent_calls.popleft()
+
+    def _get_capacity(self):
+        return max(1.0, self._rate) if self._rate else 0.0
+
+    def _refill(self):
+        now = self._clock()
+        if self._rate is not None:
+            self._tokens = min(self._get_capacity(), self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class AdaptiveRateLimiter:
+    """Paces the calls to AWS APIs with a token bucket for each operation,
+    and adapts the rate of each bucket to the throttling limits of the
+    account.
+
+    Operations are not paced until one of their calls is throttled. The
+    bucket then starts at a fraction (decrease_factor) of the rate at which
+    calls were being made. From then on, the rate grows by increase_rate
+    calls per second for every second without throttles, and shrinks by
+    decrease_factor on every throttle. Throttled calls are retried once the
+    bucket allows it, up to max_retries times.
+
+    A single limiter is meant to be shared by all services and the event
+    bus, so that every call to the same operation goes through the same
+    bucket. As every API call goes through it, the limiter also records how
+    many calls are made to each operation, how long they take and how many
+    are throttled.
+    """
+    DEFAULT_MIN_RATE = 0.5
+    DEFAULT_MAX_RATE = 1000
+    DEFAULT_INCREASE_RATE = 2
+    DEFAULT_DECREASE_FACTOR = 0.7
+    DEFAULT_MAX_RETRIES = 8
+
+    def __init__(self, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE, increase_rate=DEFAULT_INCREASE_RATE,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, max_retries=DEFAULT_MAX_RETRIES, clock=time.monotonic,
+                 sleep=time.sleep, metrics=None):
+        """Initializes the limiter.
+
+        Args:
+            min_rate: The lowest rate an operation can be slowed down to, in
+                calls per second.
+            max_rate: The highest rate a paced operation can be sped up to.
+            increase_rate: How many calls per second the rate of a paced
+                operation grows by, per second without throttles.
+            decrease_factor: The factor by which the rate of an operation is
+                multiplied when one of its calls is throttled.
+            max_retries: How many times a throttled call is retried before
+                its error is raised.
+            clock: A function which returns the current time, in seconds.
+            sleep: A function which waits for the given number of seconds.
+            metrics: An optional MetricsCollector, which records the
+                '<operation>.Calls', '<operation>.Time' and
+                '<operation>.Throttles' of every operation.
+        """
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase_rate = increase_rate
+        self._decrease_factor = decrease_factor
+        self._max_retries = max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._metrics = metrics or NullMetricsCollector()
+        self._buckets = {}
+        self._last_adjustments = {}
+        self._throttle_counts = {}
+        self._lock = threading.Lock()
+
+    def get_rate(self, operation_name):
+        """Returns the current rate of the operation, in calls per second, or
+        None if it is not paced."""
+        return self._get_bucket(operation_name).get_rate()
+
+    def get_throttle_count(self, operation_name=None):
+        """Returns how many calls to the operation (or to any operation, if
+        not given) have been throttled."""
+        with self._lock:
+            if operation_name is None:
+                return sum(self._throttle_counts.values())
+            return self._throttle_counts.get(operation_name, 0)
+
+    def call(self, operation_name, function, *args, **kwargs):
+        """Calls the function once a token of the operation is available,
+        retrying it if it is throttled.
+
+        Args:
+            operation_name: The name of the API operation (e.g., 'put_rule').
+            function: The function which calls the operation.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Any error raised by the function, including throttling errors
+            once max_retries has been exhausted.
+        """
+        attempt = 0
+        while True:
+            self._get_bucket(operation_name).acquire()
+            self._metrics.increment(operation_name + '.Calls')
+            try:
+                with self._metrics.timer(operation_name + '.Time'):
+                    result = function(*args, **kwargs)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= self._max_retries:
+                    raise
+                self._on_throttle(operation_name)
+                attempt += 1
+                continue
+            self._on_success(operation_name)
+            return result
+
+    def paginate(self, operation_name, paginator, token_key, **params):
+        """Iterates over the pages of a paginated operation, taking a token
+        for every page.
+
+        If a page is throttled, pagination resumes from the last page that
+        was received.
+
+        Args:
+            operation_name: The name of the API operation (e.g.,
+                'list_rules').
+            paginator: The boto3 paginator of the operation.
+            token_key: The key under which pages hold the token of the next
+                page (e.g., 'NextToken').
+            params: The parameters to pass to the paginator.
+
+        Returns:
+            A generator of pages.
+        """
+        pages = iter(paginator.paginate(**params))
+        attempt = 0
+        last_token = None
+        while True:
+            self._get_bucket(operation_name).acquire()
+            try:
+                with self._metrics.timer(operation_name + '.Time'):
+                    page = next(pages)
+            except StopIteration:
+                return
+            except Exception as e:
+                if not is_throttling_error(e) or attempt >= self._max_retries:
+                    raise
+                self._on_throttle(operation_name)
+                attempt += 1
+                pages = iter(paginator.paginate(**self._resume(params, last_token)))
+                continue
+
+            self._metrics.increment(operation_name + '.Calls')
+            self._on_success(operation_name)
+            attempt = 0
+            last_token = page.get(token_key)
+            yield page
+
+    def _resume(self, params, token):
+        if token is None:
+            return params
+        resumed = dict(params)
+        resumed['PaginationConfig'] = dict(params.get('PaginationConfig') or {}, StartingToken=token)
+        return resumed
+
+    def _get_bucket(self, operation_name):
+        bucket = self._buckets.get(operation_name)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(operation_name)
+                if bucket is None:
+                    bucket = TokenBucket(None, self._clock, self._sleep)
+                    self._buckets[operation_name] = bucket
+        return bucket
+
+    def _on_success(self, operation_name):
+        bucket = self._get_bucket(operation_name)
+        rate = bucket.get_rate()
+        if rate is None or rate >= self._max_rate:
+            return
+        now = self._clock()
+        with self._lock:
+            elapsed = now - self._last_adjustments.get(operation_name, now)
+            self._last_adjustments[operation_name] = now
+        if elapsed > 0:
+            bucket.set_rate(min(self._max_rate, rate + self._increase_rate * elapsed))
+
+    def _on_throttle(self, operation_name):
+        bucket = self._get_bucket(operation_name)
+        rate = bucket.get_rate()
+        if rate is None:
+            rate = bucket.get_recent_rate()
+        bucket.set_rate(max(self._min_rate, rate * self._decrease_factor))
+        bucket.drain()
+        with self._lock:
+            self._last_adjustments[operation_name] = self._clock()
+            self._throttle_counts[operation_name] = self._throttle_counts.get(operation_name, 0) + 1
+        self._metrics.increment(operation_name + '.Throttles')
+        logger.warning("Call to '%s' was throttled. Slowing down to %.2f calls per second.", operation_name,
+                       bucket.get_rate())
+
+
+class UnlimitedRateLimiter:
+    """A rate limiter which neither paces nor retries calls. It is used by
+    services which are not given a limiter."""
+    def call(self, operation_name, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    def paginate(self, operation_name, paginator, token_key, **params):
+        return iter(paginator.paginate(**params))
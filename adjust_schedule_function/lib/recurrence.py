@@ -1,47 +1,78 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-from crontab import CronTab
-from dateutil import parser
+from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
-import pytz
+from lib import timezones
+from lib.cron import compile_cron_expression
+from lib.metrics import NullMetricsCollector
+import functools
+import logging
 import re
+import threading
 
+logger = logging.getLogger(__name__)
 
-def parse_cron_expression(expression):
-    pattern = r'^([^\s]+)\s+([^\s]+)((?:\s+[^\s]+){3,4})$'
-    match = re.match(pattern, expression)
 
-    if not match:
-        raise Exception("String '{}' is not a valid cron expression".format(expression))
+@functools.lru_cache(maxsize=1024)
+def parse_local_times(expected_time):
+    """Parses the expected local time(s) of a recurrence.
 
-    return {
-        'minute': match.group(1),
-        'hour': match.group(2),
-        'rest': match.group(3).strip()
-    }
+    Args:
+        expected_time: A string with a local time (e.g., '08:00'), or with
+            several of them separated by commas (e.g., '08:00,12:00,18:00').
+
+    Returns:
+        A tuple with the minutes of the day of each local time, in the given
+        order.
+    """
+    result = []
+    for part in expected_time.split(','):
+        match = re.match(r'^\s*(\d{1,2}):(\d{2})\s*$', part)
+        if match:
+            result.append(int(match.group(1)) * 60 + int(match.group(2)))
+        else:
+            # Other formats (e.g., '6pm') are rare, so dateutil is only
+            # imported when one shows up.
+            from dateutil import parser
+            parsed = parser.parse(part)
+            result.append(parsed.hour * 60 + parsed.minute)
+    return tuple(result)
 
 
 class TimeSource:
     """A time source that uses the standard datetime module."""
     def get_current_utc_datetime(self):
-        return pytz.utc.localize(datetime.utcnow())
+        return datetime.now(timezones.UTC)
 
 
 class RecurrenceCalculator:
     """A recurrence calculator for scheduled events.
     """
-    def __init__(self, time_source=None):
+    def __init__(self, time_source=None, metrics=None):
+        """Initializes the calculator.
+
+        Args:
+            time_source: The time source used to tell the current time.
+            metrics: An optional MetricsCollector, which records how many
+                recurrences are calculated in batches ('Recurrences.Calculated')
+                and the time spent on them ('Recurrences.Time').
+        """
         if not time_source:
             self._time_source = TimeSource()
         else:
             self._time_source = time_source
+        self._metrics = metrics or NullMetricsCollector()
 
     def calculate_recurrence(self, current_recurrence, expected_time, timezone, start_time=None):
         """Calculates the correct recurrence expression for the given
         recurrence, expected local time and local timezone.
 
-        The recurrence must be defined as a cron expression.
+        The recurrence must be defined as a cron expression. Its hours and
+        minutes may be lists, ranges or steps (e.g., '*/30 9-17 * * *'): all
+        of its runs are shifted by the same amount, so that they happen at
+        the expected local times. If runs move to another day in UTC, the
+        weekdays of the expression are shifted too.
 
         If the recurrence is not selective on the hour, or if the start date
         will occur in more than a day in the future, this method will return
@@ -51,7 +82,10 @@ class RecurrenceCalculator:
             current_recurrence: A string with the current recurrence, as a cron
                 expression (e..g, '0 0 * * *')
             expected_time: A string with the local time at which the action is
-                expected to run.
+                expected to run. For recurrences which run several times a
+                day, it can list the local time of every run, separated by
+                commas (e.g., '08:00,12:00,18:00'); a single local time is
+                matched to the run that is closest to it.
             timezone: The name of the timezone (e.g., 'Europe/Madrid') of the
                 local time.
             start_date: A datetime object with the start date and time of the
@@ -62,68 +96,346 @@ class RecurrenceCalculator:
             expression.
 
         Raises:
-            NotImplementedError: The original recurrence contains anything
-            other than single hours or minutes (e.g., ranges). These are
-            currently not supported by this implementation."""
+            NotImplementedError: The shifted runs cannot be expressed as a
+                single cron expression (e.g., a 30 minute shift of
+                '0,30 6-7 * * *', or a run that moves to another day of the
+                month).
+            ValueError: The expected local times are not a shift of the runs
+                of the recurrence."""
 
-        parsed_recurrence = parse_cron_expression(current_recurrence)
+        utc_now = self._time_source.get_current_utc_datetime()
 
-        # For the time being, we don't handle cron expressions which specify
-        # anything but a specific hour and minute (i.e., ranges, multiple
-        # hours, etc.). This is a feature that will be implemented in the
-        # future.
-        if not re.match(r'^\d+$', parsed_recurrence['hour']):
-            raise NotImplementedError("This script cannot yet handle multiple hours in cron expressions: '{}'".format(current_recurrence))
-        if not re.match(r'^\d+$', parsed_recurrence['minute']):
-            raise NotImplementedError("This script cannot yet handle multiple minutes in cron expressions: '{}'".format(current_recurrence))
+        return self._calculate_recurrence_at(current_recurrence, expected_time, timezone,
+                                             start_time, utc_now)[0]
 
-        # If the cron expression is not selective on the hour, it does not make
-        # sense to keep going.
-        if parsed_recurrence['hour'] == '*':
-            print("Recurrence's cron expression ('{}') is not selective on the hour. Leaving recurrence as is.".format(current_recurrence))
-            return current_recurrence
+    def calculate_recurrences(self, batch):
+        """Calculates the correct recurrences for a batch of inputs at once.
 
+        This is equivalent to calling calculate_recurrence for each input, but
+        the inputs are grouped by timezone, so that UTC offsets are looked up
+        once per timezone, and each distinct recurrence and local time is
+        parsed once.
+
+        Args:
+            batch: A list of (current_recurrence, expected_time, timezone)
+                tuples, with the same meaning as the arguments of
+                calculate_recurrence.
+
+        Returns:
+            A list with the correct recurrence of each input, in the same
+            order. If the recurrence of an input cannot be calculated, the
+            exception that calculate_recurrence would raise is returned in its
+            place, so that it does not prevent the rest of the batch from
+            being calculated.
+        """
         utc_now = self._time_source.get_current_utc_datetime()
+        return [result for result, utc_next_run in self._calculate_recurrences_at(batch, utc_now)]
+
+    def _calculate_recurrences_at(self, batch, utc_now):
+        """Calculates the correct recurrences of a batch of inputs as seen at
+        the given instant, recording the time it takes.
+
+        Returns:
+            A list of tuples with the correct recurrence (or the exception
+            raised when calculating it) and the UTC datetime of the next run
+            that it was calculated for.
+        """
+        self._metrics.increment('Recurrences.Calculated', len(batch))
+        with self._metrics.timer('Recurrences.Time'):
+            return self._calculate_batch_at(batch, utc_now)
+
+    def _calculate_batch_at(self, batch, utc_now):
+        results = [None] * len(batch)
+        indexes_by_timezone = {}
+        for index, (current_recurrence, expected_time, timezone) in enumerate(batch):
+            indexes_by_timezone.setdefault(timezone, []).append(index)
+
+        next_runs = {}
+
+        for timezone, indexes in indexes_by_timezone.items():
+            try:
+                periods = timezones.get_offset_periods(timezone, utc_now)
+            except Exception as e:
+                periods = e
+
+            for index in indexes:
+                current_recurrence, expected_time, timezone = batch[index]
+                try:
+                    results[index] = self._calculate_batched_recurrence(current_recurrence, expected_time,
+                                                                        timezone, periods, utc_now,
+                                                                        next_runs)
+                except Exception as e:
+                    results[index] = (e, None)
+
+        logger.debug("Calculated %d recurrences across %d timezones", len(batch), len(indexes_by_timezone))
+        return results
+
+    def _calculate_batched_recurrence(self, current_recurrence, expected_time, timezone, periods,
+                                      utc_now, next_runs):
+        if current_recurrence not in next_runs:
+            try:
+                expression = compile_cron_expression(current_recurrence)
+                utc_next_run = None
+                if expression.hour != '*':
+                    utc_next_run = self._get_next_run(current_recurrence, utc_now)
+                next_runs[current_recurrence] = (expression, utc_next_run)
+            except Exception as e:
+                next_runs[current_recurrence] = e
+        next_run = next_runs[current_recurrence]
+        if isinstance(next_run, Exception):
+            raise next_run
+        expression, utc_next_run = next_run
+        if utc_next_run is None:
+            return current_recurrence, None
+        if isinstance(periods, Exception):
+            raise periods
+
+        naive_utc_next_run = timezones.to_naive_utc(utc_next_run)
+        for period_offset, period_end in periods:
+            if period_end is None or naive_utc_next_run < period_end:
+                return self._shift_recurrence(expression, expected_time, period_offset), utc_next_run
+
+        # The next run is too far away for the offsets that were looked up, so
+        # calculate it on its own.
+        return self._calculate_recurrence_at(current_recurrence, expected_time, timezone, None, utc_now)
+
+    def _shift_recurrence(self, expression, expected_time, offset):
+        """Returns the recurrence which runs at the expected local times,
+        given the UTC offset (as a timedelta) of the timezone at its next
+        run. If it already does, the current recurrence is returned as is."""
+        offset_minutes = int(offset.total_seconds()) // 60
+        expected_times = parse_local_times(expected_time)
+        if len(expression.times) == 1 and len(expected_times) == 1:
+            delta = (expected_times[0] - expression.times[0] - offset_minutes + 720) % 1440 - 720
+            return expression.shift(delta) if delta else expression.expression
+
+        local_times = [(time + offset_minutes) % 1440 for time in expression.times]
+        # Runs are matched to the closest expected time, so that a run that
+        # drifts past midnight is moved back to its day.
+        deltas = sorted({(expected_times[0] - local_time + 720) % 1440 - 720 for local_time in local_times},
+                        key=lambda delta: (abs(delta), delta))
+        if len(expected_times) == 1:
+            delta = deltas[0]
+        else:
+            matching = [delta for delta in deltas
+                        if {(local_time + delta) % 1440 for local_time in local_times} == set(expected_times)]
+            if not matching:
+                raise ValueError("Local times '{}' are not a shift of the runs of recurrence '{}'".format(expected_time, expression.expression))
+            delta = matching[0]
+
+        if delta == 0:
+            return expression.expression
+        return expression.shift(delta)
+
+    def _get_next_run(self, current_recurrence, utc_now):
+        """Returns the UTC datetime of the next run of the recurrence after
+        the given instant."""
+        utc_next_run = compile_cron_expression(current_recurrence).get_next_run(utc_now)
+        if utc_next_run is None:
+            raise ValueError("Recurrence '{}' will not run again".format(current_recurrence))
+        return utc_next_run
+
+    def _calculate_recurrence_at(self, current_recurrence, expected_time, timezone, start_time,
+                                 utc_now):
+        """Calculates the correct recurrence as seen at the given instant.
+
+        Returns:
+            A tuple with the correct recurrence and the UTC datetime of the
+            next run that it was calculated for (or None, if the recurrence
+            was left as is without looking at the next run).
+        """
+        expression = compile_cron_expression(current_recurrence)
+
+        # If the cron expression is not selective on the hour, it does not make
+        # sense to keep going.
+        if expression.hour == '*':
+            logger.debug("Recurrence's cron expression ('%s') is not selective on the hour. Leaving recurrence as "
+                         "is.", current_recurrence)
+            return current_recurrence, None
 
         # If the start date is over a day in the future, skip it. (We need to
         # reevaluate whether this logic belongs to this class.)
         if start_time and (start_time - utc_now).days > 1:
-            print("Start date is over a day away. Leaving recurrence as is.")
-            return current_recurrence
+            logger.debug("Start date is over a day away. Leaving recurrence as is.")
+            return current_recurrence, None
 
         # Determine when the event will run next, and compare the time with the
         # expected local time at the specified timezone. If they match, then
         # we're all good. If they don't, we need to update the recurrence.
-        #
-        # Note that we're adding one extra second to the time delta, to account
-        # for precision errors which might produce incorrect results. (See for
-        # example when the expected time is 14:00:00 and the delta causes us to
-        # see 13:59:59.998). This is pretty hacky and I should revisit this,
-        # for sure.
-
-        recurrence = CronTab(current_recurrence)
-        delta = timedelta(seconds = recurrence.next(default_utc=True) + 1)
-        utc_next_run = utc_now + delta
-        local_next_run = utc_next_run.astimezone(pytz.timezone(timezone))
-        local_next_run_time = local_next_run.strftime('%H:%M')
-
-        print("This event should run at '{}' local time. The next run will occur at '{}', which is '{}' at specified local timezone '{}'.".format(expected_time, utc_next_run.isoformat(), local_next_run_time, timezone))
-
-        if local_next_run_time == expected_time:
-            print("Times match. Current recurrence is correct.")
-            return current_recurrence
-
-        print("Times don't match. Current recurrence must be recalculated.")
-        local_expected_run = local_next_run.replace(hour=parser.parse(expected_time).hour,
-                                                    minute=parser.parse(expected_time).minute)
-        utc_expected_run = local_expected_run.astimezone(pytz.timezone('UTC'))
+        utc_next_run = self._get_next_run(current_recurrence, utc_now)
+        offset = timezones.get_utc_offset(timezone, utc_next_run)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            local_next_run_time = (timezones.to_naive_utc(utc_next_run) + offset).strftime('%H:%M')
+            logger.debug("This event should run at '%s' local time. The next run will occur at '%s', which is '%s' "
+                         "at specified local timezone '%s'.", expected_time, utc_next_run.isoformat(),
+                         local_next_run_time, timezone)
 
         # We should only change the hour and minute parts of the cron
-        # expression. The rest should be left as it was originally. The reason
-        # we're changing the minutes too is because some timezones don't have
-        # whole offsets. E.g., see "Indian Standard Time".
-        new_recurrence = '{} {} {}'.format(utc_expected_run.minute,
-                                           utc_expected_run.hour,
-                                           parsed_recurrence['rest'])
-
-        return new_recurrence
+        # expression, and the weekdays if runs move to another day. The
+        # reason we're changing the minutes too is because some timezones
+        # don't have whole offsets. E.g., see "Indian Standard Time".
+        new_recurrence = self._shift_recurrence(expression, expected_time, offset)
+        if new_recurrence == current_recurrence:
+            logger.debug("Times match. Current recurrence is correct.")
+        else:
+            logger.debug("Times don't match. Current recurrence must be recalculated.")
+
+        return new_recurrence, utc_next_run
+
+
+    def get_valid_until(self, recurrence, timezone):
+        """Returns the instant until which the given recurrence remains
+        correct for the timezone, provided it is correct now.
+
+        Args:
+            recurrence: A cron expression, as returned by
+                calculate_recurrence.
+            timezone: The local timezone of the recurrence.
+
+        Returns:
+            A naive datetime in UTC, or None if the recurrence remains correct
+            indefinitely (i.e., the offset of the timezone never changes
+            again, or the recurrence never runs again).
+
+        Raises:
+            ValueError: The recurrence is not a valid cron expression.
+        """
+        utc_now = self._time_source.get_current_utc_datetime()
+        utc_next_run = compile_cron_expression(recurrence).get_next_run(utc_now)
+        if utc_next_run is None:
+            return None
+        return self._get_expiry(recurrence, timezone, timezones.to_naive_utc(utc_next_run))
+
+    def _get_expiry(self, current_recurrence, timezone, utc_next_run):
+        """Returns the instant until which a result calculated for the given
+        next run remains valid.
+
+        Until the next run, it is the next run which is looked at, so the
+        result cannot change. After it, every run happens at most max_gap
+        after the current time, so the offset at the next run stays the same
+        until max_gap before the following offset transition.
+        """
+        max_gap = self._get_max_gap(compile_cron_expression(current_recurrence))
+        if max_gap is None:
+            return utc_next_run
+
+        transition = timezones.get_next_transition(timezone, utc_next_run)
+        if transition is None:
+            return None
+
+        return max(utc_next_run, transition - max_gap)
+
+    def _get_max_gap(self, expression):
+        """Returns the longest possible time between two runs of a recurrence,
+        or None if it is longer than a week."""
+        if expression.runs_every_day():
+            return timedelta(days=1)
+        if expression.runs_every_week():
+            return timedelta(days=7)
+        return None
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class CachingRecurrenceCalculator(RecurrenceCalculator):
+    """A recurrence calculator which memoizes its results in a bounded LRU
+    cache.
+
+    Results are keyed on the current recurrence, the expected local time and
+    the timezone. Each result remains valid for as long as the UTC offset of
+    the timezone at the next run cannot have changed: until the next run
+    itself or, for recurrences which run at least once a week, until shortly
+    before the next offset transition after it. Calculations which specify a
+    start time are not cached.
+
+    The calculator is safe to use from several threads. Given a
+    MetricsCollector, it also records its 'RecurrenceCache.Hits' and
+    'RecurrenceCache.Misses'.
+    """
+    DEFAULT_MAXSIZE = 1024
+
+    def __init__(self, time_source=None, maxsize=DEFAULT_MAXSIZE, metrics=None):
+        super().__init__(time_source, metrics)
+        self._maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def cache_info(self):
+        """Returns the hit and miss counters and the size of the cache."""
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._maxsize, len(self._cache))
+
+    def cache_clear(self):
+        """Empties the cache and resets its counters."""
+        with self._lock:
+            self._cache.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def calculate_recurrence(self, current_recurrence, expected_time, timezone, start_time=None):
+        if start_time:
+            return super().calculate_recurrence(current_recurrence, expected_time, timezone, start_time)
+
+        utc_now = self._time_source.get_current_utc_datetime()
+        key = (current_recurrence, expected_time, timezone)
+
+        hit, result = self._get_cached(key, utc_now)
+        if hit:
+            return result
+
+        result, utc_next_run = self._calculate_recurrence_at(current_recurrence, expected_time,
+                                                             timezone, None, utc_now)
+        self._put_cached(key, result, utc_next_run)
+
+        return result
+
+    def calculate_recurrences(self, batch):
+        utc_now = self._time_source.get_current_utc_datetime()
+        results = [None] * len(batch)
+        misses = []
+
+        for index, item in enumerate(batch):
+            hit, result = self._get_cached(tuple(item), utc_now)
+            if hit:
+                results[index] = result
+            else:
+                misses.append(index)
+
+        if misses:
+            calculated = self._calculate_recurrences_at([batch[index] for index in misses], utc_now)
+            for index, (result, utc_next_run) in zip(misses, calculated):
+                results[index] = result
+                if not isinstance(result, Exception):
+                    self._put_cached(tuple(batch[index]), result, utc_next_run)
+
+        return results
+
+    def _get_cached(self, key, utc_now):
+        """Returns a tuple with whether there is a valid cached result for the
+        key at the given instant, and the result itself."""
+        naive_utc_now = timezones.to_naive_utc(utc_now)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and (entry[1] is None or naive_utc_now < entry[1]):
+                self._cache.move_to_end(key)
+                self._hits += 1
+                self._metrics.increment('RecurrenceCache.Hits')
+                return True, entry[0]
+            self._misses += 1
+            self._metrics.increment('RecurrenceCache.Misses')
+            return False, None
+
+    def _put_cached(self, key, result, utc_next_run):
+        expiry = None
+        if utc_next_run is not None:
+            expiry = self._get_expiry(key[0], key[2], timezones.to_naive_utc(utc_next_run))
+
+        with self._lock:
+            self._cache[key] = (result, expiry)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
@@ -1,60 +1,194 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-import boto3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from lib.ratelimit import UnlimitedRateLimiter
+import time
+
+
+def _create_client(service_name):
+    # boto3 takes a large share of the cold start time, so it is only
+    # imported when a service has to create its own client.
+    import boto3
+    return boto3.client(service_name)
+
+
+ScheduledActionUpdateOutcome = namedtuple('ScheduledActionUpdateOutcome',
+                                          ['action_name', 'succeeded', 'error_code', 'error_message', 'attempts'])
 
 
 class AutoScalingService:
-    def __init__(self, client=None):
+    MAX_SCHEDULED_ACTIONS_PAGE_SIZE = 100
+    # batch_put_scheduled_update_group_action accepts at most 50 actions per
+    # call.
+    MAX_SCHEDULED_ACTIONS_PER_UPDATE = 50
+    MAX_CONCURRENT_UPDATES = 4
+    MAX_UPDATE_ATTEMPTS = 3
+    RETRY_DELAY = 0.1
+    # The error codes of failed actions which may succeed if they are sent
+    # again. Others (e.g., 'LimitExceeded') are reported right away.
+    RETRYABLE_ERROR_CODES = frozenset([
+        'ResourceContention', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'InternalFailure',
+        'ServiceUnavailable'
+    ])
+
+    def __init__(self, client=None, rate_limiter=None, sleep=time.sleep):
         if not client:
-            self._client = boto3.client('autoscaling')
+            self._client = _create_client('autoscaling')
         else:
             self._client = client
+        self._rate_limiter = rate_limiter or UnlimitedRateLimiter()
+        self._sleep = sleep
 
     def get_client(self):
         return self._client
 
-    def get_asgs(self):
+    def get_asgs(self, tag_key=None):
+        """Returns the ASGs in the active AWS account.
+
+        Args:
+            tag_key:
+                If provided, only the ASGs which have a tag with this key
+                (regardless of its value) are returned. The filtering is done
+                by the Auto Scaling API, so other ASGs are never downloaded.
+
+        Returns:
+            A generator of ASG dicts, as returned by
+            describe_auto_scaling_groups. Pages are requested as the
+            generator is consumed.
+        """
         paginator = self._client.get_paginator('describe_auto_scaling_groups')
-        result = []
-        for asg in paginator.paginate():
-            result = result + asg['AutoScalingGroups']
-        return result
+        params = {}
+        if tag_key is not None:
+            params['Filters'] = [{'Name': 'tag-key', 'Values': [tag_key]}]
+        for page in self._rate_limiter.paginate('describe_auto_scaling_groups', paginator, 'NextToken', **params):
+            yield from page['AutoScalingGroups']
 
     def get_asg_scheduled_actions(self, asg_name):
+        """Returns a generator of the scheduled actions of the ASG with the
+        specified name. Pages are requested as the generator is consumed.
+        """
+        paginator = self._client.get_paginator('describe_scheduled_actions')
+        for page in self._rate_limiter.paginate('describe_scheduled_actions', paginator, 'NextToken',
+                                                AutoScalingGroupName=asg_name):
+            yield from page['ScheduledUpdateGroupActions']
+
+    def get_all_scheduled_actions(self):
+        """Returns all scheduled actions in the active AWS account, indexed by
+        the name of the ASG they belong to.
+
+        This retrieves the actions of every ASG in a single paginated sweep,
+        so it needs one call per page instead of one call per ASG.
+
+        Returns:
+            A dict mapping ASG names to lists of scheduled action dicts:
+
+            {'MyAsg': [{'ScheduledActionName': 'Foo', ...}]}
+        """
         paginator = self._client.get_paginator('describe_scheduled_actions')
-        result = []
-        for action in paginator.paginate(AutoScalingGroupName=asg_name):
-            result = result + action['ScheduledUpdateGroupActions']
+        result = {}
+        for page in self._rate_limiter.paginate('describe_scheduled_actions', paginator, 'NextToken',
+                                                PaginationConfig={'PageSize': self.MAX_SCHEDULED_ACTIONS_PAGE_SIZE}):
+            for action in page['ScheduledUpdateGroupActions']:
+                result.setdefault(action['AutoScalingGroupName'], []).append(action)
         return result
 
     def update_asg_scheduled_actions(self, asg_name, action_updates):
-        return self._client.batch_put_scheduled_update_group_action(
+        return self._rate_limiter.call(
+            'batch_put_scheduled_update_group_action',
+            self._client.batch_put_scheduled_update_group_action,
             AutoScalingGroupName=asg_name,
             ScheduledUpdateGroupActions=action_updates
         )
 
+    def put_scheduled_actions(self, asg_name, action_updates):
+        """Updates any number of scheduled actions of the ASG with the
+        specified name, and reports the outcome of each one instead of
+        raising.
+
+        The actions are sent in chunks of MAX_SCHEDULED_ACTIONS_PER_UPDATE,
+        up to MAX_CONCURRENT_UPDATES at a time. Actions which fail with one
+        of RETRYABLE_ERROR_CODES (including whole calls which fail with one)
+        are sent again, up to MAX_UPDATE_ATTEMPTS times in total.
+
+        Args:
+            asg_name:
+                The name of the ASG.
+            action_updates:
+                The list of scheduled action dicts, as taken by
+                batch_put_scheduled_update_group_action.
+
+        Returns:
+            A list with a ScheduledActionUpdateOutcome for each action, in
+            the same order, which tells whether it succeeded, the error code
+            and message of its last failure, and how many times it was sent.
+        """
+        outcomes = {}
+        pending = list(action_updates)
+        for attempt in range(1, self.MAX_UPDATE_ATTEMPTS + 1):
+            if attempt > 1:
+                self._sleep(self.RETRY_DELAY * 2 ** (attempt - 2))
+            errors = self._put_chunks(asg_name, pending)
+            retried = []
+            for update in pending:
+                action_name = update['ScheduledActionName']
+                error_code, error_message = errors.get(action_name, (None, None))
+                if action_name not in errors:
+                    outcomes[action_name] = ScheduledActionUpdateOutcome(action_name, True, None, None, attempt)
+                elif error_code in self.RETRYABLE_ERROR_CODES and attempt < self.MAX_UPDATE_ATTEMPTS:
+                    retried.append(update)
+                else:
+                    outcomes[action_name] = ScheduledActionUpdateOutcome(action_name, False, error_code,
+                                                                         error_message, attempt)
+            pending = retried
+            if not pending:
+                break
+        return [outcomes[update['ScheduledActionName']] for update in action_updates]
+
+    def _put_chunks(self, asg_name, action_updates):
+        """Sends the actions in chunks, and returns the error code and message
+        of those which failed, indexed by action name."""
+        chunks = [action_updates[start:start + self.MAX_SCHEDULED_ACTIONS_PER_UPDATE]
+                  for start in range(0, len(action_updates), self.MAX_SCHEDULED_ACTIONS_PER_UPDATE)]
+        if len(chunks) <= 1:
+            chunk_errors = [self._put_chunk(asg_name, chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.MAX_CONCURRENT_UPDATES, len(chunks))) as executor:
+                chunk_errors = list(executor.map(lambda chunk: self._put_chunk(asg_name, chunk), chunks))
+        return {action_name: error for errors in chunk_errors for action_name, error in errors.items()}
+
+    def _put_chunk(self, asg_name, chunk):
+        try:
+            response = self.update_asg_scheduled_actions(asg_name, chunk)
+        except Exception as e:
+            # The whole call failed, so every action of the chunk did.
+            error_code = getattr(e, 'response', {}).get('Error', {}).get('Code') or e.__class__.__name__
+            return {update['ScheduledActionName']: (error_code, str(e)) for update in chunk}
+        return {failure['ScheduledActionName']: (failure.get('ErrorCode'), failure.get('ErrorMessage'))
+                for failure in response['FailedScheduledUpdateGroupActions']}
+
 
 class EventBridgeService:
-    def __init__(self, client=None):
+    def __init__(self, client=None, rate_limiter=None):
         if not client:
-            self._client = boto3.client('events')
+            self._client = _create_client('events')
         else:
             self._client = client
+        self._rate_limiter = rate_limiter or UnlimitedRateLimiter()
 
     def get_client(self):
         return self._client
 
     def get_scheduled_rules(self):
-        """Returns all EventBridge scheduled rules in the active AWS account.
+        """Returns a generator of all EventBridge scheduled rules in the active
+        AWS account. Pages are requested as the generator is consumed.
         """
         paginator = self._client.get_paginator('list_rules')
-        result = []
         # Scheduled rules can only exist in the default bus (see
         # https://docs.aws.amazon.com/eventbridge/latest/userguide/create-eventbridge-scheduled-rule.html).
-        for page in paginator.paginate(EventBusName='default'):
-            result = result + [rule for rule in page['Rules'] if 'ScheduleExpression' in rule]
-        return result
+        for page in self._rate_limiter.paginate('list_rules', paginator, 'NextToken', EventBusName='default'):
+            yield from (rule for rule in page['Rules'] if 'ScheduleExpression' in rule)
 
     def get_rule_tags(self, rule_arn):
         """Returns all tags for the EventBridge rule with the specified ARN.
@@ -68,7 +202,8 @@ class EventBridgeService:
 
             [{'Key': 'Foo', 'Value': 'Bar'}]
         """
-        return self._client.list_tags_for_resource(ResourceARN=rule_arn)['Tags']
+        return self._rate_limiter.call('list_tags_for_resource', self._client.list_tags_for_resource,
+                                       ResourceARN=rule_arn)['Tags']
 
     def update_rule_schedule(self, rule_name, schedule):
         """Update the schedule of the rule with the specified name.
@@ -79,4 +214,85 @@ class EventBridgeService:
             schedule:
                 The new schedule of the rule, as a valid schedule expression.
         """
-        return self._client.put_rule(Name=rule_name, ScheduleExpression=schedule)
+        return self._rate_limiter.call('put_rule', self._client.put_rule, Name=rule_name,
+                                       ScheduleExpression=schedule)
+
+    def disable_rule(self, rule_name):
+        """Disables the rule with the specified name.
+
+        Args:
+            rule_name:
+                The name of the EventBridge rule.
+        """
+        return self._rate_limiter.call('disable_rule', self._client.disable_rule, Name=rule_name)
+
+
+class TaggingService:
+    def __init__(self, client=None, rate_limiter=None):
+        if not client:
+            self._client = _create_client('resourcegroupstaggingapi')
+        else:
+            self._client = client
+        self._rate_limiter = rate_limiter or UnlimitedRateLimiter()
+
+    def get_client(self):
+        return self._client
+
+    def get_resource_tags_by_tag_key(self, resource_type, tag_key):
+        """Returns the tags of all resources of the given type which have a
+        tag with the given key, regardless of its value.
+
+        All resources are retrieved with a single paginated sweep, instead of
+        one call per resource.
+
+        Args:
+            resource_type:
+                The resource type, in 'service:type' format (e.g.,
+                'events:rule').
+            tag_key:
+                The key of the tag that resources must have.
+
+        Returns:
+            A dict mapping each resource ARN to its list of tag dicts:
+
+            {'arn:aws:events:...': [{'Key': 'Foo', 'Value': 'Bar'}]}
+        """
+        paginator = self._client.get_paginator('get_resources')
+        result = {}
+        for page in self._rate_limiter.paginate('get_resources', paginator, 'PaginationToken',
+                                                TagFilters=[{'Key': tag_key}],
+                                                ResourceTypeFilters=[resource_type]):
+            for resource in page['ResourceTagMappingList']:
+                result[resource['ResourceARN']] = resource['Tags']
+        return result
+
+
+class SecurityTokenService:
+    def __init__(self, client=None, rate_limiter=None):
+        if not client:
+            self._client = _create_client('sts')
+        else:
+            self._client = client
+        self._rate_limiter = rate_limiter or UnlimitedRateLimiter()
+
+    def get_client(self):
+        return self._client
+
+    def assume_role(self, role_arn, session_name, duration_seconds=3600):
+        """Assumes the IAM role with the specified ARN.
+
+        Args:
+            role_arn:
+                The ARN of the role.
+            session_name:
+                The name of the role session, which shows up in CloudTrail.
+            duration_seconds:
+                How long the credentials remain valid, in seconds.
+
+        Returns:
+            The temporary credentials of the role, as a dict with their
+            'AccessKeyId', 'SecretAccessKey', 'SessionToken' and their
+            'Expiration' (an aware datetime).
+        """
+        return self._rate_limiter.call('assume_role', self._client.assume_role, RoleArn=role_arn,
+                                       RoleSessionName=session_name, DurationSeconds=duration_seconds)['Credentials']
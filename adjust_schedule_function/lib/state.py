@@ -0,0 +1,271 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime
+from lib import timezones
+from lib.ratelimit import UnlimitedRateLimiter
+from lib.recurrence import TimeSource
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def get_fingerprint(*values):
+    """Returns a short, stable digest of the given string values."""
+    return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+class StateStore:
+    """Stores a record per resource, with what was last verified about it.
+
+    Records are dicts keyed by 'ResourceType' and 'ResourceId' (as the
+    partition and sort keys of a DynamoDB table would be), along with:
+
+        {
+            'ResourceType': 'AutoScalingGroup',
+            'ResourceId': 'arn:aws:autoscaling:...',
+            'Fingerprint': '...',
+            'UtcOffset': 60,
+            'ValidUntil': '2020-03-22T01:00:00',
+            'VerifiedAt': '2020-01-01T12:00:00'
+        }
+
+    'UtcOffset' is in minutes, and 'ValidUntil' may be missing if the record
+    does not expire.
+    """
+    def query(self, resource_type):
+        """Returns an iterable of all records of the given resource type."""
+        raise NotImplementedError()
+
+    def batch_put(self, records):
+        """Creates or replaces the given records."""
+        raise NotImplementedError()
+
+
+class DynamoDBStateStore(StateStore):
+    """A StateStore backed by a DynamoDB table whose partition key is
+    'ResourceType' and whose sort key is 'ResourceId'."""
+    # DynamoDB accepts at most 25 items per batch_write_item call.
+    BATCH_WRITE_SIZE = 25
+    MAX_ATTEMPTS = 5
+    NUMBER_ATTRIBUTES = ('UtcOffset',)
+
+    def __init__(self, table_name, client=None, rate_limiter=None):
+        self._table_name = table_name
+        if not client:
+            import boto3
+            self._client = boto3.client('dynamodb')
+        else:
+            self._client = client
+        self._rate_limiter = rate_limiter or UnlimitedRateLimiter()
+
+    def get_client(self):
+        return self._client
+
+    def query(self, resource_type):
+        params = {
+            'TableName': self._table_name,
+            'KeyConditionExpression': 'ResourceType = :resource_type',
+            'ExpressionAttributeValues': {':resource_type': {'S': resource_type}}
+        }
+        while True:
+            response = self._rate_limiter.call('query', self._client.query, **params)
+            for item in response['Items']:
+                yield self._deserialize(item)
+            if 'LastEvaluatedKey' not in response:
+                return
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def batch_put(self, records):
+        records = list(records)
+        for start in range(0, len(records), self.BATCH_WRITE_SIZE):
+            requests = [{'PutRequest': {'Item': self._serialize(record)}}
+                        for record in records[start:start + self.BATCH_WRITE_SIZE]]
+            self._write_batch(requests)
+
+    def _write_batch(self, requests):
+        """Writes a batch of requests, retrying those which DynamoDB leaves
+        unprocessed."""
+        for attempt in range(self.MAX_ATTEMPTS):
+            response = self._rate_limiter.call('batch_write_item', self._client.batch_write_item,
+                                               RequestItems={self._table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(self._table_name, [])
+            if not requests:
+                return
+        raise Exception('{} state records could not be written'.format(len(requests)))
+
+    def _serialize(self, record):
+        item = {}
+        for key, value in record.items():
+            if value is None:
+                continue
+            if key in self.NUMBER_ATTRIBUTES:
+                item[key] = {'N': str(value)}
+            else:
+                item[key] = {'S': value}
+        return item
+
+    def _deserialize(self, item):
+        record = {}
+        for key, value in item.items():
+            if 'N' in value:
+                record[key] = int(value['N'])
+            else:
+                record[key] = value['S']
+        return record
+
+
+class SQLiteStateStore(StateStore):
+    """A StateStore backed by a local SQLite database, for local runs and
+    tests."""
+    def __init__(self, path=':memory:'):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'resource_type TEXT NOT NULL, resource_id TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+                'utc_offset INTEGER NOT NULL, valid_until TEXT, verified_at TEXT NOT NULL, '
+                'PRIMARY KEY (resource_type, resource_id))')
+
+    def query(self, resource_type):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT resource_type, resource_id, fingerprint, utc_offset, valid_until, verified_at '
+                'FROM state WHERE resource_type = ?', (resource_type,)).fetchall()
+        for row in rows:
+            record = {
+                'ResourceType': row[0],
+                'ResourceId': row[1],
+                'Fingerprint': row[2],
+                'UtcOffset': row[3],
+                'VerifiedAt': row[5]
+            }
+            if row[4] is not None:
+                record['ValidUntil'] = row[4]
+            yield record
+
+    def batch_put(self, records):
+        rows = [(record['ResourceType'], record['ResourceId'], record['Fingerprint'], record['UtcOffset'],
+                 record.get('ValidUntil'), record['VerifiedAt']) for record in records]
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+class ResourceState:
+    """Tracks which resources were verified in previous runs, so that those
+    which have not changed since can be skipped.
+
+    A resource is unchanged if its fingerprint (i.e., the values it was
+    verified with, such as its tags) is the same, the UTC offset of its
+    timezone has not moved, and the time until which its recurrences were
+    known to remain correct has not been reached.
+
+    The state is shared by all processors, and is safe to use from several
+    threads. Each run starts with start_run(), and the resources verified in
+    it are stored with save().
+    """
+    def __init__(self, store, time_source=None):
+        """Initializes the state.
+
+        Args:
+            store: The StateStore which holds the records.
+            time_source: The time source used to tell the current time.
+        """
+        self._store = store
+        self._time_source = time_source or TimeSource()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._force = False
+        self._now = None
+        self._records = {}
+        self._verified = []
+        self._unchanged_count = 0
+
+    def start_run(self, force=False):
+        """Starts a new run.
+
+        Args:
+            force: Whether every resource must be evaluated in this run,
+                regardless of its state. Resources are still recorded.
+        """
+        with self._lock:
+            self._force = force
+            self._now = timezones.to_naive_utc(self._time_source.get_current_utc_datetime())
+            self._records = {}
+            self._verified = []
+            self._unchanged_count = 0
+
+    def get_unchanged_count(self):
+        """Returns the number of resources which were skipped in the current
+        run because they had not changed."""
+        return self._unchanged_count
+
+    def load(self, resource_type):
+        """Reads the records of the given resource type, in as few reads as
+        the store allows. They are only read once per run, even if several
+        processors (e.g., one per region) load them."""
+        with self._load_lock:
+            if resource_type in self._records:
+                return
+            records = {record['ResourceId']: record for record in self._store.query(resource_type)}
+            with self._lock:
+                self._records[resource_type] = records
+        logger.info("Loaded the state of %d resources of type '%s'", len(records), resource_type)
+
+    def is_unchanged(self, resource_type, resource_id, fingerprint, timezone):
+        """Returns whether the resource has not changed since it was last
+        verified, in which case it can be skipped. Unchanged resources are
+        counted."""
+        if self._force:
+            return False
+        record = self._records.get(resource_type, {}).get(resource_id)
+        if record is None or record['Fingerprint'] != fingerprint:
+            return False
+        if 'ValidUntil' in record and self._now >= datetime.strptime(record['ValidUntil'], '%Y-%m-%dT%H:%M:%S'):
+            return False
+        if record['UtcOffset'] != self._get_offset_minutes(timezone):
+            return False
+        with self._lock:
+            self._unchanged_count += 1
+        return True
+
+    def record(self, resource_type, resource_id, fingerprint, timezone, valid_until):
+        """Records that the resource has been verified in the current run.
+
+        Args:
+            resource_type: The type of the resource (e.g.,
+                'AutoScalingGroup').
+            resource_id: The identifier of the resource (e.g., its ARN).
+            fingerprint: The fingerprint of the values it was verified with.
+            timezone: The local timezone of the resource.
+            valid_until: A naive UTC datetime until which the recurrences of
+                the resource remain correct, or None if they always do.
+        """
+        record = {
+            'ResourceType': resource_type,
+            'ResourceId': resource_id,
+            'Fingerprint': fingerprint,
+            'UtcOffset': self._get_offset_minutes(timezone),
+            'VerifiedAt': self._now.isoformat()
+        }
+        if valid_until is not None:
+            record['ValidUntil'] = valid_until.replace(microsecond=0).isoformat()
+        with self._lock:
+            self._verified.append(record)
+
+    def save(self):
+        """Stores the records of the resources verified in the current run,
+        and returns how many there were."""
+        with self._lock:
+            verified = self._verified
+            self._verified = []
+        if verified:
+            self._store.batch_put(verified)
+        return len(verified)
+
+    def _get_offset_minutes(self, timezone):
+        return int(timezones.get_utc_offset(timezone, self._now).total_seconds()) // 60
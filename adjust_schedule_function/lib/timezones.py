@@ -0,0 +1,286 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import date, datetime, timedelta, timezone as datetime_timezone, MAXYEAR
+import bisect
+
+
+UTC = datetime_timezone.utc
+
+
+def to_naive_utc(moment):
+    """Returns the given datetime as a naive datetime in UTC. Naive datetimes
+    are assumed to already be in UTC."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(UTC).replace(tzinfo=None)
+
+
+class PytzProvider:
+    """A timezone provider backed by pytz, which bundles its own copy of the
+    tz database.
+
+    Offset transitions are read from the transition tables of pytz, which
+    end in 2037.
+    """
+    name = 'pytz'
+
+    def __init__(self):
+        import pytz
+        self._pytz = pytz
+        self._zones = {}
+        self._transitions = {}
+
+    def get_zone(self, timezone):
+        """Returns the tzinfo of the timezone, reusing previously loaded ones.
+
+        Raises:
+            pytz.UnknownTimeZoneError: The timezone does not exist.
+        """
+        zone = self._zones.get(timezone)
+        if zone is None:
+            zone = self._zones[timezone] = self._pytz.timezone(timezone)
+        return zone
+
+    def get_utc_offset(self, timezone, naive_utc):
+        """Returns the UTC offset of the timezone at the given naive UTC
+        datetime, as a timedelta."""
+        return self._pytz.utc.localize(naive_utc).astimezone(self.get_zone(timezone)).utcoffset()
+
+    def get_next_transition(self, timezone, naive_utc):
+        """Returns the first naive UTC datetime strictly after the given one at
+        which the UTC offset of the timezone changes, or None."""
+        transitions = self.get_offset_transitions(timezone)
+        index = bisect.bisect_right(transitions, naive_utc)
+        if index == len(transitions):
+            return None
+        return transitions[index]
+
+    def get_offset_transitions(self, timezone):
+        """Returns the instants at which the UTC offset of the timezone
+        changes, according to the tz database.
+
+        Transitions which only change the name of the timezone or its DST
+        flag, but not its UTC offset, are left out.
+
+        Args:
+            timezone: The name of the timezone (e.g., 'Europe/Madrid').
+
+        Returns:
+            A sorted tuple of naive datetimes, in UTC.
+        """
+        if timezone not in self._transitions:
+            tz = self.get_zone(timezone)
+            times = getattr(tz, '_utc_transition_times', None) or []
+            infos = getattr(tz, '_transition_info', None)
+            self._transitions[timezone] = tuple(times[i] for i in range(1, len(times))
+                                                if infos[i][0] != infos[i - 1][0])
+        return self._transitions[timezone]
+
+
+class ZoneInfoProvider:
+    """A timezone provider backed by the standard zoneinfo module (or its
+    backport), which reads the tz database of the system or of the tzdata
+    package.
+
+    zoneinfo does not expose its transitions, so they are found by sampling
+    the UTC offset once a day and bisecting changes down to the second. Each
+    year is scanned once per timezone, and only the years up to
+    SCAN_YEARS after the requested instant are looked at: a timezone whose
+    offset does not change within them is reported as not changing again.
+    Changes that are undone within less than a day are not detected.
+    """
+    name = 'zoneinfo'
+    SCAN_YEARS = 2
+
+    def __init__(self, zone_loader=None):
+        """Initializes the provider.
+
+        Args:
+            zone_loader: An optional callable which returns the tzinfo for a
+                timezone name. Defaults to zoneinfo.ZoneInfo.
+        """
+        if not zone_loader:
+            try:
+                import zoneinfo
+            except ImportError:
+                from backports import zoneinfo
+            zone_loader = zoneinfo.ZoneInfo
+        self._zone_loader = zone_loader
+        self._zones = {}
+        self._transitions = {}
+
+    def get_zone(self, timezone):
+        """Returns the tzinfo of the timezone, reusing previously loaded ones.
+
+        Raises:
+            zoneinfo.ZoneInfoNotFoundError: The timezone does not exist.
+        """
+        zone = self._zones.get(timezone)
+        if zone is None:
+            zone = self._zones[timezone] = self._zone_loader(timezone)
+        return zone
+
+    def get_utc_offset(self, timezone, naive_utc):
+        """Returns the UTC offset of the timezone at the given naive UTC
+        datetime, as a timedelta."""
+        return naive_utc.replace(tzinfo=UTC).astimezone(self.get_zone(timezone)).utcoffset()
+
+    def get_next_transition(self, timezone, naive_utc):
+        """Returns the first naive UTC datetime strictly after the given one at
+        which the UTC offset of the timezone changes, or None."""
+        for year in range(naive_utc.year, min(naive_utc.year + self.SCAN_YEARS, MAXYEAR)):
+            transitions = self._get_year_transitions(timezone, year)
+            index = bisect.bisect_right(transitions, naive_utc)
+            if index < len(transitions):
+                return transitions[index]
+        return None
+
+    def _get_year_transitions(self, timezone, year):
+        """Returns the transitions after the start of the year and no later
+        than the start of the next one."""
+        key = (timezone, year)
+        if key not in self._transitions:
+            zone = self.get_zone(timezone)
+            transitions = []
+            start = datetime(year, 1, 1, tzinfo=UTC)
+            offset = start.astimezone(zone).utcoffset()
+            for day in range(1, (date(year + 1, 1, 1) - date(year, 1, 1)).days + 1):
+                end = start + timedelta(days=1)
+                end_offset = end.astimezone(zone).utcoffset()
+                if end_offset != offset:
+                    transitions.append(self._find_transition(zone, start, end, offset))
+                start, offset = end, end_offset
+            self._transitions[key] = tuple(transitions)
+        return self._transitions[key]
+
+    def _find_transition(self, zone, start, end, offset):
+        """Returns the first second after start at which the offset of the
+        zone is no longer the given one."""
+        low, high = 0, int((end - start).total_seconds())
+        while high - low > 1:
+            middle = (low + high) // 2
+            if (start + timedelta(seconds=middle)).astimezone(zone).utcoffset() == offset:
+                low = middle
+            else:
+                high = middle
+        return (start + timedelta(seconds=high)).replace(tzinfo=None)
+
+
+PROVIDERS = {provider.name: provider for provider in (PytzProvider, ZoneInfoProvider)}
+
+_provider = None
+
+
+def get_provider():
+    """Returns the timezone provider in use, which is a PytzProvider unless
+    another one has been set."""
+    global _provider
+    if _provider is None:
+        _provider = PytzProvider()
+    return _provider
+
+
+def set_provider(provider):
+    """Sets the timezone provider to use (e.g., a ZoneInfoProvider)."""
+    global _provider
+    _provider = provider
+
+
+def get_next_transition(timezone, after):
+    """Returns the first instant strictly after the given one at which the UTC
+    offset of the timezone changes.
+
+    Args:
+        timezone: The name of the timezone (e.g., 'Europe/Madrid').
+        after: A datetime. Naive datetimes are assumed to be in UTC.
+
+    Returns:
+        A naive datetime in UTC, or None if the offset is not known to change
+        again.
+    """
+    return get_provider().get_next_transition(timezone, to_naive_utc(after))
+
+
+def get_utc_offset(timezone, moment):
+    """Returns the UTC offset of the timezone at the given instant, as a
+    timedelta. Naive datetimes are assumed to be in UTC."""
+    return get_provider().get_utc_offset(timezone, to_naive_utc(moment))
+
+
+def get_offset_periods(timezone, moment, count=2):
+    """Returns the periods of constant UTC offset of the timezone, starting
+    with the one that contains the given instant.
+
+    Args:
+        timezone: The name of the timezone (e.g., 'Europe/Madrid').
+        moment: A datetime. Naive datetimes are assumed to be in UTC.
+        count: The maximum number of periods to return.
+
+    Returns:
+        A list of (offset, end) tuples, where offset is a timedelta and end is
+        the naive UTC datetime at which the period ends (or None, if the
+        offset is not known to change again).
+    """
+    result = []
+    start = to_naive_utc(moment)
+    while len(result) < count:
+        end = get_next_transition(timezone, start)
+        result.append((get_utc_offset(timezone, start), end))
+        if end is None:
+            break
+        start = end
+    return result
+
+
+def has_transition_between(timezone, since, until):
+    """Returns whether the UTC offset of the timezone changes after since and
+    no later than until.
+
+    Unknown timezones are assumed to have transitions, so that resources
+    using them are still processed (and their errors reported).
+    """
+    try:
+        transition = get_next_transition(timezone, since)
+    except KeyError:
+        # Both pytz.UnknownTimeZoneError and
+        # zoneinfo.ZoneInfoNotFoundError derive from KeyError.
+        return True
+    return transition is not None and transition <= to_naive_utc(until)
+
+
+class TransitionWindow:
+    """A window of time around the current run, used to tell which
+    timezones may need their schedules adjusted.
+
+    Unless the UTC offset of a timezone has changed or will change within
+    the horizon around the current run, the schedules which use it cannot
+    have become wrong, and need not be evaluated.
+    """
+    def __init__(self, since, until):
+        self._since = to_naive_utc(since)
+        self._until = to_naive_utc(until)
+        self._cache = {}
+
+    @classmethod
+    def around(cls, now, horizon):
+        """Creates a window that spans one horizon before and after the
+        current time.
+
+        The window is symmetric by design: the time of the last run is not
+        tracked, so the horizon must be longer than the interval between
+        runs for every change to be seen by at least one run after it.
+
+        Args:
+            now: The datetime of the current run.
+            horizon: A timedelta with how far into the past and the future to
+                look for offset changes.
+        """
+        return cls(now - horizon, now + horizon)
+
+    def includes(self, timezone):
+        """Returns whether the UTC offset of the timezone changes within the
+        window."""
+        if timezone not in self._cache:
+            self._cache[timezone] = has_transition_between(timezone, self._since, self._until)
+        return self._cache[timezone]
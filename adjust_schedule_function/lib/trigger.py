@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import timedelta
+from lib import timezones
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TransitionTriggerScheduler:
+    """Schedules an EventBridge rule to invoke the adjuster shortly before
+    and shortly after the next UTC offset transition of the timezones in use.
+
+    Most of the year, no timezone changes its offset, so there is nothing to
+    adjust. Instead of sweeping the whole fleet at a fixed frequency, every
+    run schedules the rule for the next instant at which a run is useful:
+    lead before the earliest upcoming transition, so that the schedules are
+    correct as soon as it happens, and lag after it, to adjust the schedules
+    whose next run was still before it. The rule is scheduled with a cron
+    expression that only matches that instant (year included), so it fires
+    once, and the run it triggers schedules the following one.
+    """
+    DEFAULT_LEAD = timedelta(hours=1)
+    DEFAULT_LAG = timedelta(minutes=5)
+
+    def __init__(self, eventbridge_service, rule_name, lead=DEFAULT_LEAD, lag=DEFAULT_LAG):
+        """Initializes the scheduler.
+
+        Args:
+            eventbridge_service: The EventBridgeService used to update the
+                rule.
+            rule_name: The name of the EventBridge rule which invokes the
+                adjuster.
+            lead: How long before a transition the adjuster runs.
+            lag: How long after a transition the adjuster runs.
+        """
+        self._eventbridge_service = eventbridge_service
+        self._rule_name = rule_name
+        self._lead = lead
+        self._lag = lag
+
+    def get_next_trigger_time(self, timezone_names, now):
+        """Returns the next instant at which the adjuster must run.
+
+        Args:
+            timezone_names: The names of the timezones used by the resources.
+            now: The datetime of the current run.
+
+        Returns:
+            A naive UTC datetime, rounded to the minute, or None if none of
+            the timezones changes its offset again.
+        """
+        # Runs are scheduled to the minute, and never for the current one.
+        earliest = (timezones.to_naive_utc(now) + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        result = None
+        for timezone in set(timezone_names):
+            try:
+                trigger_time = self._get_next_trigger_time(timezone, earliest)
+            except Exception as e:
+                logger.warning("Could not look up the offset transitions of timezone '%s': %s", timezone, e)
+                continue
+            if trigger_time is not None and (result is None or trigger_time < result):
+                result = trigger_time
+        return result
+
+    def schedule_next_run(self, timezone_names, now):
+        """Schedules the rule for the next instant at which the adjuster
+        must run, or disables it if there is none.
+
+        Returns:
+            The naive UTC datetime for which the rule was scheduled, or None.
+        """
+        trigger_time = self.get_next_trigger_time(timezone_names, now)
+        if trigger_time is None:
+            logger.info("No offset transitions are coming up. Disabling rule '%s'", self._rule_name)
+            self._eventbridge_service.disable_rule(self._rule_name)
+            return None
+
+        logger.info("Scheduling rule '%s' for the next offset transition, at %s", self._rule_name,
+                    trigger_time.isoformat())
+        self._eventbridge_service.update_rule_schedule(self._rule_name, self.get_schedule_expression(trigger_time))
+        return trigger_time
+
+    @staticmethod
+    def get_schedule_expression(trigger_time):
+        """Returns the schedule expression which only matches the given naive
+        UTC datetime."""
+        return 'cron({} {} {} {} ? {})'.format(trigger_time.minute, trigger_time.hour, trigger_time.day,
+                                               trigger_time.month, trigger_time.year)
+
+    def _get_next_trigger_time(self, timezone, earliest):
+        # The run after a transition may still be due when the next one is
+        # looked up, so the search starts one lag earlier.
+        transition = timezones.get_next_transition(timezone, earliest - self._lag)
+        while transition is not None:
+            before = transition - self._lead
+            if before >= earliest:
+                return before.replace(second=0, microsecond=0)
+            after = transition + self._lag
+            if after >= earliest:
+                # Rounded up, so that it never runs before the lag is over.
+                return (after + timedelta(seconds=59)).replace(second=0, microsecond=0)
+            transition = timezones.get_next_transition(timezone, transition)
+        return None
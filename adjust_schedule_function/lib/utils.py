@@ -6,3 +6,51 @@ def get_tag_by_key(tags, key):
     if len(tags):
     	return tags[0]['Value']
     return None
+
+
+class TagIndex:
+    """An index of the tags of a resource, built in a single pass over them,
+    so that any number of lookups can be made without scanning the tags
+    again.
+
+    Tags whose key starts with the given local time prefix (e.g.,
+    'scheduled-event-adjuster:local-time:') are also parsed into a map from
+    the rest of their key (e.g., the name of a scheduled action) to their
+    value.
+    """
+    def __init__(self, tags, local_time_tag_prefix=None):
+        """Indexes the tags.
+
+        Args:
+            tags: The tags of the resource, as a list of dicts with their
+                'Key' and 'Value'.
+            local_time_tag_prefix: The prefix of the keys of the local time
+                tags, including the trailing ':'. If None, no local time map
+                is built.
+        """
+        self._values = {}
+        self._local_times = {}
+        for tag in tags:
+            key = tag['Key']
+            # As with get_tag_by_key, the first tag with a given key wins.
+            if key in self._values:
+                continue
+            self._values[key] = tag['Value']
+            if local_time_tag_prefix is not None and key.startswith(local_time_tag_prefix):
+                self._local_times[key[len(local_time_tag_prefix):]] = tag['Value']
+
+    def get(self, key):
+        """Returns the value of the tag with the given key, or None if the
+        resource does not have it."""
+        return self._values.get(key)
+
+    def get_local_time(self, name):
+        """Returns the value of the local time tag with the given name (e.g.,
+        the name of a scheduled action), or None if the resource does not
+        have it."""
+        return self._local_times.get(name)
+
+    def get_local_times(self):
+        """Returns a dict mapping the names of all local time tags to their
+        values."""
+        return dict(self._local_times)
@@ -2,5 +2,28 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import sys, os
+import pytest
 
 sys.path.insert(0, os.path.abspath("adjust_schedule_function"))
+
+BENCHMARKS_DIR = os.path.abspath(os.path.join("tests", "benchmarks"))
+
+
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmarks", action="store_true", default=False,
+                     help="run the benchmarks in tests/benchmarks, which assert timing budgets")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: measures timing; only run with --run-benchmarks")
+
+
+def pytest_collection_modifyitems(config, items):
+    # Benchmarks assert wall-clock budgets and speedups, which depend on the
+    # machine they run on, so they are not part of the default run.
+    skip_benchmark = pytest.mark.skip(reason="benchmarks only run with --run-benchmarks")
+    for item in items:
+        if os.path.abspath(str(item.fspath)).startswith(BENCHMARKS_DIR + os.sep):
+            item.add_marker(pytest.mark.benchmark)
+            if not config.getoption("--run-benchmarks"):
+                item.add_marker(skip_benchmark)
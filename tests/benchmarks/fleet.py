@@ -0,0 +1,410 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""Generates synthetic fleets of ASGs and EventBridge rules, and measures
+how the processors scale over them.
+
+The fleet is served by in-memory stand-ins for the services, which simulate
+the latency of every API call and count them. run_fleet_benchmark returns a
+JSON-serializable report, so that it can be stored and compared across
+changes. It can also be run from the root of the repository:
+
+    PYTHONPATH=adjust_schedule_function python -m tests.benchmarks.fleet --asgs 1000 --actions 5 --rules 1000 --latency 0.005
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from lib import timezones
+from lib.processors.autoscaling import AutoScalingGroupProcessor
+from lib.processors.eventbridge import EventBridgeProcessor
+from lib.processors.runner import ProcessorRunner
+from lib.recurrence import CachingRecurrenceCalculator
+from lib.services import AutoScalingService, EventBridgeService, TaggingService
+
+DEFAULT_TIMEZONE_MIX = {
+    'Europe/Madrid': 0.4,
+    'America/New_York': 0.3,
+    'Asia/Tokyo': 0.2,
+    'Australia/Sydney': 0.1
+}
+# The moment at which recurrences are calculated, so that reports do not
+# depend on when the benchmark runs.
+DEFAULT_NOW = datetime(2021, 3, 20, 12, 0)
+# The maximum page sizes of the APIs which are simulated.
+PAGE_SIZE = 100
+
+
+class Fleet:
+    """A synthetic fleet of ASGs, their scheduled actions and EventBridge
+    rules, with their tags."""
+    def __init__(self, asgs, scheduled_actions, rules, rule_tags):
+        self.asgs = asgs
+        self.scheduled_actions = scheduled_actions
+        self.rules = rules
+        self.rule_tags = rule_tags
+
+
+def generate_fleet(asg_count, actions_per_asg, rule_count, tag_coverage=1.0, timezone_mix=None,
+                   tag_prefix='bench', seed=0, region='us-east-1'):
+    """Generates a synthetic fleet.
+
+    Args:
+        asg_count: The number of ASGs.
+        actions_per_asg: The number of scheduled actions of every ASG.
+        rule_count: The number of scheduled EventBridge rules.
+        tag_coverage: The share of the ASGs and rules (between 0 and 1)
+            which are tagged to be adjusted. The others only have unrelated
+            tags.
+        timezone_mix: A dict mapping the names of the timezones used by the
+            tagged resources to their weight. Defaults to
+            DEFAULT_TIMEZONE_MIX.
+        tag_prefix: The prefix of the tags of the adjuster.
+        seed: The seed of the generator, so that the same arguments always
+            give the same fleet.
+        region: The region in the ARNs of the resources.
+
+    Returns:
+        A Fleet.
+    """
+    rng = random.Random(seed)
+    timezone_mix = timezone_mix or DEFAULT_TIMEZONE_MIX
+    timezone_names = sorted(timezone_mix)
+    weights = [timezone_mix[name] for name in timezone_names]
+
+    def build_tags(local_time_tags):
+        tags = [{'Key': 'team', 'Value': rng.choice(['red', 'green', 'blue'])}]
+        if rng.random() < tag_coverage:
+            tags.append({'Key': tag_prefix + ':enabled', 'Value': ''})
+            tags.append({'Key': tag_prefix + ':local-timezone', 'Value': rng.choices(timezone_names, weights)[0]})
+            tags.extend(local_time_tags)
+        return tags
+
+    asgs = []
+    scheduled_actions = {}
+    for i in range(asg_count):
+        name = 'asg-{:06d}'.format(i)
+        actions = []
+        local_time_tags = []
+        for j in range(actions_per_asg):
+            action_name = 'action-{:03d}'.format(j)
+            hour = rng.randrange(24)
+            actions.append({
+                'AutoScalingGroupName': name,
+                'ScheduledActionName': action_name,
+                'Recurrence': '0 {} * * *'.format(hour),
+                'DesiredCapacity': rng.randrange(1, 10)
+            })
+            local_time_tags.append({'Key': '{}:local-time:{}'.format(tag_prefix, action_name),
+                                    'Value': '{:02d}:00'.format(hour)})
+        asgs.append({
+            'AutoScalingGroupName': name,
+            'AutoScalingGroupARN': 'arn:aws:autoscaling:{}:123456789012:autoScalingGroup:{}'.format(region, name),
+            'Tags': build_tags(local_time_tags)
+        })
+        scheduled_actions[name] = actions
+
+    rules = []
+    rule_tags = {}
+    for i in range(rule_count):
+        name = 'rule-{:06d}'.format(i)
+        arn = 'arn:aws:events:{}:123456789012:rule/{}'.format(region, name)
+        hour = rng.randrange(24)
+        rules.append({'Name': name, 'Arn': arn, 'ScheduleExpression': 'cron(0 {} * * ? *)'.format(hour)})
+        rule_tags[arn] = build_tags([{'Key': tag_prefix + ':local-time', 'Value': '{:02d}:00'.format(hour)}])
+
+    return Fleet(asgs, scheduled_actions, rules, rule_tags)
+
+
+class ApiCallCounter:
+    """Counts the simulated API calls per operation, from any thread, and
+    simulates their latency."""
+    def __init__(self, latency):
+        self._latency = latency
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def call(self, operation_name):
+        with self._lock:
+            self._counts[operation_name] += 1
+        if self._latency:
+            time.sleep(self._latency)
+
+    def get_counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def _paginate(items, page_size=PAGE_SIZE):
+    for start in range(0, len(items), page_size):
+        yield items[start:start + page_size]
+
+
+def _has_tag(tags, key):
+    return any(tag['Key'] == key for tag in tags)
+
+
+class FakeAutoScalingService(AutoScalingService):
+    """An AutoScalingService which serves the ASGs of a fleet, with one
+    simulated call per page."""
+    def __init__(self, fleet, counter):
+        super().__init__(client=object())
+        self._fleet = fleet
+        self._counter = counter
+
+    def get_asgs(self, tag_key=None):
+        asgs = [asg for asg in self._fleet.asgs if tag_key is None or _has_tag(asg['Tags'], tag_key)]
+        for page in _paginate(asgs):
+            self._counter.call('describe_auto_scaling_groups')
+            yield from page
+
+    def get_asg_scheduled_actions(self, asg_name):
+        actions = self._fleet.scheduled_actions.get(asg_name, [])
+        for page in _paginate(actions) if actions else [[]]:
+            self._counter.call('describe_scheduled_actions')
+            yield from page
+
+    def get_all_scheduled_actions(self):
+        result = {}
+        actions = [action for asg_actions in self._fleet.scheduled_actions.values() for action in asg_actions]
+        for page in _paginate(actions):
+            self._counter.call('describe_scheduled_actions')
+            for action in page:
+                result.setdefault(action['AutoScalingGroupName'], []).append(action)
+        return result
+
+    def update_asg_scheduled_actions(self, asg_name, action_updates):
+        self._counter.call('batch_put_scheduled_update_group_action')
+        actions = {action['ScheduledActionName']: action for action in self._fleet.scheduled_actions[asg_name]}
+        for update in action_updates:
+            actions[update['ScheduledActionName']]['Recurrence'] = update['Recurrence']
+        return {'FailedScheduledUpdateGroupActions': []}
+
+
+class FakeEventBridgeService(EventBridgeService):
+    """An EventBridgeService which serves the rules of a fleet, with one
+    simulated call per page."""
+    def __init__(self, fleet, counter):
+        super().__init__(client=object())
+        self._fleet = fleet
+        self._counter = counter
+        self._rules = {rule['Name']: rule for rule in fleet.rules}
+
+    def get_scheduled_rules(self):
+        for page in _paginate(self._fleet.rules):
+            self._counter.call('list_rules')
+            yield from page
+
+    def get_rule_tags(self, rule_arn):
+        self._counter.call('list_tags_for_resource')
+        return self._fleet.rule_tags[rule_arn]
+
+    def update_rule_schedule(self, rule_name, schedule):
+        self._counter.call('put_rule')
+        self._rules[rule_name]['ScheduleExpression'] = schedule
+
+    def disable_rule(self, rule_name):
+        self._counter.call('disable_rule')
+
+
+class FakeTaggingService(TaggingService):
+    """A TaggingService which serves the tags of the rules of a fleet, with
+    one simulated call per page."""
+    def __init__(self, fleet, counter):
+        super().__init__(client=object())
+        self._fleet = fleet
+        self._counter = counter
+
+    def get_resource_tags_by_tag_key(self, resource_type, tag_key):
+        result = {}
+        resources = [(arn, tags) for arn, tags in self._fleet.rule_tags.items() if _has_tag(tags, tag_key)]
+        for page in _paginate(resources):
+            self._counter.call('get_resources')
+            result.update(page)
+        return result
+
+
+class FixedTimeSource:
+    def __init__(self, now):
+        self._now = now
+
+    def get_current_utc_datetime(self):
+        return self._now
+
+
+def percentile(values, percent):
+    """Returns the given percentile of the values, with the nearest-rank
+    method, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class ResourceTimer:
+    """Measures the time spent on every resource, by wrapping the methods of
+    the processors and services which work on a single resource."""
+    def __init__(self):
+        self._durations = collections.defaultdict(lambda: collections.defaultdict(float))
+        self._lock = threading.Lock()
+
+    def wrap(self, target, method_name, resource_type, get_resource_name):
+        method = getattr(target, method_name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                with self._lock:
+                    self._durations[resource_type][get_resource_name(*args, **kwargs)] += duration
+
+        setattr(target, method_name, timed)
+
+    def get_percentiles(self):
+        """Returns the p50 and p99 of the time spent per resource, in
+        milliseconds, for every resource type."""
+        result = {}
+        for resource_type, durations in sorted(self._durations.items()):
+            values = [duration * 1000 for duration in durations.values()]
+            result[resource_type] = {
+                'count': len(values),
+                'p50': round(percentile(values, 50), 3),
+                'p99': round(percentile(values, 99), 3)
+            }
+        return result
+
+
+def _build_runner(fleet, counter, timer=None, max_workers=8, prefetch_threshold=20, metrics=None,
+                  tag_prefix='bench', now=DEFAULT_NOW, rule_max_workers=1):
+    asg_service = FakeAutoScalingService(fleet, counter)
+    eventbridge_service = FakeEventBridgeService(fleet, counter)
+    tagging_service = FakeTaggingService(fleet, counter)
+    recurrence_calculator = CachingRecurrenceCalculator(FixedTimeSource(now.replace(tzinfo=timezones.UTC)),
+                                                        metrics=metrics)
+    asg_processor = AutoScalingGroupProcessor(tag_prefix, asg_service, recurrence_calculator, max_workers,
+                                              prefetch_threshold, metrics=metrics)
+    eventbridge_processor = EventBridgeProcessor(tag_prefix, eventbridge_service, recurrence_calculator,
+                                                 tagging_service, metrics=metrics, max_workers=rule_max_workers)
+    if timer is not None:
+        # An ASG is processed in a single call, whereas the tags of a rule are
+        # looked up before its recurrence is calculated in a batch, and it is
+        # updated afterwards.
+        timer.wrap(asg_processor, '_process_asg_isolated', 'AutoScalingGroup',
+                   lambda asg, *args: asg['AutoScalingGroupName'])
+        timer.wrap(eventbridge_processor, '_get_candidate', 'EventBridgeRule', lambda rule, *args: rule['Name'])
+        timer.wrap(eventbridge_service, 'update_rule_schedule', 'EventBridgeRule', lambda rule_name, *args: rule_name)
+    return ProcessorRunner([asg_processor, eventbridge_processor], metrics=metrics)
+
+
+def run_fleet_benchmark(asg_count, actions_per_asg, rule_count, tag_coverage=1.0, timezone_mix=None, latency=0.0,
+                        max_workers=8, prefetch_threshold=20, seed=0, metrics=None, rule_max_workers=1):
+    """Runs the processors over a synthetic fleet and reports how they
+    performed.
+
+    The fleet is processed twice, each time from a freshly generated copy:
+    once to measure the time, and once under tracemalloc to measure the peak
+    memory, as tracing slows everything down.
+
+    Args:
+        asg_count, actions_per_asg, rule_count, tag_coverage, timezone_mix,
+            seed: The shape of the fleet, as given to generate_fleet.
+        latency: The simulated latency of every API call, in seconds.
+        max_workers: The maximum number of ASGs processed concurrently.
+        prefetch_threshold: The number of enabled ASGs from which all
+            scheduled actions are retrieved at once, or None to never do so.
+        metrics: An optional MetricsCollector given to the processors in the
+            timed run. Its values are included in the report.
+        rule_max_workers: The maximum number of rules updated concurrently.
+
+    Returns:
+        A JSON-serializable dict with the parameters of the run, its
+        duration, the throughput in resources per second, the number of
+        changes and failures, the API calls per operation, the p50 and p99
+        of the time spent per resource and the peak memory in bytes.
+    """
+    def build(counter, timer=None, metrics=None):
+        fleet = generate_fleet(asg_count, actions_per_asg, rule_count, tag_coverage, timezone_mix, seed=seed)
+        return _build_runner(fleet, counter, timer, max_workers, prefetch_threshold, metrics,
+                             rule_max_workers=rule_max_workers)
+
+    counter = ApiCallCounter(latency)
+    timer = ResourceTimer()
+    runner = build(counter, timer, metrics)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        results = runner.run()
+        duration = time.perf_counter() - start
+
+        runner = build(ApiCallCounter(latency))
+        tracemalloc.start()
+        try:
+            runner.run()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    for result in results:
+        if result.error is not None:
+            raise result.error
+
+    resource_count = asg_count + rule_count
+    report = {
+        'parameters': {
+            'asg_count': asg_count,
+            'actions_per_asg': actions_per_asg,
+            'rule_count': rule_count,
+            'tag_coverage': tag_coverage,
+            'timezone_mix': timezone_mix or DEFAULT_TIMEZONE_MIX,
+            'latency': latency,
+            'max_workers': max_workers,
+            'prefetch_threshold': prefetch_threshold,
+            'rule_max_workers': rule_max_workers,
+            'seed': seed
+        },
+        'duration_seconds': round(duration, 6),
+        'throughput_per_second': round(resource_count / duration, 3),
+        'change_count': len(ProcessorRunner.merge_changes(results)),
+        'failure_count': len(ProcessorRunner.merge_failures(results)),
+        'api_calls': counter.get_counts(),
+        'api_call_count': sum(counter.get_counts().values()),
+        'resource_latency_ms': timer.get_percentiles(),
+        'peak_memory_bytes': peak_memory
+    }
+    if metrics is not None and metrics.enabled:
+        report['metrics'] = metrics.get_values()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the processors over a synthetic fleet and prints a JSON report.')
+    parser.add_argument('--asgs', type=int, default=1000)
+    parser.add_argument('--actions', type=int, default=5)
+    parser.add_argument('--rules', type=int, default=1000)
+    parser.add_argument('--tag-coverage', type=float, default=1.0)
+    parser.add_argument('--timezones', type=json.loads, default=None,
+                        help='a JSON object mapping timezone names to their weight')
+    parser.add_argument('--latency', type=float, default=0.005, help='the latency of every API call, in seconds')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--prefetch-threshold', type=int, default=20)
+    parser.add_argument('--rule-max-workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run_fleet_benchmark(args.asgs, args.actions, args.rules, args.tag_coverage, args.timezones, args.latency,
+                                 args.max_workers, args.prefetch_threshold, args.seed,
+                                 rule_max_workers=args.rule_max_workers)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
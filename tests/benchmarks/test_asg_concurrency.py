@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+from lib.processors.autoscaling import AutoScalingGroupProcessor
+from lib.services import AutoScalingService
+
+ASG_COUNT = 40
+LATENCY = 0.01
+
+
+class SlowAutoScalingService(AutoScalingService):
+    """An AutoScalingService stand-in which simulates the latency of the
+    Auto Scaling API on every call."""
+    def __init__(self, asgs, latency):
+        super().__init__(client=object())
+        self._asgs = asgs
+        self._latency = latency
+
+    def get_asgs(self, tag_key=None):
+        return self._asgs
+
+    def get_asg_scheduled_actions(self, asg_name):
+        time.sleep(self._latency)
+        return [{'ScheduledActionName': 'ActionOne', 'Recurrence': '0 9 * * *', 'DesiredCapacity': 1}]
+
+    def update_asg_scheduled_actions(self, asg_name, action_updates):
+        time.sleep(self._latency)
+        return {'FailedScheduledUpdateGroupActions': []}
+
+
+class FixedRecurrenceCalculator:
+    def calculate_recurrence(self, current_recurrence, expected_time, timezone, start_time=None):
+        return '0 8 * * *'
+
+    def calculate_recurrences(self, batch):
+        return [self.calculate_recurrence(*item) for item in batch]
+
+
+def _build_asgs(count):
+    return [
+        {
+            'AutoScalingGroupName': 'Asg{}'.format(i),
+            'AutoScalingGroupARN': 'Asg{}ARN'.format(i),
+            'Tags': [
+                {'Key': 'bench:enabled', 'Value': ''},
+                {'Key': 'bench:local-timezone', 'Value': 'Europe/Madrid'},
+                {'Key': 'bench:local-time:ActionOne', 'Value': '10:00'}
+            ]
+        }
+        for i in range(count)
+    ]
+
+
+def _run(max_workers):
+    service = SlowAutoScalingService(_build_asgs(ASG_COUNT), LATENCY)
+    processor = AutoScalingGroupProcessor('bench', service, FixedRecurrenceCalculator(), max_workers)
+    start = time.perf_counter()
+    changes = processor.process_resources()
+    return time.perf_counter() - start, changes
+
+
+def test_concurrent_processing_is_faster_than_serial_processing():
+    serial_time, serial_changes = _run(max_workers=1)
+    concurrent_time, concurrent_changes = _run(max_workers=8)
+
+    print('Serial: {:.3f}s, concurrent (8 workers): {:.3f}s, speedup: {:.1f}x'.format(
+        serial_time, concurrent_time, serial_time / concurrent_time))
+
+    assert concurrent_changes == serial_changes
+    assert serial_time / concurrent_time > 3
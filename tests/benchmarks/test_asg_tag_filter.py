@@ -0,0 +1,85 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import time
+from lib.services import AutoScalingService
+
+ASG_COUNT = 2000
+ENABLED_RATIO = 0.05
+INSTANCES_PER_ASG = 20
+PAGE_SIZE = 100
+PAGE_LATENCY = 0.002
+BYTE_LATENCY = 0.00000005
+
+
+class FakeAutoScalingClient:
+    """A stand-in for the Auto Scaling client which serves a synthetic fleet,
+    honouring tag-key filters and simulating a latency proportional to the
+    size of each page. It records the number of bytes it has sent."""
+    def __init__(self, asgs):
+        self._asgs = asgs
+        self.bytes_sent = 0
+
+    def get_paginator(self, operation_name):
+        assert operation_name == 'describe_auto_scaling_groups'
+        return self
+
+    def paginate(self, Filters=None):
+        asgs = self._asgs
+        if Filters:
+            keys = set(Filters[0]['Values'])
+            asgs = [asg for asg in asgs if any(tag['Key'] in keys for tag in asg['Tags'])]
+        for i in range(0, max(len(asgs), 1), PAGE_SIZE):
+            page = {'AutoScalingGroups': asgs[i:i + PAGE_SIZE]}
+            size = len(json.dumps(page))
+            self.bytes_sent += size
+            time.sleep(PAGE_LATENCY + size * BYTE_LATENCY)
+            yield page
+
+
+def _build_fleet():
+    fleet = []
+    for i in range(ASG_COUNT):
+        tags = [{'Key': 'Name', 'Value': 'asg-{}'.format(i)}]
+        if i % int(1 / ENABLED_RATIO) == 0:
+            tags.append({'Key': 'bench:enabled', 'Value': ''})
+        fleet.append({
+            'AutoScalingGroupName': 'asg-{}'.format(i),
+            'AutoScalingGroupARN': 'arn:aws:autoscaling:asg-{}'.format(i),
+            'Tags': tags,
+            'Instances': [
+                {
+                    'InstanceId': 'i-{:017x}'.format(i * INSTANCES_PER_ASG + j),
+                    'AvailabilityZone': 'eu-west-1a',
+                    'LifecycleState': 'InService',
+                    'HealthStatus': 'Healthy',
+                    'ProtectedFromScaleIn': False
+                }
+                for j in range(INSTANCES_PER_ASG)
+            ]
+        })
+    return fleet
+
+
+def _run(fleet, tag_key):
+    client = FakeAutoScalingClient(fleet)
+    service = AutoScalingService(client)
+    start = time.perf_counter()
+    asgs = list(service.get_asgs(tag_key))
+    return time.perf_counter() - start, client.bytes_sent, asgs
+
+
+def test_tag_filter_reduces_payload_and_latency():
+    fleet = _build_fleet()
+
+    unfiltered_time, unfiltered_bytes, all_asgs = _run(fleet, None)
+    filtered_time, filtered_bytes, enabled_asgs = _run(fleet, 'bench:enabled')
+
+    print('Unfiltered: {} ASGs, {} bytes, {:.3f}s; filtered: {} ASGs, {} bytes, {:.3f}s'.format(
+        len(all_asgs), unfiltered_bytes, unfiltered_time,
+        len(enabled_asgs), filtered_bytes, filtered_time))
+
+    assert len(enabled_asgs) == ASG_COUNT * ENABLED_RATIO
+    assert filtered_bytes * 10 < unfiltered_bytes
+    assert filtered_time * 5 < unfiltered_time
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import contextlib
+import os
+import random
+import time
+from datetime import datetime
+import pytz
+from lib.recurrence import RecurrenceCalculator
+
+ACTION_COUNT = 100000
+ZONE_COUNT = 300
+# Calculating every action one by one takes too long, so the per-action cost
+# is measured on a sample.
+SAMPLE_SIZE = 2000
+
+
+class FixedTimeSource:
+    def get_current_utc_datetime(self):
+        return pytz.utc.localize(datetime(2020, 3, 27, 12))
+
+
+def _build_actions(rng):
+    zones = sorted(pytz.common_timezones)[:ZONE_COUNT]
+    rests = ['* * ? *', '? * MON-FRI *', '? * SUN *']
+    return [
+        ('{} {} {}'.format(rng.choice([0, 15, 30, 45]), rng.randrange(24), rng.choice(rests)),
+         '{:02d}:{:02d}'.format(rng.randrange(24), rng.choice([0, 30])),
+         rng.choice(zones))
+        for i in range(ACTION_COUNT)
+    ]
+
+
+def test_batch_calculation_is_faster_than_one_by_one():
+    actions = _build_actions(random.Random(300))
+    sample = actions[:SAMPLE_SIZE]
+    calculator = RecurrenceCalculator(FixedTimeSource())
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        single_results = [calculator.calculate_recurrence(*action) for action in sample]
+        single_time = (time.perf_counter() - start) / SAMPLE_SIZE
+
+        start = time.perf_counter()
+        batch_results = calculator.calculate_recurrences(actions)
+        batch_time = (time.perf_counter() - start) / ACTION_COUNT
+
+    print('One by one: {:.1f}us per action; batched: {:.1f}us per action ({} actions, {} zones); speedup: {:.1f}x'.format(
+        single_time * 1e6, batch_time * 1e6, ACTION_COUNT, ZONE_COUNT, single_time / batch_time))
+
+    assert batch_results[:SAMPLE_SIZE] == single_results
+    assert single_time / batch_time > 5
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import random
+import time
+from crontab import CronTab
+from datetime import datetime, timedelta
+import pytz
+from lib.cron import compile_cron_expression, CronExpression
+
+ITERATIONS = 5000
+
+
+def _crontab_next_run(expression, now):
+    """The previous implementation: CronTab, plus one extra second to work
+    around its float precision."""
+    return now + timedelta(seconds=CronTab(expression).next(now=now, default_utc=True) + 1)
+
+
+def _build_inputs(rng):
+    # Only shapes on which Unix cron, AWS cron and CronTab agree, so that the
+    # results can be compared.
+    rests = ['* * *', '* * ? *', '? * MON-FRI *', '? * SUN *', '1 * ? *', '* * SAT,SUN']
+    start = pytz.utc.localize(datetime(2020, 1, 1))
+    return [
+        ('{} {} {}'.format(rng.choice([0, 15, 30, 45]), rng.randrange(24), rng.choice(rests)),
+         start + timedelta(minutes=rng.randrange(2 * 366 * 1440)))
+        for i in range(ITERATIONS)
+    ]
+
+
+def _measure(function, inputs):
+    start = time.perf_counter()
+    results = [function(expression, now) for expression, now in inputs]
+    return (time.perf_counter() - start) / len(inputs), results
+
+
+def test_compiled_expressions_are_faster_than_crontab():
+    inputs = _build_inputs(random.Random(9))
+
+    crontab_time, crontab_results = _measure(_crontab_next_run, inputs)
+    compiled_time, compiled_results = _measure(lambda e, now: CronExpression(e).get_next_run(now), inputs)
+    cached_time, cached_results = _measure(lambda e, now: compile_cron_expression(e).get_next_run(now), inputs)
+
+    print('CronTab: {:.1f}us; compiled: {:.1f}us ({:.1f}x); compiled and cached: {:.1f}us ({:.1f}x)'.format(
+        crontab_time * 1e6,
+        compiled_time * 1e6, crontab_time / compiled_time,
+        cached_time * 1e6, crontab_time / cached_time))
+
+    # The previous implementation lands one second after the run.
+    assert [result.replace(second=0, microsecond=0) for result in crontab_results] == compiled_results
+    assert cached_results == compiled_results
+    assert crontab_time / compiled_time > 2
@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import collections
+import json
+import os
+from tests.benchmarks.fleet import generate_fleet, percentile, run_fleet_benchmark
+
+ASG_COUNT = 500
+ACTIONS_PER_ASG = 5
+RULE_COUNT = 500
+LATENCY = 0.002
+# When set, the report of test_fleet_report is written to this path, so that
+# it can be tracked across changes.
+REPORT_PATH_VARIABLE = 'FLEET_BENCHMARK_REPORT'
+
+
+def test_generate_fleet_follows_coverage_and_timezone_mix():
+    fleet = generate_fleet(1000, 2, 1000, tag_coverage=0.25, timezone_mix={'Europe/Madrid': 3, 'Asia/Tokyo': 1})
+    timezones = collections.Counter(tag['Value'] for asg in fleet.asgs for tag in asg['Tags']
+                                    if tag['Key'] == 'bench:local-timezone')
+    enabled_rules = [arn for arn, tags in fleet.rule_tags.items()
+                     if any(tag['Key'] == 'bench:enabled' for tag in tags)]
+
+    assert len(fleet.asgs) == 1000
+    assert all(len(actions) == 2 for actions in fleet.scheduled_actions.values())
+    assert 200 < sum(timezones.values()) < 300
+    assert 2.5 < timezones['Europe/Madrid'] / timezones['Asia/Tokyo'] < 3.5
+    assert 200 < len(enabled_rules) < 300
+    assert generate_fleet(10, 2, 10).asgs == generate_fleet(10, 2, 10).asgs
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 99) == 3
+    assert percentile([], 50) is None
+
+
+def test_fleet_report():
+    report = run_fleet_benchmark(ASG_COUNT, ACTIONS_PER_ASG, RULE_COUNT, tag_coverage=0.8, latency=LATENCY)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if os.environ.get(REPORT_PATH_VARIABLE):
+        with open(os.environ[REPORT_PATH_VARIABLE], 'w') as report_file:
+            report_file.write(text)
+
+    assert report['failure_count'] == 0
+    assert report['change_count'] > 0
+    assert report['throughput_per_second'] > 0
+    assert report['peak_memory_bytes'] > 0
+    # ASGs are listed filtered by tag and their actions are prefetched, and
+    # rule tags are retrieved in bulk, so most calls are writes.
+    assert report['api_calls']['describe_auto_scaling_groups'] <= 5
+    assert report['api_calls']['describe_scheduled_actions'] == ASG_COUNT * ACTIONS_PER_ASG // 100
+    assert 'list_tags_for_resource' not in report['api_calls']
+    for latencies in report['resource_latency_ms'].values():
+        assert 0 < latencies['p50'] <= latencies['p99']
+
+
+def test_fleet_throughput_grows_with_workers():
+    sequential = run_fleet_benchmark(ASG_COUNT, ACTIONS_PER_ASG, 0, latency=LATENCY, max_workers=1)
+    concurrent = run_fleet_benchmark(ASG_COUNT, ACTIONS_PER_ASG, 0, latency=LATENCY, max_workers=8)
+
+    print('Sequential: {} ASGs/s, concurrent: {} ASGs/s'.format(sequential['throughput_per_second'],
+                                                                concurrent['throughput_per_second']))
+
+    assert concurrent['api_calls'] == sequential['api_calls']
+    assert concurrent['throughput_per_second'] > 3 * sequential['throughput_per_second']
@@ -0,0 +1,38 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import subprocess
+import sys
+
+FUNCTION_DIR = os.path.abspath('adjust_schedule_function')
+MODULE = 'adjust_schedule.app'
+# Importing the handler module used to take ~400ms, most of it spent on
+# importing boto3 and creating clients. The budget leaves room for slow
+# machines while still catching those coming back.
+IMPORT_TIME_BUDGET_MS = 150
+RUNS = 3
+
+
+def _import_module():
+    """Imports the handler module in a fresh interpreter with -X importtime,
+    and returns a dict with the cumulative import time (in microseconds) of
+    each module that was imported."""
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(MODULE)],
+                             cwd=FUNCTION_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_handler_import_time_is_within_budget():
+    import_time_ms = min(_import_module()[MODULE] for i in range(RUNS)) / 1000
+    print('Importing {} takes {:.1f}ms (budget: {}ms)'.format(MODULE, import_time_ms, IMPORT_TIME_BUDGET_MS))
+
+    assert import_time_ms < IMPORT_TIME_BUDGET_MS
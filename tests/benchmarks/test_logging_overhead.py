@@ -0,0 +1,33 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import os
+import pytest
+from lib import logs
+from tests.benchmarks.fleet import run_fleet_benchmark
+
+
+@pytest.fixture
+def lib_logger():
+    # The records are formatted as in production, but written to devnull.
+    logger = logging.getLogger('lib')
+    saved = (logger.level, logger.handlers, logger.propagate)
+    with open(os.devnull, 'w') as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(logs.JsonFormatter())
+        logger.handlers = [handler]
+        logger.propagate = False
+        yield logger
+    logger.level, logger.handlers, logger.propagate = saved
+
+
+def test_info_level_skips_per_resource_records(lib_logger):
+    lib_logger.setLevel(logging.DEBUG)
+    debug = run_fleet_benchmark(1000, 5, 1000, latency=0, max_workers=1)
+    lib_logger.setLevel(logging.INFO)
+    info = run_fleet_benchmark(1000, 5, 1000, latency=0, max_workers=1)
+
+    print('Throughput: DEBUG {}/s, INFO {}/s'.format(debug['throughput_per_second'], info['throughput_per_second']))
+
+    assert info['throughput_per_second'] > debug['throughput_per_second'] * 1.5
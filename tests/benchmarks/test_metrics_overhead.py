@@ -0,0 +1,40 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import timeit
+from lib.metrics import MetricsCollector, NullMetricsCollector
+from tests.benchmarks.fleet import run_fleet_benchmark
+
+ITERATIONS = 100000
+
+
+def _instrumented_step(metrics):
+    metrics.increment('AutoScalingGroup.Evaluated')
+    with metrics.timer('Recurrences.Time'):
+        pass
+
+
+def test_disabled_collector_is_nearly_free():
+    disabled = NullMetricsCollector()
+    enabled = MetricsCollector('Benchmark')
+
+    disabled_time = min(timeit.repeat(lambda: _instrumented_step(disabled), number=ITERATIONS, repeat=3))
+    enabled_time = min(timeit.repeat(lambda: _instrumented_step(enabled), number=ITERATIONS, repeat=3))
+
+    print('Per step: disabled {:.3f}us, enabled {:.3f}us'.format(disabled_time / ITERATIONS * 1e6,
+                                                                   enabled_time / ITERATIONS * 1e6))
+
+    assert disabled_time / ITERATIONS < 1e-6
+    assert disabled_time * 2 < enabled_time
+
+
+def test_collector_does_not_slow_down_fleet_processing():
+    disabled = run_fleet_benchmark(1000, 5, 1000, latency=0, max_workers=1, metrics=NullMetricsCollector())
+    enabled = run_fleet_benchmark(1000, 5, 1000, latency=0, max_workers=1, metrics=MetricsCollector('Benchmark'))
+
+    print('Throughput: disabled {}/s, enabled {}/s'.format(disabled['throughput_per_second'],
+                                                           enabled['throughput_per_second']))
+
+    assert enabled['metrics']['AutoScalingGroup.Evaluated'] == 1000
+    assert 'metrics' not in disabled
+    assert enabled['throughput_per_second'] > disabled['throughput_per_second'] * 0.8
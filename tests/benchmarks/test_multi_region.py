@@ -0,0 +1,57 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+from lib.processors.runner import MultiRegionRunner
+from tests.benchmarks.fleet import ApiCallCounter, _build_runner, generate_fleet
+
+REGIONS = ['us-east-1', 'eu-west-1', 'ap-northeast-1', 'sa-east-1']
+LATENCY = 0.002
+
+
+def build_regional_runners(latency, asg_count=100, rule_count=100):
+    """Builds a runner per region, each over a fleet of its own served by
+    fake services of its own, whose calls are counted per region."""
+    runners = {}
+    counters = {}
+    for seed, region in enumerate(REGIONS):
+        counters[region] = ApiCallCounter(latency)
+        runners[region] = _build_runner(generate_fleet(asg_count, 2, rule_count, seed=seed, region=region),
+                                        counters[region])
+    return runners, counters
+
+
+def test_regions_only_use_their_own_services():
+    runners, counters = build_regional_runners(0)
+    # Each region on its own, as a reference.
+    alone_runners, alone_counters = build_regional_runners(0)
+    for region in REGIONS:
+        MultiRegionRunner(alone_runners.get, [region]).run()
+
+    region_results = MultiRegionRunner(runners.get, REGIONS).run()
+    changes = MultiRegionRunner.merge_changes(region_results)
+    summaries = MultiRegionRunner.summarize(region_results)
+
+    assert [region_result.region for region_result in region_results] == REGIONS
+    assert changes
+    assert all(':{}:'.format(change['Region']) in change['ResourceArn'] for change in changes)
+    for region in REGIONS:
+        assert counters[region].get_counts() == alone_counters[region].get_counts()
+        assert summaries[region]['UpdateCount'] == sum(1 for change in changes if change['Region'] == region)
+        assert summaries[region]['FailureCount'] == 0
+
+
+def test_regions_are_processed_concurrently():
+    sequential_runners, _ = build_regional_runners(LATENCY)
+    concurrent_runners, _ = build_regional_runners(LATENCY)
+
+    start = time.perf_counter()
+    MultiRegionRunner(sequential_runners.get, REGIONS, max_workers=1).run()
+    sequential = time.perf_counter() - start
+    start = time.perf_counter()
+    MultiRegionRunner(concurrent_runners.get, REGIONS).run()
+    concurrent = time.perf_counter() - start
+
+    print('{} regions: sequential {:.3f}s, concurrent {:.3f}s'.format(len(REGIONS), sequential, concurrent))
+
+    assert concurrent * 2.5 < sequential
@@ -0,0 +1,100 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+from lib.processors.autoscaling import AutoScalingGroupProcessor
+from lib.processors.eventbridge import EventBridgeProcessor
+from lib.processors.runner import ProcessorRunner
+from lib.services import AutoScalingService, EventBridgeService
+
+RESOURCE_COUNT = 20
+LATENCY = 0.01
+
+
+class SlowAutoScalingService(AutoScalingService):
+    """An AutoScalingService stand-in which simulates the latency of the
+    Auto Scaling API on every call."""
+    def __init__(self, asgs):
+        super().__init__(client=object())
+        self._asgs = asgs
+
+    def get_asgs(self, tag_key=None):
+        return self._asgs
+
+    def get_asg_scheduled_actions(self, asg_name):
+        time.sleep(LATENCY)
+        return [{'ScheduledActionName': 'ActionOne', 'Recurrence': '0 9 * * *', 'DesiredCapacity': 1}]
+
+    def update_asg_scheduled_actions(self, asg_name, action_updates):
+        time.sleep(LATENCY)
+        return {'FailedScheduledUpdateGroupActions': []}
+
+
+class SlowEventBridgeService(EventBridgeService):
+    """An EventBridgeService stand-in which simulates the latency of the
+    EventBridge API on every call."""
+    def __init__(self, rules, tags):
+        super().__init__(client=object())
+        self._rules = rules
+        self._tags = tags
+
+    def get_scheduled_rules(self):
+        return self._rules
+
+    def get_rule_tags(self, rule_arn):
+        time.sleep(LATENCY)
+        return self._tags
+
+    def update_rule_schedule(self, rule_name, schedule):
+        time.sleep(LATENCY)
+
+
+class FixedRecurrenceCalculator:
+    def calculate_recurrences(self, batch):
+        return ['0 8 * * *'] * len(batch)
+
+
+def _build_processors():
+    asgs = [
+        {
+            'AutoScalingGroupName': 'Asg{}'.format(i),
+            'AutoScalingGroupARN': 'Asg{}ARN'.format(i),
+            'Tags': [
+                {'Key': 'bench:enabled', 'Value': ''},
+                {'Key': 'bench:local-timezone', 'Value': 'Europe/Madrid'},
+                {'Key': 'bench:local-time:ActionOne', 'Value': '10:00'}
+            ]
+        }
+        for i in range(RESOURCE_COUNT)
+    ]
+    rules = [{'Name': 'Rule{}'.format(i), 'Arn': 'Rule{}ARN'.format(i), 'ScheduleExpression': 'cron(0 9 * * ? *)'}
+             for i in range(RESOURCE_COUNT)]
+    tags = [
+        {'Key': 'bench:enabled', 'Value': ''},
+        {'Key': 'bench:local-timezone', 'Value': 'Europe/Madrid'},
+        {'Key': 'bench:local-time', 'Value': '10:00'}
+    ]
+    calculator = FixedRecurrenceCalculator()
+    return [
+        AutoScalingGroupProcessor('bench', SlowAutoScalingService(asgs), calculator),
+        EventBridgeProcessor('bench', SlowEventBridgeService(rules, tags), calculator),
+    ]
+
+
+def _run(max_workers):
+    runner = ProcessorRunner(_build_processors(), max_workers)
+    start = time.perf_counter()
+    results = runner.run()
+    return time.perf_counter() - start, ProcessorRunner.merge_changes(results)
+
+
+def test_concurrent_processors_reduce_end_to_end_latency():
+    sequential_time, sequential_changes = _run(max_workers=1)
+    concurrent_time, concurrent_changes = _run(max_workers=None)
+
+    print('Sequential: {:.3f}s, concurrent: {:.3f}s, speedup: {:.1f}x'.format(
+        sequential_time, concurrent_time, sequential_time / concurrent_time))
+
+    assert concurrent_changes == sequential_changes
+    assert len(concurrent_changes) == 2 * RESOURCE_COUNT
+    assert sequential_time / concurrent_time > 1.6
@@ -0,0 +1,27 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from tests.benchmarks.fleet import run_fleet_benchmark
+
+RULE_COUNT = 500
+LATENCY = 0.002
+
+
+def _run(rule_max_workers):
+    # The schedules of the fleet are written in UTC for their local time, so
+    # every rule in Europe/Madrid is updated, as after a DST shift.
+    return run_fleet_benchmark(0, 0, RULE_COUNT, timezone_mix={'Europe/Madrid': 1.0}, latency=LATENCY,
+                               rule_max_workers=rule_max_workers)
+
+
+def test_rule_updates_overlap_with_reads():
+    inline = _run(1)
+    queued = _run(8)
+
+    print('{} rules, {} updated: inline {:.3f}s, queued {:.3f}s'.format(
+        RULE_COUNT, inline['api_calls'].get('put_rule', 0), inline['duration_seconds'], queued['duration_seconds']))
+
+    assert queued['change_count'] == inline['change_count']
+    assert queued['api_calls'] == inline['api_calls']
+    assert inline['api_calls']['put_rule'] >= RULE_COUNT // 2
+    assert queued['duration_seconds'] * 3 < inline['duration_seconds']
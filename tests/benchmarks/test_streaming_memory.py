@@ -0,0 +1,145 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import contextlib
+import os
+import tracemalloc
+from lib.processors.autoscaling import AutoScalingGroupProcessor
+from lib.processors.eventbridge import EventBridgeProcessor
+from lib.services import AutoScalingService, EventBridgeService
+
+PAGE_SIZE = 100
+SMALL_FLEET = 1000
+LARGE_FLEET = 10000
+
+
+class FakePaginator:
+    def __init__(self, build_page, item_count):
+        self._build_page = build_page
+        self._item_count = item_count
+
+    def paginate(self, **kwargs):
+        for start in range(0, self._item_count, PAGE_SIZE):
+            yield self._build_page(start, min(start + PAGE_SIZE, self._item_count), **kwargs)
+
+
+class FakeAutoScalingClient:
+    """A stand-in for the Auto Scaling client which builds each page of a
+    synthetic fleet only when it is requested."""
+    def __init__(self, asg_count):
+        self._asg_count = asg_count
+
+    def get_paginator(self, operation_name):
+        if operation_name == 'describe_auto_scaling_groups':
+            return FakePaginator(self._build_asgs_page, self._asg_count)
+        return FakePaginator(self._build_actions_page, 1)
+
+    def _build_asgs_page(self, start, end, **kwargs):
+        return {
+            'AutoScalingGroups': [
+                {
+                    'AutoScalingGroupName': 'asg-{}'.format(i),
+                    'AutoScalingGroupARN': 'arn:asg-{}'.format(i),
+                    'Tags': [
+                        {'Key': 'bench:enabled', 'Value': ''},
+                        {'Key': 'bench:local-timezone', 'Value': 'Europe/Madrid'},
+                        {'Key': 'bench:local-time:ActionOne', 'Value': '10:00'}
+                    ],
+                    'Instances': [{'InstanceId': 'i-{:017x}'.format(i * 10 + j)} for j in range(10)]
+                }
+                for i in range(start, end)
+            ]
+        }
+
+    def _build_actions_page(self, start, end, AutoScalingGroupName):
+        return {
+            'ScheduledUpdateGroupActions': [
+                {
+                    'AutoScalingGroupName': AutoScalingGroupName,
+                    'ScheduledActionName': 'ActionOne',
+                    'Recurrence': '0 9 * * *',
+                    'DesiredCapacity': 1
+                }
+            ]
+        }
+
+
+class FakeEventBridgeClient:
+    """A stand-in for the EventBridge client which builds each page of a
+    synthetic set of rules only when it is requested."""
+    def __init__(self, rule_count):
+        self._rule_count = rule_count
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self._build_rules_page, self._rule_count)
+
+    def _build_rules_page(self, start, end, **kwargs):
+        return {
+            'Rules': [
+                {
+                    'Name': 'rule-{}'.format(i),
+                    'Arn': 'arn:rule-{}'.format(i),
+                    'ScheduleExpression': 'cron(0 9 * * ? *)',
+                    'Description': 'x' * 200
+                }
+                for i in range(start, end)
+            ]
+        }
+
+    def list_tags_for_resource(self, ResourceARN):
+        return {'Tags': [
+            {'Key': 'bench:enabled', 'Value': ''},
+            {'Key': 'bench:local-timezone', 'Value': 'Europe/Madrid'},
+            {'Key': 'bench:local-time', 'Value': '10:00'}
+        ]}
+
+
+class UnchangedRecurrenceCalculator:
+    def calculate_recurrence(self, current_recurrence, expected_time, timezone, start_time=None):
+        return current_recurrence
+
+    def calculate_recurrences(self, batch):
+        return [self.calculate_recurrence(*item) for item in batch]
+
+
+def _measure_peak_memory(processor):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        tracemalloc.start()
+        try:
+            for change in processor.iter_changes():
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def _asg_processor(asg_count):
+    return AutoScalingGroupProcessor('bench',
+                                     AutoScalingService(FakeAutoScalingClient(asg_count)),
+                                     UnchangedRecurrenceCalculator())
+
+
+def _eventbridge_processor(rule_count):
+    return EventBridgeProcessor('bench',
+                                EventBridgeService(FakeEventBridgeClient(rule_count)),
+                                UnchangedRecurrenceCalculator())
+
+
+def test_asg_processor_peak_memory_does_not_grow_with_fleet_size():
+    small_peak = _measure_peak_memory(_asg_processor(SMALL_FLEET))
+    large_peak = _measure_peak_memory(_asg_processor(LARGE_FLEET))
+
+    print('ASG peak memory: {} bytes for {} ASGs, {} bytes for {} ASGs'.format(
+        small_peak, SMALL_FLEET, large_peak, LARGE_FLEET))
+
+    assert large_peak < small_peak * 1.5
+
+
+def test_eventbridge_processor_peak_memory_does_not_grow_with_rule_count():
+    small_peak = _measure_peak_memory(_eventbridge_processor(SMALL_FLEET))
+    large_peak = _measure_peak_memory(_eventbridge_processor(LARGE_FLEET))
+
+    print('EventBridge peak memory: {} bytes for {} rules, {} bytes for {} rules'.format(
+        small_peak, SMALL_FLEET, large_peak, LARGE_FLEET))
+
+    assert large_peak < small_peak * 1.5
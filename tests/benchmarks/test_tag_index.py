@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+from lib import utils
+from lib.processors.autoscaling import AutoScalingGroupProcessor
+from lib.services import AutoScalingService
+
+ASG_COUNT = 200
+# The most tags an ASG can have, 3 of which configure the adjuster, and the
+# rest the local time of its first actions.
+TAG_COUNT = 50
+ACTION_COUNT = 100
+
+
+class FixedAutoScalingService(AutoScalingService):
+    def __init__(self, asgs, scheduled_actions):
+        super().__init__(client=object())
+        self._asgs = asgs
+        self._scheduled_actions = scheduled_actions
+
+    def get_asgs(self, tag_key=None):
+        return self._asgs
+
+    def get_asg_scheduled_actions(self, asg_name):
+        return self._scheduled_actions
+
+
+class UnchangedRecurrenceCalculator:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def calculate_recurrences(self, batch):
+        self.batch_sizes.append(len(batch))
+        return [current_recurrence for current_recurrence, expected_time, timezone in batch]
+
+
+def _build_fleet():
+    actions = [{'ScheduledActionName': 'Action{:03d}'.format(i), 'Recurrence': '0 9 * * *', 'DesiredCapacity': 1}
+               for i in range(ACTION_COUNT)]
+    tags = [
+        {'Key': 'bench:enabled', 'Value': ''},
+        {'Key': 'bench:local-timezone', 'Value': 'Europe/Madrid'},
+        {'Key': 'Name', 'Value': 'asg'}
+    ]
+    tags += [{'Key': 'bench:local-time:' + action['ScheduledActionName'], 'Value': '10:00'}
+             for action in actions[:TAG_COUNT - len(tags)]]
+    asgs = [{'AutoScalingGroupName': 'Asg{}'.format(i), 'AutoScalingGroupARN': 'Asg{}ARN'.format(i), 'Tags': tags}
+            for i in range(ASG_COUNT)]
+    return asgs, actions
+
+
+def _look_up_per_action(asgs, actions):
+    """The lookups made before the tags were indexed: one scan of the tags per
+    action, with the tag keys formatted every time."""
+    local_times = []
+    for asg in asgs:
+        for action in actions:
+            local_times.append(utils.get_tag_by_key(asg['Tags'], '%s:%s' % ('bench', 'local-time') + ':' +
+                                                    action['ScheduledActionName']))
+    return local_times
+
+
+def _look_up_indexed(asgs, actions):
+    local_times = []
+    for asg in asgs:
+        tags = utils.TagIndex(asg['Tags'], 'bench:local-time:')
+        for action in actions:
+            local_times.append(tags.get_local_time(action['ScheduledActionName']))
+    return local_times
+
+
+def _time(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def test_tag_index_lookups_are_faster_than_per_action_scans():
+    asgs, actions = _build_fleet()
+
+    per_action_time, per_action_local_times = _time(_look_up_per_action, asgs, actions)
+    indexed_time, indexed_local_times = _time(_look_up_indexed, asgs, actions)
+
+    print('{} ASGs with {} tags and {} actions: per-action scans {:.3f}s, indexed {:.3f}s'.format(
+        ASG_COUNT, TAG_COUNT, ACTION_COUNT, per_action_time, indexed_time))
+
+    assert indexed_local_times == per_action_local_times
+    assert indexed_time * 5 < per_action_time
+
+
+def test_processor_evaluates_asgs_with_many_tags_and_actions():
+    asgs, actions = _build_fleet()
+    calculator = UnchangedRecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('bench', FixedAutoScalingService(asgs, actions), calculator)
+
+    duration, changes = _time(processor.process_resources)
+
+    print('{} ASGs with {} tags and {} actions processed in {:.3f}s'.format(
+        ASG_COUNT, TAG_COUNT, ACTION_COUNT, duration))
+
+    assert changes == []
+    assert processor.get_failures() == []
+    # Only the actions with a local time tag are evaluated.
+    assert calculator.batch_sizes == [TAG_COUNT - 3] * ASG_COUNT
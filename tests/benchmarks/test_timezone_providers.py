@@ -0,0 +1,69 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from lib import timezones
+
+CONVERSION_COUNT = 100000
+TRANSITION_LOOKUP_COUNT = 20000
+
+
+def _measure(function, count):
+    """Returns the time per call of the function, in microseconds."""
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) / count * 1000000
+
+
+def _measure_import(statement):
+    """Returns the cumulative import time of the statement in a fresh
+    interpreter, in milliseconds."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return sum(int(line.split('|')[0][len('import time:'):]) for line in process.stderr.splitlines()
+               if line.startswith('import time:') and 'self [us]' not in line) / 1000
+
+
+def _benchmark(provider_class, names, moments):
+    provider = provider_class()
+    lookup = _measure(lambda: [provider.get_zone(name) for name in names], len(names))
+    cached_lookup = _measure(lambda: [provider.get_zone(name) for name in names], len(names))
+    conversion = _measure(lambda: [provider.get_utc_offset(name, moment) for name, moment in moments],
+                          len(moments))
+    transitions = _measure(lambda: [provider.get_next_transition(name, moment)
+                                    for name, moment in moments[:TRANSITION_LOOKUP_COUNT]],
+                           TRANSITION_LOOKUP_COUNT)
+    return {
+        'first_lookup_us': round(lookup, 2),
+        'cached_lookup_us': round(cached_lookup, 2),
+        'conversion_us': round(conversion, 2),
+        'next_transition_us': round(transitions, 2),
+    }
+
+
+def test_compare_timezone_providers():
+    pytest.importorskip('zoneinfo')
+    rng = random.Random(2021)
+    names = sorted(pytz.common_timezones)
+    moments = [(rng.choice(names), datetime(2021, 1, 1) + timedelta(minutes=rng.randrange(366 * 1440)))
+               for i in range(CONVERSION_COUNT)]
+
+    results = {}
+    for provider_class, module in [(timezones.PytzProvider, 'pytz'), (timezones.ZoneInfoProvider, 'zoneinfo')]:
+        results[provider_class.name] = _benchmark(provider_class, names, moments)
+        results[provider_class.name]['import_ms'] = round(_measure_import('import {}'.format(module)), 2)
+
+    print(json.dumps(results, indent=2))
+    # Both providers must agree on the offsets they were benchmarked on (up
+    # to differences between the versions of their tz databases).
+    pytz_provider, zoneinfo_provider = timezones.PytzProvider(), timezones.ZoneInfoProvider()
+    agreeing = sum(pytz_provider.get_utc_offset(name, moment) == zoneinfo_provider.get_utc_offset(name, moment)
+                   for name, moment in moments[:1000])
+    assert agreeing >= 990
@@ -1,12 +1,24 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+from datetime import datetime, timedelta
+from lib.metrics import MetricsCollector
 from lib.processors.autoscaling import AutoScalingGroupProcessor
 from lib.recurrence import RecurrenceCalculator
 from lib.services import AutoScalingService
+from lib.state import ResourceState, SQLiteStateStore
+from lib.timezones import TransitionWindow
 import pytest
+import pytz
 
 
+class FixedTimeSource:
+    def __init__(self, now):
+        self.now = now
+
+    def get_current_utc_datetime(self):
+        return self.now
+
 def test_process_resources_with_different_recurrence(mocker):
     asgs = [
         {
@@ -42,13 +54,12 @@ def test_process_resources_with_different_recurrence(mocker):
     mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
     mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
     mocker.patch.object(asg_svc, 'update_asg_scheduled_actions')
-    mocker.patch.object(rec_calc, 'calculate_recurrence', return_value='NewRecurrence')
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
 
     result = processor.process_resources()
 
-    rec_calc.calculate_recurrence.assert_called_once_with('OriginalRecurrence',
-                                                          '10:00',
-                                                          'Europe/Madrid')
+    asg_svc.get_asgs.assert_called_once_with('foo:bar:enabled')
+    rec_calc.calculate_recurrences.assert_called_once_with([('OriginalRecurrence', '10:00', 'Europe/Madrid')])
     asg_svc.update_asg_scheduled_actions.assert_called_once_with(
         'MyAsg',
         [
@@ -108,13 +119,11 @@ def test_process_resources_with_different_recurrence_and_custom_tag_prefix(mocke
     mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
     mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
     mocker.patch.object(asg_svc, 'update_asg_scheduled_actions')
-    mocker.patch.object(rec_calc, 'calculate_recurrence', return_value='NewRecurrence')
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
 
     result = processor.process_resources()
 
-    rec_calc.calculate_recurrence.assert_called_once_with('OriginalRecurrence',
-                                                          '10:00',
-                                                          'Europe/Madrid')
+    rec_calc.calculate_recurrences.assert_called_once_with([('OriginalRecurrence', '10:00', 'Europe/Madrid')])
     asg_svc.update_asg_scheduled_actions.assert_called_once_with(
         'MyAsg',
         [
@@ -174,7 +183,7 @@ def test_process_resources_with_same_recurrence(mocker):
     mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
     mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
     mocker.patch.object(asg_svc, 'update_asg_scheduled_actions')
-    mocker.patch.object(rec_calc, 'calculate_recurrence', return_value='OriginalRecurrence')
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['OriginalRecurrence'] * len(batch))
 
     result = processor.process_resources()
 
@@ -243,3 +252,322 @@ def test_process_asg_without_action_time_tag(mocker):
     result = processor.process_resources()
 
     assert len(result) == 0
+
+def _build_asg(name):
+    return {
+        'AutoScalingGroupName': name,
+        'AutoScalingGroupARN': name + 'ARN',
+        'Tags': [
+            {'Key': 'foo:bar:enabled', 'Value': ''},
+            {'Key': 'foo:bar:local-timezone', 'Value': 'Europe/Madrid'},
+            {'Key': 'foo:bar:local-time:ActionOne', 'Value': '10:00'}
+        ]
+    }
+
+def test_process_resources_concurrently_keeps_asg_order(mocker):
+    asgs = [_build_asg('Asg{}'.format(i)) for i in range(20)]
+    scheduled_actions = [
+        {
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': 'OriginalRecurrence',
+            'DesiredCapacity': 123
+        }
+    ]
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc, max_workers=4)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions',
+                        return_value={'FailedScheduledUpdateGroupActions': []})
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
+
+    result = processor.process_resources()
+
+    assert [change['ResourceName'] for change in result] == [asg['AutoScalingGroupName'] for asg in asgs]
+    assert asg_svc.update_asg_scheduled_actions.call_count == 20
+    assert processor.get_failures() == []
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_process_resources_reports_failures_per_asg(mocker, max_workers):
+    asgs = [_build_asg('AsgOne'), _build_asg('AsgTwo'), _build_asg('AsgThree')]
+    scheduled_actions = [
+        {
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': 'OriginalRecurrence',
+            'DesiredCapacity': 123
+        }
+    ]
+    def update(asg_name, action_updates):
+        if asg_name == 'AsgTwo':
+            return {'FailedScheduledUpdateGroupActions': [{'ScheduledActionName': 'ActionOne'}]}
+        return {'FailedScheduledUpdateGroupActions': []}
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc, max_workers=max_workers)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions', side_effect=update)
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
+
+    result = processor.process_resources()
+
+    assert [change['ResourceName'] for change in result] == ['AsgOne', 'AsgThree']
+    assert processor.get_failures() == [
+        {'ResourceName': 'AsgTwo', 'Error': '1 actions failed to update'}
+    ]
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_process_resources_continues_after_asg_error(mocker, max_workers):
+    asgs = [_build_asg('AsgOne'), _build_asg('AsgTwo'), _build_asg('AsgThree')]
+    scheduled_actions = [
+        {
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': 'OriginalRecurrence',
+            'DesiredCapacity': 123
+        }
+    ]
+    def get_actions(asg_name):
+        if asg_name == 'AsgOne':
+            raise Exception('Boom')
+        return scheduled_actions
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc, max_workers=max_workers)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', side_effect=get_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions',
+                        return_value={'FailedScheduledUpdateGroupActions': []})
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
+
+    result = processor.process_resources()
+
+    assert [change['ResourceName'] for change in result] == ['AsgTwo', 'AsgThree']
+    assert processor.get_failures() == [{'ResourceName': 'AsgOne', 'Error': 'Boom'}]
+
+def test_process_resources_reports_updated_actions_of_partially_failed_asg(mocker):
+    asgs = [_build_asg('AsgOne')]
+    asgs[0]['Tags'].append({'Key': 'foo:bar:local-time:ActionTwo', 'Value': '20:00'})
+    scheduled_actions = [
+        {
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': 'OriginalRecurrence',
+            'DesiredCapacity': 123
+        },
+        {
+            'ScheduledActionName': 'ActionTwo',
+            'Recurrence': 'OriginalRecurrence',
+            'DesiredCapacity': 123
+        }
+    ]
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions',
+                        return_value={'FailedScheduledUpdateGroupActions': [{'ScheduledActionName': 'ActionOne'}]})
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
+
+    result = processor.process_resources()
+
+    assert [change['AdditionalDetails']['ActionName'] for change in result] == ['ActionTwo']
+    assert processor.get_failures() == [{'ResourceName': 'AsgOne', 'Error': '1 actions failed to update'}]
+
+def test_process_resources_retrieves_actions_per_asg_below_prefetch_threshold(mocker):
+    asgs = [_build_asg('AsgOne'), _build_asg('AsgTwo')]
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc, prefetch_threshold=3)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=[])
+    mocker.patch.object(asg_svc, 'get_all_scheduled_actions')
+
+    processor.process_resources()
+
+    asg_svc.get_all_scheduled_actions.assert_not_called()
+    assert asg_svc.get_asg_scheduled_actions.call_count == 2
+
+def test_process_resources_prefetches_actions_from_prefetch_threshold(mocker):
+    asgs = [_build_asg('AsgOne'), _build_asg('AsgTwo'), _build_asg('AsgThree'),
+            {'AutoScalingGroupName': 'Disabled', 'AutoScalingGroupARN': 'DisabledARN', 'Tags': []}]
+    def action(asg_name):
+        return {
+            'AutoScalingGroupName': asg_name,
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': 'OriginalRecurrence',
+            'DesiredCapacity': 123
+        }
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc, prefetch_threshold=3)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions')
+    mocker.patch.object(asg_svc, 'get_all_scheduled_actions',
+                        return_value={'AsgOne': [action('AsgOne')], 'AsgThree': [action('AsgThree')]})
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions',
+                        return_value={'FailedScheduledUpdateGroupActions': []})
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
+
+    result = processor.process_resources()
+
+    asg_svc.get_all_scheduled_actions.assert_called_once_with()
+    asg_svc.get_asg_scheduled_actions.assert_not_called()
+    assert [change['ResourceName'] for change in result] == ['AsgOne', 'AsgThree']
+
+def test_process_resources_filters_asgs_with_empty_tag_prefix(mocker):
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('', asg_svc, rec_calc)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=[])
+
+    result = processor.process_resources()
+
+    asg_svc.get_asgs.assert_called_once_with(':enabled')
+    assert result == []
+
+def test_process_resources_skips_asgs_outside_transition_window(mocker):
+    asgs = [_build_asg('AsgOne')]
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    window = TransitionWindow.around(datetime(2020, 6, 1), timedelta(days=7))
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions')
+
+    result = processor.process_resources(window)
+
+    asg_svc.get_asg_scheduled_actions.assert_not_called()
+    assert result == []
+    assert processor.get_skipped_count() == 1
+    assert processor.get_timezones() == {'Europe/Madrid'}
+
+def test_process_resources_evaluates_asgs_inside_transition_window(mocker):
+    asgs = [_build_asg('AsgOne')]
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    window = TransitionWindow.around(datetime(2020, 3, 25), timedelta(days=7))
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=[])
+
+    processor.process_resources(window)
+
+    asg_svc.get_asg_scheduled_actions.assert_called_once_with('AsgOne')
+    assert processor.get_skipped_count() == 0
+
+def test_process_resources_skips_asgs_unchanged_since_last_verified(mocker):
+    asgs = [_build_asg('AsgOne'), _build_asg('AsgTwo')]
+    scheduled_actions = [
+        {
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': '0 8 * * *',
+            'DesiredCapacity': 123
+        }
+    ]
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 6, 1)))
+    state = ResourceState(SQLiteStateStore(), time_source)
+    asg_svc = AutoScalingService()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, RecurrenceCalculator(time_source), state=state)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
+
+    state.start_run()
+    assert processor.process_resources() == []
+    assert state.save() == 2
+
+    # Once verified, the ASGs are skipped until their tags change.
+    asgs[1]['Tags'][2]['Value'] = '11:00'
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions',
+                        return_value={'FailedScheduledUpdateGroupActions': []})
+    asg_svc.get_asg_scheduled_actions.reset_mock()
+    state.start_run()
+    result = processor.process_resources()
+
+    asg_svc.get_asg_scheduled_actions.assert_called_once_with('AsgTwo')
+    assert [change['NewRecurrence'] for change in result] == ['0 9 * * *']
+    assert state.get_unchanged_count() == 1
+
+    # The ASGs are evaluated again before the next offset change.
+    asg_svc.get_asg_scheduled_actions.reset_mock()
+    state.save()
+    time_source.now = pytz.utc.localize(datetime(2020, 10, 24, 12))
+    state.start_run()
+    processor.process_resources()
+
+    assert asg_svc.get_asg_scheduled_actions.call_count == 2
+
+def test_process_resources_does_not_record_partially_failed_asgs(mocker):
+    scheduled_actions = [
+        {
+            'ScheduledActionName': 'ActionOne',
+            'Recurrence': '0 0 * * *',
+            'DesiredCapacity': 123
+        }
+    ]
+    state = ResourceState(SQLiteStateStore())
+    asg_svc = AutoScalingService()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, RecurrenceCalculator(), state=state)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=[_build_asg('AsgOne')])
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions',
+                        return_value={'FailedScheduledUpdateGroupActions': [{'ScheduledActionName': 'ActionOne'}]})
+
+    state.start_run()
+    processor.process_resources()
+
+    assert state.save() == 0
+
+def test_process_resources_records_metrics(mocker):
+    asgs = [_build_asg('AsgOne'), _build_asg('AsgTwo'), _build_asg('AsgThree')]
+    asgs[2]['Tags'][1]['Value'] = 'Asia/Tokyo'
+    asg_svc = AutoScalingService()
+    rec_calc = RecurrenceCalculator()
+    metrics = MetricsCollector('Adjuster')
+    window = TransitionWindow.around(datetime(2020, 3, 25), timedelta(days=7))
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc, metrics=metrics)
+    def get_asg_scheduled_actions(asg_name):
+        if asg_name == 'AsgTwo':
+            raise ValueError('Boom')
+        return [{'ScheduledActionName': 'ActionOne', 'Recurrence': '0 9 * * *', 'DesiredCapacity': 1}]
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=asgs)
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', side_effect=get_asg_scheduled_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions', return_value={'FailedScheduledUpdateGroupActions': []})
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['0 8 * * *'] * len(batch))
+
+    processor.process_resources(window)
+
+    assert metrics.get_values() == {
+        'AutoScalingGroup.Evaluated': 2,
+        'AutoScalingGroup.Updated': 1,
+        'AutoScalingGroup.Failed': 1,
+        'AutoScalingGroup.SkippedOutsideWindow': 1
+    }
+
+def test_process_resources_updates_asgs_with_hundreds_of_actions(mocker):
+    action_names = ['Action{:03d}'.format(i) for i in range(300)]
+    asg = _build_asg('MyAsg')
+    asg['Tags'] = asg['Tags'][:2] + [{'Key': 'foo:bar:local-time:' + name, 'Value': '10:00'} for name in action_names]
+    scheduled_actions = [{'ScheduledActionName': name, 'Recurrence': 'OriginalRecurrence', 'DesiredCapacity': 1}
+                         for name in action_names]
+    sent = []
+    def update(asg_name, action_updates):
+        sent.append(len(action_updates))
+        return {'FailedScheduledUpdateGroupActions': [
+            {'ScheduledActionName': action['ScheduledActionName'], 'ErrorCode': 'AlreadyExists'}
+            for action in action_updates if action['ScheduledActionName'] == 'Action123'
+        ]}
+    asg_svc = AutoScalingService(sleep=lambda seconds: None)
+    rec_calc = RecurrenceCalculator()
+    processor = AutoScalingGroupProcessor('foo:bar', asg_svc, rec_calc)
+    mocker.patch.object(asg_svc, 'get_asgs', return_value=[asg])
+    mocker.patch.object(asg_svc, 'get_asg_scheduled_actions', return_value=scheduled_actions)
+    mocker.patch.object(asg_svc, 'update_asg_scheduled_actions', side_effect=update)
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['NewRecurrence'] * len(batch))
+
+    result = processor.process_resources()
+
+    assert sorted(sent) == [50] * 6
+    assert len(result) == 299
+    assert 'Action123' not in [change['AdditionalDetails']['ActionName'] for change in result]
+    assert processor.get_failures() == [{'ResourceName': 'MyAsg', 'Error': '1 actions failed to update'}]
@@ -1,12 +1,30 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import boto3
+import threading
+import time
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from lib.metrics import MetricsCollector
+from lib.ratelimit import AdaptiveRateLimiter
 from lib.processors.eventbridge import EventBridgeProcessor
 from lib.recurrence import RecurrenceCalculator
-from lib.services import EventBridgeService
+from lib.services import EventBridgeService, TaggingService
+from lib.state import ResourceState, SQLiteStateStore
+from lib.timezones import TransitionWindow
 import pytest
+import pytz
 
 
+class FixedTimeSource:
+    def __init__(self, now):
+        self.now = now
+
+    def get_current_utc_datetime(self):
+        return self.now
+
 def test_process_resources_updates_schedule_when_recurrences_are_different(mocker):
     rules = [{'Name': 'ruleName', 'Arn': 'ruleArn', 'ScheduleExpression': 'cron(foo)'}]
     tags = [
@@ -20,12 +38,12 @@ def test_process_resources_updates_schedule_when_recurrences_are_different(mocke
     mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
     mocker.patch.object(eb_svc, 'get_rule_tags', return_value=tags)
     mocker.patch.object(eb_svc, 'update_rule_schedule', return_value=None)
-    mocker.patch.object(rec_calc, 'calculate_recurrence', return_value='bar')
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['bar'] * len(batch))
 
     changes = processor.process_resources()
 
     eb_svc.get_rule_tags.assert_called_once_with('ruleArn')
-    rec_calc.calculate_recurrence.assert_called_once_with('foo', '10:00', 'Europe/Madrid')
+    rec_calc.calculate_recurrences.assert_called_once_with([('foo', '10:00', 'Europe/Madrid')])
     eb_svc.update_rule_schedule.assert_called_once_with('ruleName', 'cron(bar)')
     assert len(changes) == 1
     assert changes[0] == {
@@ -51,7 +69,7 @@ def test_process_resources_skips_update_when_an_exception_is_thrown_when_updatin
     mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
     mocker.patch.object(eb_svc, 'get_rule_tags', return_value=tags)
     mocker.patch.object(eb_svc, 'update_rule_schedule', side_effect=Exception('mocked exception'))
-    mocker.patch.object(rec_calc, 'calculate_recurrence', return_value='bar')
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['bar'] * len(batch))
 
     changes = processor.process_resources()
 
@@ -70,7 +88,7 @@ def test_process_resources_with_same_recurrence(mocker):
     processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc)
     mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
     mocker.patch.object(eb_svc, 'get_rule_tags', return_value=tags)
-    mocker.patch.object(rec_calc, 'calculate_recurrence', return_value='foo')
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['foo'] * len(batch))
 
     changes = processor.process_resources()
 
@@ -121,3 +139,291 @@ def test_process_resources_without_local_time_tag(mocker):
 
     eb_svc.get_rule_tags.assert_called_once_with('ruleArn')
     assert len(changes) == 0
+
+def test_process_resources_uses_bulk_tags_when_tagging_service_is_available(mocker):
+    rules = [
+        {'Name': 'rule{}'.format(i), 'Arn': 'ruleArn{}'.format(i), 'ScheduleExpression': 'cron(foo)'}
+        for i in range(100)
+    ]
+    tags_by_arn = {
+        'ruleArn7': [
+            {'Key': 'foo:bar:enabled', 'Value': ''},
+            {'Key': 'foo:bar:local-timezone', 'Value': 'Europe/Madrid'},
+            {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+        ]
+    }
+    eb_svc = EventBridgeService()
+    tagging_svc = TaggingService()
+    rec_calc = RecurrenceCalculator()
+    processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc, tagging_svc)
+    mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
+    mocker.patch.object(eb_svc, 'get_rule_tags')
+    mocker.patch.object(eb_svc, 'update_rule_schedule', return_value=None)
+    mocker.patch.object(tagging_svc, 'get_resource_tags_by_tag_key', return_value=tags_by_arn)
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['bar'] * len(batch))
+
+    changes = processor.process_resources()
+
+    tagging_svc.get_resource_tags_by_tag_key.assert_called_once_with('events:rule', 'foo:bar:enabled')
+    eb_svc.get_rule_tags.assert_not_called()
+    rec_calc.calculate_recurrences.assert_called_once_with([('foo', '10:00', 'Europe/Madrid')])
+    eb_svc.update_rule_schedule.assert_called_once_with('rule7', 'cron(bar)')
+    assert [change['ResourceName'] for change in changes] == ['rule7']
+
+def test_process_resources_falls_back_to_per_rule_tags_when_bulk_retrieval_fails(mocker):
+    rules = [
+        {'Name': 'ruleOne', 'Arn': 'ruleArnOne', 'ScheduleExpression': 'cron(foo)'},
+        {'Name': 'ruleTwo', 'Arn': 'ruleArnTwo', 'ScheduleExpression': 'cron(foo)'}
+    ]
+    eb_svc = EventBridgeService()
+    tagging_svc = TaggingService()
+    rec_calc = RecurrenceCalculator()
+    processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc, tagging_svc)
+    mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
+    mocker.patch.object(eb_svc, 'get_rule_tags', return_value=[])
+    mocker.patch.object(tagging_svc, 'get_resource_tags_by_tag_key', side_effect=Exception('AccessDenied'))
+
+    changes = processor.process_resources()
+
+    assert eb_svc.get_rule_tags.call_count == 2
+    assert len(changes) == 0
+
+def test_process_resources_api_call_counts_with_stubbed_clients():
+    events_client = boto3.client('events')
+    tagging_client = boto3.client('resourcegroupstaggingapi')
+    events_stubber = Stubber(events_client)
+    tagging_stubber = Stubber(tagging_client)
+    rules = [
+        {'Name': 'rule{}'.format(i), 'Arn': 'ruleArn{}'.format(i), 'ScheduleExpression': 'cron(0 10 * * ? *)'}
+        for i in range(50)
+    ]
+    events_stubber.add_response('list_rules', {'Rules': rules}, {'EventBusName': 'default'})
+    tagging_stubber.add_response('get_resources',
+                                 {
+                                     'ResourceTagMappingList': [
+                                         {
+                                             'ResourceARN': 'ruleArn3',
+                                             'Tags': [
+                                                 {'Key': 'foo:bar:enabled', 'Value': ''},
+                                                 {'Key': 'foo:bar:local-timezone', 'Value': 'UTC'},
+                                                 {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+                                             ]
+                                         }
+                                     ]
+                                 },
+                                 {'TagFilters': [{'Key': 'foo:bar:enabled'}], 'ResourceTypeFilters': ['events:rule']})
+    calls = []
+    for client in (events_client, tagging_client):
+        client.meta.events.register('before-call.*.*',
+                                    lambda model, **kwargs: calls.append(model.name))
+    processor = EventBridgeProcessor('foo:bar',
+                                     EventBridgeService(events_client),
+                                     RecurrenceCalculator(),
+                                     TaggingService(tagging_client))
+
+    with events_stubber, tagging_stubber:
+        changes = processor.process_resources()
+        events_stubber.assert_no_pending_responses()
+        tagging_stubber.assert_no_pending_responses()
+
+    assert calls == ['GetResources', 'ListRules']
+    assert changes == []
+
+def test_process_resources_skips_rules_outside_transition_window(mocker):
+    rules = [
+        {'Name': 'madridRule', 'Arn': 'madridArn', 'ScheduleExpression': 'cron(foo)'},
+        {'Name': 'tokyoRule', 'Arn': 'tokyoArn', 'ScheduleExpression': 'cron(foo)'}
+    ]
+    tags = {
+        'madridArn': [
+            {'Key': 'foo:bar:enabled', 'Value': ''},
+            {'Key': 'foo:bar:local-timezone', 'Value': 'Europe/Madrid'},
+            {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+        ],
+        'tokyoArn': [
+            {'Key': 'foo:bar:enabled', 'Value': ''},
+            {'Key': 'foo:bar:local-timezone', 'Value': 'Asia/Tokyo'},
+            {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+        ]
+    }
+    eb_svc = EventBridgeService()
+    rec_calc = RecurrenceCalculator()
+    window = TransitionWindow.around(datetime(2020, 3, 25), timedelta(days=7))
+    processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc)
+    mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
+    mocker.patch.object(eb_svc, 'get_rule_tags', side_effect=lambda arn: tags[arn])
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['foo'] * len(batch))
+
+    changes = processor.process_resources(window)
+
+    rec_calc.calculate_recurrences.assert_called_once_with([('foo', '10:00', 'Europe/Madrid')])
+    assert processor.get_skipped_count() == 1
+    assert processor.get_timezones() == {'Europe/Madrid', 'Asia/Tokyo'}
+    assert changes == []
+
+def test_process_resources_skips_rules_unchanged_since_last_verified(mocker):
+    rules = [
+        {'Name': 'ruleOne', 'Arn': 'ruleOneArn', 'ScheduleExpression': 'cron(0 9 * * ? *)'},
+        {'Name': 'ruleTwo', 'Arn': 'ruleTwoArn', 'ScheduleExpression': 'cron(0 8 * * ? *)'}
+    ]
+    tags = [
+        {'Key': 'foo:bar:enabled', 'Value': ''},
+        {'Key': 'foo:bar:local-timezone', 'Value': 'Europe/Madrid'},
+        {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+    ]
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 15)))
+    state = ResourceState(SQLiteStateStore(), time_source)
+    eb_svc = EventBridgeService()
+    rec_calc = RecurrenceCalculator(time_source)
+    processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc, state=state)
+    mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
+    mocker.patch.object(eb_svc, 'get_rule_tags', return_value=tags)
+    mocker.patch.object(eb_svc, 'update_rule_schedule', return_value=None)
+
+    state.start_run()
+    changes = processor.process_resources()
+    assert [change['ResourceName'] for change in changes] == ['ruleTwo']
+    assert state.save() == 2
+
+    # The updated rule is listed with its new schedule, and both are skipped.
+    rules[1]['ScheduleExpression'] = 'cron(0 9 * * ? *)'
+    mocker.spy(rec_calc, 'calculate_recurrences')
+    state.start_run()
+    assert processor.process_resources() == []
+    assert rec_calc.calculate_recurrences.call_count == 0
+    assert state.get_unchanged_count() == 2
+
+    # A rule whose schedule is changed by someone else is evaluated again.
+    rules[0]['ScheduleExpression'] = 'cron(0 7 * * ? *)'
+    state.start_run()
+    changes = processor.process_resources()
+    assert [change['ResourceName'] for change in changes] == ['ruleOne']
+    assert state.get_unchanged_count() == 1
+
+def test_process_resources_records_metrics(mocker):
+    rules = [
+        {'Name': 'ruleOne', 'Arn': 'ruleOneArn', 'ScheduleExpression': 'cron(0 9 * * ? *)'},
+        {'Name': 'ruleTwo', 'Arn': 'ruleTwoArn', 'ScheduleExpression': 'cron(0 8 * * ? *)'},
+        {'Name': 'ruleThree', 'Arn': 'ruleThreeArn', 'ScheduleExpression': 'cron(0 8 * * ? *)'}
+    ]
+    tags = [
+        {'Key': 'foo:bar:enabled', 'Value': ''},
+        {'Key': 'foo:bar:local-timezone', 'Value': 'Europe/Madrid'},
+        {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+    ]
+    eb_svc = EventBridgeService()
+    rec_calc = RecurrenceCalculator(FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 15))))
+    metrics = MetricsCollector('Adjuster')
+    processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc, metrics=metrics)
+    mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=rules)
+    mocker.patch.object(eb_svc, 'get_rule_tags', side_effect=lambda arn: [] if arn == 'ruleOneArn' else tags)
+    def update_rule_schedule(rule_name, schedule):
+        if rule_name == 'ruleThree':
+            raise ValueError('Boom')
+    mocker.patch.object(eb_svc, 'update_rule_schedule', side_effect=update_rule_schedule)
+
+    processor.process_resources()
+
+    assert metrics.get_values() == {
+        'EventBridgeRule.Evaluated': 2,
+        'EventBridgeRule.Failed': 1,
+        'EventBridgeRule.Updated': 1
+    }
+
+def _build_tagged_rules(count):
+    rules = [{'Name': 'rule{:03d}'.format(i), 'Arn': 'rule{:03d}Arn'.format(i), 'ScheduleExpression': 'cron(foo)'}
+             for i in range(count)]
+    tags = [
+        {'Key': 'foo:bar:enabled', 'Value': ''},
+        {'Key': 'foo:bar:local-timezone', 'Value': 'Europe/Madrid'},
+        {'Key': 'foo:bar:local-time', 'Value': '10:00'}
+    ]
+    return rules, {rule['Arn']: tags for rule in rules}
+
+class FakeEventBridgeClient:
+    """Serves put_rule with a delay, throttling the first call and failing
+    the rules it is told to, and tracks how many calls run at the same
+    time."""
+    def __init__(self, delay=0, failing_rule_names=()):
+        self.delay = delay
+        self.failing_rule_names = set(failing_rule_names)
+        self.names = []
+        self.current = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def put_rule(self, Name, ScheduleExpression):
+        with self.lock:
+            throttled = not self.names
+            self.names.append(Name)
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            time.sleep(self.delay)
+            if throttled:
+                raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'PutRule')
+            if Name in self.failing_rule_names:
+                raise Exception('Boom')
+        finally:
+            with self.lock:
+                self.current -= 1
+
+def _build_write_queue_processor(mocker, client, max_workers, rule_count):
+    rules, tags_by_arn = _build_tagged_rules(rule_count)
+    rate_limiter = AdaptiveRateLimiter(sleep=lambda seconds: None)
+    eb_svc = EventBridgeService(client, rate_limiter)
+    tagging_svc = TaggingService(mocker.Mock())
+    rec_calc = RecurrenceCalculator()
+    processor = EventBridgeProcessor('foo:bar', eb_svc, rec_calc, tagging_svc, max_workers=max_workers)
+    mocker.patch.object(eb_svc, 'get_scheduled_rules', return_value=iter(rules))
+    mocker.patch.object(tagging_svc, 'get_resource_tags_by_tag_key', return_value=tags_by_arn)
+    mocker.patch.object(rec_calc, 'calculate_recurrences', side_effect=lambda batch: ['bar'] * len(batch))
+    return processor, rate_limiter
+
+def test_process_resources_queues_updates_to_workers_in_rule_order(mocker):
+    client = FakeEventBridgeClient(delay=0.01, failing_rule_names=['rule007'])
+    processor, rate_limiter = _build_write_queue_processor(mocker, client, 4, 40)
+
+    changes = processor.process_resources()
+
+    assert [change['ResourceName'] for change in changes] == ['rule{:03d}'.format(i) for i in range(40) if i != 7]
+    assert processor.get_failures() == [{'ResourceName': 'rule007', 'Error': 'Boom'}]
+    # Every write goes through the rate limiter, which retried the throttled
+    # one.
+    assert rate_limiter.get_throttle_count('put_rule') == 1
+    assert len(client.names) == 41
+    assert client.peak <= 4
+
+def test_process_resources_with_write_queue_is_faster_than_inline_updates(mocker):
+    inline_processor, _ = _build_write_queue_processor(mocker, FakeEventBridgeClient(delay=0.01), 1, 40)
+    queued_processor, _ = _build_write_queue_processor(mocker, FakeEventBridgeClient(delay=0.01), 8, 40)
+
+    start = time.perf_counter()
+    inline_changes = inline_processor.process_resources()
+    inline_time = time.perf_counter() - start
+    start = time.perf_counter()
+    queued_changes = queued_processor.process_resources()
+    queued_time = time.perf_counter() - start
+
+    assert queued_changes == inline_changes
+    assert queued_time * 3 < inline_time
+
+def test_process_resources_lists_rules_while_updates_are_in_flight(mocker):
+    client = FakeEventBridgeClient(delay=0.05)
+    processor, _ = _build_write_queue_processor(mocker, client, 4, 0)
+    rules, tags_by_arn = _build_tagged_rules(4)
+    listed = []
+    def get_scheduled_rules():
+        for rule in rules:
+            listed.append((rule['Name'], len(client.names)))
+            yield rule
+    mocker.patch.object(processor, 'BATCH_SIZE', 1)
+    mocker.patch.object(processor._eventbridge_service, 'get_scheduled_rules', side_effect=get_scheduled_rules)
+    mocker.patch.object(processor._tagging_service, 'get_resource_tags_by_tag_key', return_value=tags_by_arn)
+
+    changes = processor.process_resources()
+
+    # The last rules are listed once earlier ones have been queued for
+    # update, but before their updates have completed.
+    assert listed[-1][1] > 0
+    assert len(changes) == 4
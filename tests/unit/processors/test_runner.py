@@ -0,0 +1,233 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+import time
+from lib.metrics import MetricsCollector
+from lib.accounts import Account
+from lib.processors.runner import MultiAccountRunner, MultiRegionRunner, ProcessorResult, ProcessorRunner
+
+
+class FakeProcessor:
+    def __init__(self, changes, delay=0, error=None, skipped_count=0, failures=()):
+        self.changes = changes
+        self.failures = list(failures)
+        self.delay = delay
+        self.error = error
+        self.skipped_count = skipped_count
+        self.transition_window = None
+        self.thread = None
+
+    def iter_changes(self, transition_window=None):
+        self.transition_window = transition_window
+        self.thread = threading.current_thread()
+        for change in self.changes:
+            time.sleep(self.delay)
+            yield change
+        if self.error:
+            raise self.error
+
+    def get_skipped_count(self):
+        return self.skipped_count
+
+    def get_failures(self):
+        return self.failures
+
+
+def test_run_returns_results_in_registration_order():
+    slow = FakeProcessor(['a1', 'a2'], delay=0.05, skipped_count=1)
+    fast = FakeProcessor(['b1'], skipped_count=2)
+    runner = ProcessorRunner([slow, fast])
+
+    results = runner.run('window')
+
+    assert results == [
+        ProcessorResult('FakeProcessor', ['a1', 'a2'], 1, [], None),
+        ProcessorResult('FakeProcessor', ['b1'], 2, [], None)
+    ]
+    assert ProcessorRunner.merge_changes(results) == ['a1', 'a2', 'b1']
+    assert slow.transition_window == fast.transition_window == 'window'
+
+def test_run_executes_processors_concurrently():
+    processors = [FakeProcessor(['a'], delay=0.1), FakeProcessor(['b'], delay=0.1)]
+    runner = ProcessorRunner(processors)
+
+    start = time.perf_counter()
+    runner.run()
+
+    assert time.perf_counter() - start < 0.18
+    assert processors[0].thread is not processors[1].thread
+
+def test_run_isolates_errors_of_one_processor():
+    error = Exception('Boom')
+    failing = FakeProcessor(['a1'], error=error)
+    succeeding = FakeProcessor(['b1', 'b2'], delay=0.01)
+    runner = ProcessorRunner([failing, succeeding])
+
+    results = runner.run()
+
+    assert results[0].error is error
+    assert results[0].changes == ['a1']
+    assert results[1].error is None
+    assert ProcessorRunner.merge_changes(results) == ['a1', 'b1', 'b2']
+
+def test_run_with_single_worker_runs_processors_in_the_calling_thread():
+    processors = [FakeProcessor(['a']), FakeProcessor(['b'])]
+
+    ProcessorRunner(processors, max_workers=1).run()
+
+    assert all(processor.thread is threading.current_thread() for processor in processors)
+
+def test_run_collects_failures_of_every_processor():
+    first = FakeProcessor(['a1'], failures=[{'ResourceName': 'AsgOne', 'Error': 'Boom'}])
+    second = FakeProcessor([], failures=[{'ResourceName': 'RuleOne', 'Error': 'Bang'}])
+    runner = ProcessorRunner([first, second])
+
+    results = runner.run()
+
+    assert results[0].failures == [{'ResourceName': 'AsgOne', 'Error': 'Boom'}]
+    assert ProcessorRunner.merge_failures(results) == [
+        {'ResourceName': 'AsgOne', 'Error': 'Boom'},
+        {'ResourceName': 'RuleOne', 'Error': 'Bang'}
+    ]
+
+def test_run_records_time_of_each_processor():
+    metrics = MetricsCollector('Adjuster')
+    runner = ProcessorRunner([FakeProcessor(['a1'], delay=0.01)], metrics=metrics)
+
+    runner.run()
+
+    assert metrics.get_values()['FakeProcessor.Time'] >= 10
+
+def build_region_runner(processors_by_region, **kwargs):
+    runners = {region: ProcessorRunner(processors) for region, processors in processors_by_region.items()}
+    return MultiRegionRunner(runners.get, list(processors_by_region), **kwargs)
+
+def test_multi_region_run_returns_results_in_region_order():
+    runner = build_region_runner({
+        'eu-west-1': [FakeProcessor(['a1'], delay=0.05, skipped_count=1)],
+        'us-west-2': [FakeProcessor(['b1', 'b2'])]
+    })
+
+    region_results = runner.run('window')
+
+    assert [region_result.region for region_result in region_results] == ['eu-west-1', 'us-west-2']
+    assert region_results[0].results == [ProcessorResult('FakeProcessor', ['a1'], 1, [], None)]
+    assert region_results[0].duration >= 0.05
+    assert [processor.transition_window for processor in runner.get_processors()] == ['window', 'window']
+
+def test_multi_region_run_processes_regions_concurrently():
+    runner = build_region_runner({region: [FakeProcessor(['a'], delay=0.1)] for region in ['r1', 'r2', 'r3']})
+
+    start = time.perf_counter()
+    runner.run()
+
+    assert time.perf_counter() - start < 0.25
+    assert len(set(processor.thread for processor in runner.get_processors())) == 3
+
+def test_multi_region_run_isolates_errors_and_labels_items():
+    error = Exception('Boom')
+    runner = build_region_runner({
+        'eu-west-1': [FakeProcessor([{'ResourceName': 'AsgOne'}], error=error,
+                                    failures=[{'ResourceName': 'AsgTwo', 'Error': 'Bang'}])],
+        'us-west-2': [FakeProcessor([{'ResourceName': 'RuleOne'}], skipped_count=3)]
+    })
+
+    region_results = runner.run()
+
+    assert MultiRegionRunner.merge_changes(region_results) == [
+        {'ResourceName': 'AsgOne', 'Region': 'eu-west-1'},
+        {'ResourceName': 'RuleOne', 'Region': 'us-west-2'}
+    ]
+    assert MultiRegionRunner.merge_failures(region_results) == [
+        {'ResourceName': 'AsgTwo', 'Error': 'Bang', 'Region': 'eu-west-1'}
+    ]
+    summaries = MultiRegionRunner.summarize(region_results)
+    assert summaries['eu-west-1']['FailedProcessors'] == ['FakeProcessor']
+    assert {key: value for key, value in summaries['us-west-2'].items() if key != 'DurationMs'} == {
+        'UpdateCount': 1, 'FailureCount': 0, 'SkippedCount': 3, 'FailedProcessors': []
+    }
+
+def test_multi_region_run_does_not_label_items_of_function_region():
+    runner = build_region_runner({None: [FakeProcessor([{'ResourceName': 'AsgOne'}])]})
+
+    assert MultiRegionRunner.merge_changes(runner.run()) == [{'ResourceName': 'AsgOne'}]
+
+class ConcurrencyProbe:
+    """Tracks how many callers are within it at the same time."""
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._lock:
+            self.current -= 1
+
+def build_account_runner(processors_by_account, failing_account_ids=(), probe=None, **kwargs):
+    accounts = [Account(account_id, 'arn:aws:iam::{}:role/Adjuster'.format(account_id))
+                for account_id in processors_by_account]
+    def get_region_runner(account):
+        if account.account_id in failing_account_ids:
+            raise Exception('AccessDenied')
+        return build_region_runner({None: processors_by_account[account.account_id]})
+    def get_probed_region_runner(account):
+        with probe:
+            runner = get_region_runner(account)
+            time.sleep(0.02)
+        return runner
+    return MultiAccountRunner(get_probed_region_runner if probe else get_region_runner, accounts, **kwargs)
+
+def test_multi_account_run_isolates_failing_accounts():
+    runner = build_account_runner({
+        '111111111111': [FakeProcessor([{'ResourceName': 'AsgOne'}],
+                                       failures=[{'ResourceName': 'AsgTwo', 'Error': 'Bang'}])],
+        '222222222222': [FakeProcessor([{'ResourceName': 'AsgThree'}])],
+        '333333333333': [FakeProcessor([{'ResourceName': 'AsgFour'}], delay=0.01)]
+    }, failing_account_ids=['222222222222'])
+
+    account_results = runner.run('window')
+
+    assert [account_result.account_id for account_result in account_results] == \
+        ['111111111111', '222222222222', '333333333333']
+    assert str(account_results[1].error) == 'AccessDenied'
+    assert account_results[1].region_results == []
+    assert MultiAccountRunner.merge_changes(account_results) == [
+        {'ResourceName': 'AsgOne', 'AccountId': '111111111111'},
+        {'ResourceName': 'AsgFour', 'AccountId': '333333333333'}
+    ]
+    assert MultiAccountRunner.merge_failures(account_results) == [
+        {'ResourceName': 'AsgTwo', 'Error': 'Bang', 'AccountId': '111111111111'}
+    ]
+    # The processors of the failing account were never built.
+    assert len(runner.get_processors()) == 2
+    assert all(processor.transition_window == 'window' for processor in runner.get_processors())
+
+def test_multi_account_summary_reports_time_and_errors():
+    runner = build_account_runner({
+        '111111111111': [FakeProcessor(['a1'], delay=0.02, skipped_count=2)],
+        '222222222222': []
+    }, failing_account_ids=['222222222222'])
+
+    summaries = MultiAccountRunner.summarize(runner.run())
+
+    assert summaries['111111111111']['UpdateCount'] == 1
+    assert summaries['111111111111']['SkippedCount'] == 2
+    assert summaries['111111111111']['Error'] is None
+    assert summaries['111111111111']['DurationMs'] >= 20
+    assert summaries['222222222222']['Error'] == 'AccessDenied'
+
+def test_multi_account_run_is_bounded_by_max_workers():
+    probe = ConcurrencyProbe()
+    runner = build_account_runner({'{:012d}'.format(i): [FakeProcessor(['a'])] for i in range(6)},
+                                  probe=probe, max_workers=2)
+
+    account_results = runner.run()
+
+    assert len(account_results) == 6
+    assert probe.peak == 2
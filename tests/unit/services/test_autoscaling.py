@@ -2,9 +2,11 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import boto3
+import threading
+import time
 from botocore.stub import Stubber
 from datetime import datetime
-from lib.services import AutoScalingService
+from lib.services import AutoScalingService, ScheduledActionUpdateOutcome
 import pytest
 
 
@@ -33,10 +35,34 @@ def test_get_asgs():
     stubber.activate()
     client = AutoScalingService(asg_boto3_client)
 
-    asgs = client.get_asgs()
+    asgs = list(client.get_asgs())
 
     assert asgs == [asg]
 
+def test_get_asgs_filtered_by_tag_key():
+    asg_boto3_client = boto3.client('autoscaling')
+    stubber = Stubber(asg_boto3_client)
+    asg = {
+        'AutoScalingGroupName': 'foo',
+        'MinSize': 0,
+        'MaxSize': 0,
+        'DesiredCapacity': 0,
+        'DefaultCooldown': 0,
+        'AvailabilityZones': ['foo'],
+        'HealthCheckType': 'foo',
+        'CreatedTime': datetime(2020, 1, 1)
+    }
+    stubber.add_response('describe_auto_scaling_groups',
+                         {'AutoScalingGroups': [asg]},
+                         {'Filters': [{'Name': 'tag-key', 'Values': [':enabled']}]})
+    stubber.activate()
+    client = AutoScalingService(asg_boto3_client)
+
+    asgs = list(client.get_asgs(':enabled'))
+
+    stubber.assert_no_pending_responses()
+    assert asgs == [asg]
+
 def test_get_asg_scheduled_actions():
     asg_boto3_client = boto3.client('autoscaling')
     stubber = Stubber(asg_boto3_client)
@@ -59,6 +85,116 @@ def test_get_asg_scheduled_actions():
     stubber.activate()
     client = AutoScalingService(asg_boto3_client)
 
-    actions = client.get_asg_scheduled_actions('foo')
+    actions = list(client.get_asg_scheduled_actions('foo'))
 
     assert actions == [action]
+
+def test_get_all_scheduled_actions():
+    asg_boto3_client = boto3.client('autoscaling')
+    stubber = Stubber(asg_boto3_client)
+    def action(asg_name, action_name):
+        return {
+            'AutoScalingGroupName': asg_name,
+            'ScheduledActionName': action_name,
+            'Recurrence': 'foo',
+            'DesiredCapacity': 123
+        }
+    stubber.add_response('describe_scheduled_actions',
+                         {
+                             'ScheduledUpdateGroupActions': [action('foo', 'one'), action('bar', 'two')],
+                             'NextToken': 'nextPage'
+                         },
+                         {'MaxRecords': 100})
+    stubber.add_response('describe_scheduled_actions',
+                         {'ScheduledUpdateGroupActions': [action('foo', 'three')]},
+                         {'MaxRecords': 100, 'NextToken': 'nextPage'})
+    stubber.activate()
+    client = AutoScalingService(asg_boto3_client)
+
+    actions = client.get_all_scheduled_actions()
+
+    stubber.assert_no_pending_responses()
+    assert actions == {
+        'foo': [action('foo', 'one'), action('foo', 'three')],
+        'bar': [action('bar', 'two')]
+    }
+
+class FakeAutoScalingClient:
+    """Records the actions of every batch_put_scheduled_update_group_action
+    call, from any thread, and fails the actions it is told to with the
+    given error codes, once per code in their list."""
+    def __init__(self, errors=None, delay=0):
+        self.calls = []
+        self.errors = {name: list(codes) for name, codes in (errors or {}).items()}
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def batch_put_scheduled_update_group_action(self, AutoScalingGroupName, ScheduledUpdateGroupActions):
+        time.sleep(self.delay)
+        failed = []
+        with self.lock:
+            self.calls.append([action['ScheduledActionName'] for action in ScheduledUpdateGroupActions])
+            for action in ScheduledUpdateGroupActions:
+                codes = self.errors.get(action['ScheduledActionName'])
+                if codes:
+                    failed.append({'ScheduledActionName': action['ScheduledActionName'], 'ErrorCode': codes.pop(0),
+                                   'ErrorMessage': 'Failed'})
+        return {'FailedScheduledUpdateGroupActions': failed}
+
+
+def build_action_updates(count):
+    return [{'ScheduledActionName': 'action-{:03d}'.format(i), 'Recurrence': '0 9 * * *', 'DesiredCapacity': 1}
+            for i in range(count)]
+
+def test_put_scheduled_actions_chunks_to_api_limit():
+    client = FakeAutoScalingClient()
+    service = AutoScalingService(client, sleep=lambda seconds: None)
+    updates = build_action_updates(230)
+
+    outcomes = service.put_scheduled_actions('MyAsg', updates)
+
+    assert sorted(len(call) for call in client.calls) == [30, 50, 50, 50, 50]
+    assert sorted(name for call in client.calls for name in call) == [update['ScheduledActionName'] for update in updates]
+    assert [outcome.action_name for outcome in outcomes] == [update['ScheduledActionName'] for update in updates]
+    assert all(outcome.succeeded and outcome.attempts == 1 for outcome in outcomes)
+
+def test_put_scheduled_actions_sends_chunks_concurrently():
+    client = FakeAutoScalingClient(delay=0.1)
+    service = AutoScalingService(client, sleep=lambda seconds: None)
+
+    start = time.perf_counter()
+    service.put_scheduled_actions('MyAsg', build_action_updates(200))
+
+    assert time.perf_counter() - start < 0.2
+    assert len(client.calls) == 4
+
+def test_put_scheduled_actions_retries_only_retryable_failures():
+    client = FakeAutoScalingClient(errors={
+        'action-010': ['ResourceContention'],
+        'action-120': ['ResourceContention', 'ResourceContention', 'ResourceContention'],
+        'action-200': ['LimitExceeded']
+    })
+    delays = []
+    service = AutoScalingService(client, sleep=delays.append)
+
+    outcomes = {outcome.action_name: outcome for outcome in
+                service.put_scheduled_actions('MyAsg', build_action_updates(250))}
+
+    assert client.calls[-2:] == [['action-010', 'action-120'], ['action-120']]
+    assert outcomes['action-010'] == ScheduledActionUpdateOutcome('action-010', True, None, None, 2)
+    assert outcomes['action-120'] == ScheduledActionUpdateOutcome('action-120', False, 'ResourceContention', 'Failed', 3)
+    assert outcomes['action-200'] == ScheduledActionUpdateOutcome('action-200', False, 'LimitExceeded', 'Failed', 1)
+    assert sum(outcome.succeeded for outcome in outcomes.values()) == 248
+    assert delays == [0.1, 0.2]
+
+def test_put_scheduled_actions_reports_failed_calls_instead_of_raising():
+    client = boto3.client('autoscaling')
+    stubber = Stubber(client)
+    stubber.add_client_error('batch_put_scheduled_update_group_action', 'ValidationError', 'Bad request')
+    service = AutoScalingService(client, sleep=lambda seconds: None)
+
+    with stubber:
+        outcomes = service.put_scheduled_actions('MyAsg', build_action_updates(2))
+
+    assert [(outcome.succeeded, outcome.error_code, outcome.attempts) for outcome in outcomes] == \
+        [(False, 'ValidationError', 1)] * 2
@@ -29,7 +29,7 @@ def test_get_scheduled_rules():
     stubber.activate()
     service = EventBridgeService(eventbridge_boto3_client)
 
-    rules = service.get_scheduled_rules()
+    rules = list(service.get_scheduled_rules())
 
     assert len(rules) == 1
     assert rules[0] == scheduled_rule
@@ -57,3 +57,14 @@ def test_update_rule_schedule():
     service = EventBridgeService(eventbridge_boto3_client)
 
     tags = service.update_rule_schedule('theName', 'foo')
+
+def test_disable_rule():
+    eventbridge_boto3_client = boto3.client('events')
+    stubber = Stubber(eventbridge_boto3_client)
+    stubber.add_response('disable_rule', {}, {'Name': 'theName'})
+    stubber.activate()
+    service = EventBridgeService(eventbridge_boto3_client)
+
+    service.disable_rule('theName')
+
+    stubber.assert_no_pending_responses()
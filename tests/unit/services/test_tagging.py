@@ -0,0 +1,48 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import boto3
+from botocore.stub import Stubber
+from lib.services import TaggingService
+
+
+def test_default_client_is_tagging_client():
+    service = TaggingService()
+
+    client = service.get_client()
+
+    assert client.__module__ + '.' + client.__class__.__qualname__ == 'botocore.client.ResourceGroupsTaggingAPI'
+
+def test_get_resource_tags_by_tag_key():
+    tagging_boto3_client = boto3.client('resourcegroupstaggingapi')
+    stubber = Stubber(tagging_boto3_client)
+    expected_params = {
+        'TagFilters': [{'Key': 'foo:enabled'}],
+        'ResourceTypeFilters': ['events:rule']
+    }
+    stubber.add_response('get_resources',
+                         {
+                             'PaginationToken': 'nextPage',
+                             'ResourceTagMappingList': [
+                                 {'ResourceARN': 'arnOne', 'Tags': [{'Key': 'foo:enabled', 'Value': ''}]}
+                             ]
+                         },
+                         expected_params)
+    stubber.add_response('get_resources',
+                         {
+                             'PaginationToken': '',
+                             'ResourceTagMappingList': [
+                                 {'ResourceARN': 'arnTwo', 'Tags': [{'Key': 'foo:enabled', 'Value': 'yes'}]}
+                             ]
+                         },
+                         dict(expected_params, PaginationToken='nextPage'))
+    stubber.activate()
+    service = TaggingService(tagging_boto3_client)
+
+    tags = service.get_resource_tags_by_tag_key('events:rule', 'foo:enabled')
+
+    stubber.assert_no_pending_responses()
+    assert tags == {
+        'arnOne': [{'Key': 'foo:enabled', 'Value': ''}],
+        'arnTwo': [{'Key': 'foo:enabled', 'Value': 'yes'}]
+    }
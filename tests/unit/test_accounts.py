@@ -0,0 +1,116 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import collections
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from lib import timezones
+from lib.accounts import Account, AssumedRoleSessionCache, parse_role_arns
+
+
+class FakeTimeSource:
+    def __init__(self, now=datetime(2021, 3, 28, 12, 0)):
+        self.now = now.replace(tzinfo=timezones.UTC)
+
+    def get_current_utc_datetime(self):
+        return self.now
+
+
+class LocalSecurityTokenService:
+    """A local stand-in for STS, which issues numbered credentials that expire
+    after the requested duration, and fails for the roles it is told to."""
+    def __init__(self, time_source, delay=0, failing_role_arns=()):
+        self._time_source = time_source
+        self._delay = delay
+        self.failing_role_arns = set(failing_role_arns)
+        self._lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.issued_count = 0
+
+    def assume_role(self, role_arn, session_name, duration_seconds=3600):
+        with self._lock:
+            self.calls[role_arn] += 1
+            self.issued_count += 1
+            number = self.issued_count
+        time.sleep(self._delay)
+        if role_arn in self.failing_role_arns:
+            raise Exception('AccessDenied: not authorized to assume {}'.format(role_arn))
+        return {
+            'AccessKeyId': 'ASIA{:016d}'.format(number),
+            'SecretAccessKey': 'secret-{}'.format(number),
+            'SessionToken': 'token-{}'.format(number),
+            'Expiration': self._time_source.get_current_utc_datetime() + timedelta(seconds=duration_seconds)
+        }
+
+
+def role_arn(account_id):
+    return 'arn:aws:iam::{}:role/Adjuster'.format(account_id)
+
+
+def test_parse_role_arns():
+    accounts = parse_role_arns(' {}, {},'.format(role_arn('111111111111'), role_arn('222222222222')))
+
+    assert accounts == [Account('111111111111', role_arn('111111111111')),
+                        Account('222222222222', role_arn('222222222222'))]
+
+@pytest.mark.parametrize('text', [
+    'arn:aws:iam::111111111111:user/Adjuster',
+    'arn:aws:s3:::bucket',
+    'Adjuster'
+])
+def test_parse_role_arns_rejects_other_arns(text):
+    with pytest.raises(ValueError) as raised:
+        parse_role_arns(text)
+
+    assert str(raised.value) == "'{}' is not the ARN of an IAM role".format(text)
+
+def test_parse_role_arns_rejects_repeated_accounts():
+    with pytest.raises(ValueError):
+        parse_role_arns('{},arn:aws:iam::111111111111:role/Other'.format(role_arn('111111111111')))
+
+def test_credentials_are_cached_until_they_are_about_to_expire():
+    time_source = FakeTimeSource()
+    sts = LocalSecurityTokenService(time_source)
+    cache = AssumedRoleSessionCache(sts, time_source, duration=timedelta(hours=1),
+                                    refresh_margin=timedelta(minutes=10))
+
+    first = cache.get_credentials(role_arn('111111111111'))
+    time_source.now += timedelta(minutes=49)
+    second = cache.get_credentials(role_arn('111111111111'))
+    time_source.now += timedelta(minutes=1)
+    third = cache.get_credentials(role_arn('111111111111'))
+
+    assert first is second
+    assert third['AccessKeyId'] != first['AccessKeyId']
+    assert sts.calls[role_arn('111111111111')] == 2
+    assert cache.get_assume_count() == 2
+
+def test_concurrent_requests_assume_each_role_once():
+    time_source = FakeTimeSource()
+    sts = LocalSecurityTokenService(time_source, delay=0.05)
+    cache = AssumedRoleSessionCache(sts, time_source)
+    role_arns = [role_arn('{:012d}'.format(i)) for i in range(4)]
+    threads = [threading.Thread(target=cache.get_credentials, args=(arn,)) for arn in role_arns * 3]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Different roles are assumed concurrently.
+    assert time.perf_counter() - start < 0.15
+    assert sts.calls == {arn: 1 for arn in role_arns}
+
+def test_failures_are_not_cached():
+    time_source = FakeTimeSource()
+    sts = LocalSecurityTokenService(time_source, failing_role_arns=[role_arn('111111111111')])
+    cache = AssumedRoleSessionCache(sts, time_source)
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            cache.get_credentials(role_arn('111111111111'))
+
+    assert sts.calls[role_arn('111111111111')] == 2
@@ -0,0 +1,285 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import subprocess
+import sys
+import pytest
+from adjust_schedule import app
+from lib.accounts import AssumedRoleSessionCache, parse_role_arns
+from lib.metrics import MetricsCollector
+from tests.unit.test_accounts import FakeTimeSource, LocalSecurityTokenService
+
+
+@pytest.fixture
+def fresh_app(mocker):
+    mocker.patch.object(app, '_clients', {})
+    mocker.patch.object(app, '_rate_limiters', {})
+    mocker.patch.object(app, '_runners', {})
+    mocker.patch.object(app, '_region_runner', None)
+    mocker.patch.object(app, '_session_cache', None)
+    mocker.patch.object(app, '_account_region_runners', {})
+    mocker.patch.object(app, '_account_runner', None)
+    mocker.patch.object(app, '_bus', None)
+    mocker.patch.object(app, '_state', None)
+    mocker.patch.object(app, '_trigger_scheduler', None)
+    return mocker.patch('boto3.client', side_effect=lambda service_name, **kwargs: mocker.Mock(name=service_name))
+
+
+def test_clients_are_created_on_first_use(fresh_app):
+    assert not fresh_app.called
+
+    app.get_processors()
+
+    assert sorted(call[0][0] for call in fresh_app.call_args_list) == \
+        ['autoscaling', 'events', 'resourcegroupstaggingapi']
+
+def test_events_client_is_shared_by_processor_and_bus(fresh_app):
+    eventbridge_processor = app.get_processors()[1]
+    bus = app.get_bus()
+
+    assert eventbridge_processor._eventbridge_service.get_client() is bus._eventbridge_client
+    assert [call[0][0] for call in fresh_app.call_args_list].count('events') == 1
+
+def test_processors_and_bus_are_reused(fresh_app):
+    assert app.get_processors() is app.get_processors()
+    assert app.get_bus() is app.get_bus()
+
+def test_lambda_handler_reports_changes_of_other_processors_before_failing(fresh_app, mocker):
+    error = Exception('Boom')
+    runner = app.get_runner()
+    mocker.patch.object(runner.get_processors()[0], 'iter_changes', side_effect=error)
+    mocker.patch.object(runner.get_processors()[1], 'iter_changes', return_value=iter([{'ResourceName': 'rule'}]))
+    bus = mocker.patch.object(app.get_bus(), 'emit_process_completed')
+
+    with pytest.raises(Exception) as raised:
+        app.lambda_handler({}, None)
+
+    assert raised.value.__cause__ is error
+    assert "Processor 'AutoScalingGroupProcessor' failed: Boom" in str(raised.value)
+    bus.assert_called_once_with([{'ResourceName': 'rule'}], [], None, None)
+
+def test_lambda_handler_reports_failed_resources_before_failing(fresh_app, mocker):
+    runner = app.get_runner()
+    asg_processor = runner.get_processors()[0]
+    def iter_changes(transition_window=None):
+        asg_processor._add_failure('AsgTwo', '1 actions failed to update')
+        yield {'ResourceName': 'AsgOne'}
+    mocker.patch.object(asg_processor, 'iter_changes', side_effect=iter_changes)
+    mocker.patch.object(runner.get_processors()[1], 'iter_changes', return_value=iter([]))
+    bus = mocker.patch.object(app.get_bus(), 'emit_process_completed')
+
+    with pytest.raises(Exception) as raised:
+        app.lambda_handler({}, None)
+
+    assert str(raised.value) == "1 resources failed to be processed: 'AsgTwo' (1 actions failed to update)"
+    bus.assert_called_once_with([{'ResourceName': 'AsgOne'}],
+                                [{'ResourceName': 'AsgTwo', 'Error': '1 actions failed to update'}], None, None)
+
+def test_rate_limiter_is_shared_by_services_and_bus(fresh_app):
+    asg_processor, eventbridge_processor = app.get_processors()
+
+    assert asg_processor._asg_service._rate_limiter is app.rate_limiter
+    assert eventbridge_processor._eventbridge_service._rate_limiter is app.rate_limiter
+    assert eventbridge_processor._tagging_service._rate_limiter is app.rate_limiter
+    assert app.get_bus()._rate_limiter is app.rate_limiter
+
+def test_unknown_timezone_provider_is_rejected():
+    # The provider is configured at import time, so the module is imported in
+    # a separate interpreter.
+    env = dict(os.environ, TIMEZONE_PROVIDER='dateutil', AWS_DEFAULT_REGION='us-east-1')
+    process = subprocess.run([sys.executable, '-c', 'import adjust_schedule.app'], env=env,
+                             cwd=os.path.dirname(os.path.dirname(app.__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    assert process.returncode != 0
+    assert "ValueError: Unknown TIMEZONE_PROVIDER 'dateutil'. Supported providers are: pytz, zoneinfo" in process.stderr
+
+def test_import_defers_heavy_modules():
+    # boto3, pytz and the like are only imported once the first invocation
+    # needs them, so that cold starts do not pay for them.
+    deferred_modules = ['boto3', 'botocore', 'crontab', 'dateutil', 'pytz', 'zoneinfo']
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1')
+    env.pop('TIMEZONE_PROVIDER', None)
+    process = subprocess.run([sys.executable, '-c', 'import sys, adjust_schedule.app; print("\\n".join(sys.modules))'],
+                             env=env, cwd=os.path.dirname(os.path.dirname(app.__file__)),
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True)
+
+    imported = process.stdout.splitlines()
+    assert [module for module in imported if module.split('.')[0] in deferred_modules] == []
+
+def test_state_is_shared_by_processors_and_saved_after_run(fresh_app, mocker):
+    mocker.patch.object(app, 'state_table_name', 'state')
+    state = app.get_state()
+    for processor in app.get_processors():
+        assert processor._state is state
+        mocker.patch.object(processor, 'iter_changes', return_value=iter([]))
+    start_run = mocker.patch.object(state, 'start_run')
+    save = mocker.patch.object(state, 'save', return_value=0)
+
+    app.lambda_handler({'detail': {'Force': True}}, None)
+
+    start_run.assert_called_once_with(True)
+    save.assert_called_once_with()
+    assert [call[0][0] for call in fresh_app.call_args_list].count('dynamodb') == 1
+
+def test_state_is_not_kept_without_table(fresh_app):
+    assert app.get_state() is None
+    assert all(processor._state is None for processor in app.get_processors())
+
+def test_trigger_is_scheduled_for_timezones_of_all_processors(fresh_app, mocker):
+    mocker.patch.object(app, 'transition_trigger_rule_name', 'trigger')
+    asg_processor, eventbridge_processor = app.get_processors()
+    mocker.patch.object(asg_processor, 'iter_changes', return_value=iter([]))
+    mocker.patch.object(asg_processor, 'get_timezones', return_value={'Europe/Madrid'})
+    mocker.patch.object(eventbridge_processor, 'iter_changes', return_value=iter([]))
+    mocker.patch.object(eventbridge_processor, 'get_timezones', return_value={'Asia/Tokyo', 'Europe/Madrid'})
+    schedule_next_run = mocker.patch.object(app.get_trigger_scheduler(), 'schedule_next_run')
+
+    app.lambda_handler({}, None)
+
+    assert schedule_next_run.call_args[0][0] == {'Europe/Madrid', 'Asia/Tokyo'}
+    assert app.get_trigger_scheduler()._eventbridge_service.get_client() is \
+        eventbridge_processor._eventbridge_service.get_client()
+
+def test_trigger_is_not_scheduled_without_rule(fresh_app):
+    assert app.get_trigger_scheduler() is None
+
+def test_metrics_are_flushed_when_run_fails(fresh_app, mocker):
+    lines = []
+    mocker.patch.object(app, 'metrics', MetricsCollector('Adjuster', output=lines.append))
+    asg_processor, eventbridge_processor = app.get_processors()
+    mocker.patch.object(asg_processor, 'iter_changes', side_effect=Exception('Boom'))
+    mocker.patch.object(eventbridge_processor, 'iter_changes', return_value=iter([]))
+
+    with pytest.raises(Exception):
+        app.lambda_handler({}, None)
+
+    assert len(lines) == 1
+    assert 'AutoScalingGroupProcessor.Time' in json.loads(lines[0])
+    assert asg_processor._metrics is app.metrics
+
+def test_run_summary_is_logged_before_failing(fresh_app, mocker, capsys):
+    asg_processor, eventbridge_processor = app.get_processors()
+    def iter_changes(transition_window=None):
+        asg_processor._add_failure('AsgTwo', '1 actions failed to update')
+        yield {'ResourceName': 'AsgOne'}
+    mocker.patch.object(asg_processor, 'iter_changes', side_effect=iter_changes)
+    mocker.patch.object(eventbridge_processor, 'iter_changes', return_value=iter([]))
+    mocker.patch.object(app.get_bus(), 'emit_process_completed')
+
+    with pytest.raises(Exception):
+        app.lambda_handler({}, None)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    summary = [record for record in records if record['message'] == 'Run completed']
+    assert len(summary) == 1
+    assert summary[0]['level'] == 'INFO'
+    assert summary[0]['logger'] == 'adjust_schedule.app'
+    assert summary[0]['Forced'] is False
+    assert summary[0]['UpdateCount'] == 1
+    assert summary[0]['FailureCount'] == 1
+    assert summary[0]['FailedProcessorCount'] == 0
+    assert 'RecurrenceCacheHits' in summary[0]
+
+def test_unknown_log_level_is_rejected():
+    env = dict(os.environ, LOG_LEVEL='verbose', AWS_DEFAULT_REGION='us-east-1')
+    process = subprocess.run([sys.executable, '-c', 'import adjust_schedule.app'], env=env,
+                             cwd=os.path.dirname(os.path.dirname(app.__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+    assert process.returncode != 0
+    assert "ValueError: Unknown LOG_LEVEL 'VERBOSE'. Supported levels are: DEBUG, INFO, WARNING, ERROR" in process.stderr
+
+def test_regions_get_their_own_clients_and_rate_limiters(fresh_app, mocker):
+    mocker.patch.object(app, 'regions', ['eu-west-1', 'us-west-2'])
+
+    europe = app.get_processors('eu-west-1')
+    america = app.get_processors('us-west-2')
+
+    assert sorted(call[1].get('region_name') for call in fresh_app.call_args_list) == \
+        ['eu-west-1'] * 3 + ['us-west-2'] * 3
+    assert europe[0]._asg_service.get_client() is not america[0]._asg_service.get_client()
+    assert europe[0]._asg_service._rate_limiter is app.get_rate_limiter('eu-west-1')
+    assert app.get_rate_limiter('eu-west-1') is not app.get_rate_limiter('us-west-2')
+    assert app.get_rate_limiter('eu-west-1') is not app.rate_limiter
+
+def test_regions_are_processed_and_summarized_in_event(fresh_app, mocker):
+    mocker.patch.object(app, 'regions', ['eu-west-1', 'us-west-2'])
+    for region in app.regions:
+        asg_processor, eventbridge_processor = app.get_processors(region)
+        mocker.patch.object(asg_processor, 'iter_changes', return_value=iter([{'ResourceName': 'Asg'}]))
+        mocker.patch.object(eventbridge_processor, 'iter_changes', return_value=iter([]))
+    bus = mocker.patch.object(app.get_bus(), 'emit_process_completed')
+
+    app.lambda_handler({}, None)
+
+    updates, failures, regions, accounts = bus.call_args[0]
+    assert updates == [{'ResourceName': 'Asg', 'Region': 'eu-west-1'}, {'ResourceName': 'Asg', 'Region': 'us-west-2'}]
+    assert failures == []
+    assert sorted(regions) == ['eu-west-1', 'us-west-2']
+    assert regions['eu-west-1']['UpdateCount'] == 1
+    assert accounts is None
+    # Events are emitted in the region of the function.
+    assert app.get_bus()._eventbridge_client is app.get_client('events')
+
+@pytest.fixture
+def target_accounts(fresh_app, mocker):
+    mocker.patch.object(app, 'accounts', parse_role_arns(
+        'arn:aws:iam::111111111111:role/Adjuster,arn:aws:iam::222222222222:role/Adjuster'))
+    time_source = FakeTimeSource()
+    sts = LocalSecurityTokenService(time_source)
+    mocker.patch.object(app, '_session_cache', AssumedRoleSessionCache(sts, time_source))
+    sessions = []
+    def create_session(**credentials):
+        session = mocker.Mock(name='session', credentials=credentials)
+        session.client.side_effect = lambda service_name, **kwargs: mocker.Mock(name=service_name)
+        sessions.append(session)
+        return session
+    mocker.patch('boto3.session.Session', side_effect=create_session)
+    return sts, time_source, sessions
+
+def mock_account_processors(mocker, account, changes):
+    for processor in app.get_account_region_runner(account).get_processors():
+        mocker.patch.object(processor, 'iter_changes', side_effect=lambda transition_window=None: iter(changes))
+
+def test_accounts_use_sessions_with_credentials_of_their_role(target_accounts):
+    sts, time_source, sessions = target_accounts
+
+    first, second = [app.get_account_region_runner(account) for account in app.accounts]
+
+    assert [session.credentials['aws_access_key_id'] for session in sessions] == \
+        ['ASIA0000000000000001', 'ASIA0000000000000002']
+    assert first.get_processors()[0]._asg_service.get_client() is not \
+        second.get_processors()[0]._asg_service.get_client()
+    assert first.get_processors()[0]._asg_service._rate_limiter is app.get_rate_limiter(None, '111111111111')
+    assert app.get_rate_limiter(None, '111111111111') is not app.rate_limiter
+
+def test_account_runners_are_rebuilt_once_credentials_expire(target_accounts):
+    sts, time_source, sessions = target_accounts
+    account = app.accounts[0]
+
+    runner = app.get_account_region_runner(account)
+    assert app.get_account_region_runner(account) is runner
+    time_source.now += AssumedRoleSessionCache.DEFAULT_DURATION
+
+    assert app.get_account_region_runner(account) is not runner
+    assert sts.calls[account.role_arn] == 2
+    assert len(sessions) == 2
+
+def test_failing_account_is_reported_after_the_others(target_accounts, mocker):
+    sts, time_source, sessions = target_accounts
+    mock_account_processors(mocker, app.accounts[0], [{'ResourceName': 'Asg'}])
+    sts.failing_role_arns.add(app.accounts[1].role_arn)
+    bus = mocker.patch.object(app.get_bus(), 'emit_process_completed')
+
+    with pytest.raises(Exception) as raised:
+        app.lambda_handler({}, None)
+
+    assert str(raised.value).startswith("Account '222222222222' failed: AccessDenied")
+    updates, failures, regions, accounts = bus.call_args[0]
+    assert updates == [{'ResourceName': 'Asg', 'AccountId': '111111111111'}] * 2
+    assert regions is None
+    assert accounts['111111111111']['UpdateCount'] == 2
+    assert accounts['222222222222']['Error'].startswith('AccessDenied')
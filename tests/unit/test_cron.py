@@ -0,0 +1,137 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from crontab import CronTab
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from lib.cron import compile_cron_expression, format_field, parse_field, CronExpression, UnsupportedFieldError
+
+
+@pytest.mark.parametrize('field,expected', [
+    ('*', None),
+    ('?', None),
+    ('5', (5,)),
+    ('1,3,5', (1, 3, 5)),
+    ('8-11', (8, 9, 10, 11)),
+    ('*/20', (0, 20, 40)),
+    ('10/20', (10, 30, 50)),
+    ('0-30/15,45', (0, 15, 30, 45)),
+])
+def test_parse_field(field, expected):
+    assert parse_field(field, 0, 59) == expected
+
+def test_parse_field_with_names():
+    assert parse_field('MON-WED,fri', 0, 7, {'MON': 1, 'TUE': 2, 'WED': 3, 'FRI': 5}) == (1, 2, 3, 5)
+
+@pytest.mark.parametrize('field', ['L', '15W', '2#1', '5-2', '60', '*/0', 'foo'])
+def test_parse_field_with_unsupported_syntax(field):
+    with pytest.raises(UnsupportedFieldError):
+        parse_field(field, 0, 59)
+
+@pytest.mark.parametrize('expression,now,expected', [
+    # Daily
+    ('0 10 * * *', datetime(2020, 1, 1, 9, 59), datetime(2020, 1, 1, 10, 0)),
+    ('0 10 * * *', datetime(2020, 1, 1, 10, 0), datetime(2020, 1, 2, 10, 0)),
+    ('0 10 * * ? *', datetime(2020, 12, 31, 11, 0), datetime(2021, 1, 1, 10, 0)),
+    # Weekdays by name (2020-01-01 is a Wednesday)
+    ('30 8 ? * MON-FRI *', datetime(2020, 1, 3, 9, 0), datetime(2020, 1, 6, 8, 30)),
+    ('30 8 * * SAT', datetime(2020, 1, 1), datetime(2020, 1, 4, 8, 30)),
+    # Numeric weekdays: Unix cron counts from Sunday = 0, AWS cron from Sunday = 1
+    ('0 10 * * 1', datetime(2020, 1, 1), datetime(2020, 1, 6, 10, 0)),
+    ('0 10 * * 0', datetime(2020, 1, 1), datetime(2020, 1, 5, 10, 0)),
+    ('0 10 * * 7', datetime(2020, 1, 1), datetime(2020, 1, 5, 10, 0)),
+    ('0 10 ? * 1 *', datetime(2020, 1, 1), datetime(2020, 1, 5, 10, 0)),
+    ('0 10 ? * 2 *', datetime(2020, 1, 1), datetime(2020, 1, 6, 10, 0)),
+    # Days of month, months and years
+    ('0 10 15 * ? *', datetime(2020, 1, 16), datetime(2020, 2, 15, 10, 0)),
+    ('0 10 31 * ? *', datetime(2020, 2, 1), datetime(2020, 3, 31, 10, 0)),
+    ('0 10 29 FEB ? *', datetime(2020, 3, 1), datetime(2024, 2, 29, 10, 0)),
+    ('0 10 1 JUN ? 2022', datetime(2020, 3, 1), datetime(2022, 6, 1, 10, 0)),
+    # Both day of month and weekday restricted: either of them matches,
+    # unless one of them starts with '*' (2020-01-03 is an odd Friday)
+    ('0 10 15 * 1', datetime(2020, 1, 1), datetime(2020, 1, 6, 10, 0)),
+    ('0,30 */3 */2 * MON-FRI', datetime(2020, 1, 3, 22, 0), datetime(2020, 1, 7, 0, 0)),
+    ('0 10 1,15 * */2', datetime(2020, 1, 2), datetime(2020, 2, 1, 10, 0)),
+    # Several hours and minutes
+    ('0,30 8-9 * * *', datetime(2020, 1, 1, 8, 45), datetime(2020, 1, 1, 9, 0)),
+    ('*/20 * * * *', datetime(2020, 1, 1, 23, 50), datetime(2020, 1, 2, 0, 0)),
+    # Not compiled
+    ('0 10 L * ? *', datetime(2020, 1, 1), datetime(2020, 1, 31, 10, 0)),
+])
+def test_get_next_run(expression, now, expected):
+    assert CronExpression(expression).get_next_run(now) == expected
+
+def test_get_next_run_with_aware_datetime():
+    now = pytz.timezone('Europe/Madrid').localize(datetime(2020, 1, 1, 10, 30))
+
+    assert CronExpression('0 10 * * *').get_next_run(now) == pytz.utc.localize(datetime(2020, 1, 1, 10, 0))
+
+def test_get_next_run_when_expression_does_not_run_again():
+    assert CronExpression('0 10 * * ? 2019').get_next_run(datetime(2020, 1, 1)) is None
+    assert CronExpression('0 10 31 FEB ? *').get_next_run(datetime(2020, 1, 1)) is None
+
+@pytest.mark.parametrize('expression', ['0,30 */3 */2 * MON-FRI', '0 10 */10 * MON', '0 10 1,15 * */2'])
+def test_get_next_run_with_star_prefixed_day_field_matches_crontab(expression):
+    crontab = CronTab(expression)
+    compiled = CronExpression(expression)
+    now = datetime(2020, 1, 1)
+    for _ in range(100):
+        expected = now + timedelta(seconds=crontab.next(now, default_utc=False))
+        now = compiled.get_next_run(now)
+        assert now == expected
+
+def test_unsupported_fields_are_evaluated_by_crontab():
+    assert CronExpression('0 10 * * ? *').is_compiled()
+    assert not CronExpression('0 10 L * ? *').is_compiled()
+
+def test_compile_cron_expression_reuses_expressions():
+    assert compile_cron_expression('0 10 * * *') is compile_cron_expression('0 10 * * *')
+
+@pytest.mark.parametrize('expression', ['0 10 * *', '0 10 * * * * *', ''])
+def test_cron_expression_with_invalid_expression(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+@pytest.mark.parametrize('values,minimum,maximum,is_aws,expected', [
+    (range(0, 60), 0, 59, False, '*'),
+    ([5], 0, 59, False, '5'),
+    ([8, 9], 0, 23, False, '8,9'),
+    ([8, 9, 10, 11], 0, 23, False, '8-11'),
+    ([1, 2, 3, 7, 9, 10, 11], 0, 23, False, '1-3,7,9-11'),
+    ([0, 15, 30, 45], 0, 59, False, '*/15'),
+    ([5, 20, 35, 50], 0, 59, False, '5-50/15'),
+    ([5, 20, 35, 50], 0, 59, True, '5/15'),
+    ([7, 9, 11, 13, 15, 17], 0, 23, True, '7-17/2'),
+])
+def test_format_field(values, minimum, maximum, is_aws, expected):
+    assert format_field(values, minimum, maximum, is_aws=is_aws) == expected
+
+def test_format_field_with_names():
+    assert format_field([1, 2, 3, 4, 5], 0, 6, names={'SUN': 0, 'MON': 1, 'TUE': 2, 'WED': 3, 'THU': 4, 'FRI': 5, 'SAT': 6}) == 'MON-FRI'
+
+@pytest.mark.parametrize('expression,delta,expected', [
+    ('0 8 * * ? *', -60, '0 7 * * ? *'),
+    ('0 8,12,18 * * ? *', -60, '0 7,11,17 * * ? *'),
+    ('*/30 9-17 * * *', 60, '*/30 10-18 * * *'),
+    ('0 */2 * * *', 60, '0 1-23/2 * * *'),
+    ('0 */2 * * ? *', 60, '0 1/2 * * ? *'),
+    ('0 6-9 * * *', 750, '30 18-21 * * *'),
+    ('30 0 ? * MON-FRI *', -60, '30 23 ? * SUN-THU *'),
+    ('30 23 * * 0-4', 60, '30 0 * * 1-5'),
+    ('0 0 ? * SAT,SUN *', -60, '0 23 ? * FRI,SAT *'),
+    ('0 0 1 * ? *', 60, '0 1 1 * ? *'),
+])
+def test_shift(expression, delta, expected):
+    assert CronExpression(expression).shift(delta) == expected
+
+@pytest.mark.parametrize('expression,delta', [
+    ('0,30 6-7 * * *', 30),
+    ('0 0 1 * ? *', -60),
+    ('0 0,12 ? * MON *', -60),
+    ('0 0 L * ? *', -60),
+])
+def test_shift_with_unsupported_shifts(expression, delta):
+    with pytest.raises(NotImplementedError):
+        CronExpression(expression).shift(delta)
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import boto3
+import json
 from botocore.stub import Stubber
 from lib.events import EventBus
 import pytest
@@ -34,3 +35,188 @@ def test_emit_process_completed():
     with stubber:
         response = bus.emit_process_completed([{'foo': 'bar'}])
         assert response == mocked_response
+
+
+def test_emit_process_completed_with_failures():
+    mocked_response = {
+        'FailedEntryCount': 0,
+        'Entries': [
+            {
+                'EventId': '00000000-0000-0000-0000-000000000000'
+            }
+        ]
+    }
+    expected_params = {
+        'Entries': [
+            {
+                'Source': 'scheduled-event-adjuster',
+                'DetailType': 'ProcessCompleted',
+                'Detail': '{"Updates": [], "Failures": [{"ResourceName": "foo", "Error": "bar"}]}',
+                'EventBusName': 'default'
+            }
+        ]
+    }
+    eventbridge_client = boto3.client('events')
+    stubber = Stubber(eventbridge_client)
+    stubber.add_response('put_events', mocked_response, expected_params)
+    bus = EventBus(eventbridge_client)
+
+    with stubber:
+        response = bus.emit_process_completed([], [{'ResourceName': 'foo', 'Error': 'bar'}])
+        assert response == mocked_response
+
+
+class FakeEventBridgeClient:
+    """Records the entries of every put_events call, and fails the entries
+    whose index (across all calls) is in fail_indexes, once each."""
+    def __init__(self, fail_indexes=(), always_fail=False):
+        self.calls = []
+        self._fail_indexes = set(fail_indexes)
+        self._always_fail = always_fail
+        self._count = 0
+
+    def put_events(self, Entries):
+        self.calls.append(Entries)
+        results = []
+        for entry in Entries:
+            if self._always_fail or self._count in self._fail_indexes:
+                self._fail_indexes.discard(self._count)
+                results.append({'ErrorCode': 'InternalFailure', 'ErrorMessage': 'Boom'})
+            else:
+                results.append({'EventId': str(self._count)})
+            self._count += 1
+        return {'FailedEntryCount': sum('ErrorCode' in result for result in results), 'Entries': results}
+
+
+def build_updates(count):
+    return [
+        {
+            'Type': 'AutoScalingGroupScalingPolicy',
+            'ResourceName': 'asg-{}'.format(i),
+            'ResourceArn': 'arn:aws:autoscaling:eu-west-1:123456789012:autoScalingGroup:{}'.format(i),
+            'OriginalRecurrence': '0 9 * * *',
+            'NewRecurrence': '0 8 * * *',
+            'LocalTime': '10:00',
+            'LocalTimezone': 'Europe/Madrid',
+            'AdditionalDetails': {'ActionName': 'action-{}'.format(i)}
+        }
+        for i in range(count)
+    ]
+
+
+def get_entry_size(entry):
+    return 14 + sum(len(entry[key].encode('utf-8')) for key in ('Source', 'DetailType', 'Detail'))
+
+
+def test_emit_process_completed_splits_large_fleets_into_batches():
+    updates = build_updates(20000)
+    failures = [{'ResourceName': 'rule-{}'.format(i), 'Error': 'Boom'} for i in range(1000)]
+    client = FakeEventBridgeClient()
+    bus = EventBus(client)
+
+    response = bus.emit_process_completed(updates, failures)
+
+    entries = [entry for call in client.calls for entry in call]
+    details = [json.loads(entry['Detail']) for entry in entries]
+    # Full entries are as large as a whole call may be, so they are sent one
+    # per call.
+    assert len(entries) > 10
+    assert len(client.calls) == len(entries)
+    assert all(sum(get_entry_size(entry) for entry in call) <= 256 * 1024 for call in client.calls)
+    assert all(get_entry_size(entry) <= 256 * 1024 for entry in entries)
+    assert [detail['Part'] for detail in details] == list(range(1, len(entries) + 1))
+    assert all(detail['PartCount'] == len(entries) for detail in details)
+    assert [update for detail in details for update in detail['Updates']] == updates
+    assert [failure for detail in details for failure in detail.get('Failures', [])] == failures
+    assert response['FailedEntryCount'] == 0
+    assert len(response['Entries']) == len(entries)
+
+def test_emit_process_completed_includes_regions_in_every_part():
+    updates = build_updates(5000)
+    regions = {'region-{}'.format(i): {'UpdateCount': 1250, 'FailureCount': 0} for i in range(4)}
+    client = FakeEventBridgeClient()
+
+    EventBus(client).emit_process_completed(updates, [], regions)
+
+    entries = [entry for call in client.calls for entry in call]
+    details = [json.loads(entry['Detail']) for entry in entries]
+    assert len(entries) > 1
+    assert all(get_entry_size(entry) <= 256 * 1024 for entry in entries)
+    assert all(detail['Regions'] == regions for detail in details)
+    assert [update for detail in details for update in detail['Updates']] == updates
+    assert entries[0]['Detail'] == json.dumps(details[0])
+
+def test_emit_process_completed_packs_entries_close_to_the_limit():
+    updates = build_updates(5000)
+    client = FakeEventBridgeClient()
+
+    EventBus(client).emit_process_completed(updates)
+
+    entries = [entry for call in client.calls for entry in call]
+    total_size = sum(get_entry_size(entry) for entry in entries)
+    assert len(entries) == -(-total_size // (256 * 1024))
+
+def test_emit_process_completed_sends_up_to_ten_small_entries_per_call():
+    client = FakeEventBridgeClient()
+    bus = EventBus(client)
+    bus.MAX_ENTRY_SIZE = 4096
+
+    bus.emit_process_completed(build_updates(2000))
+
+    assert len(client.calls) > 10
+    assert all(len(call) == 10 for call in client.calls[:-1])
+    assert all(get_entry_size(entry) <= 4096 for call in client.calls for entry in call)
+
+def test_emit_process_completed_retries_failed_entries():
+    updates = build_updates(1000)
+    client = FakeEventBridgeClient(fail_indexes=[1, 3])
+    sleeps = []
+    bus = EventBus(client, sleep=sleeps.append)
+    bus.MAX_ENTRY_SIZE = 4096
+
+    response = bus.emit_process_completed(updates)
+
+    entry_count = len(response['Entries'])
+    assert [len(call) for call in client.calls][-1] == 2
+    assert client.calls[-1] == [client.calls[0][1], client.calls[0][3]]
+    assert sleeps == [0.1]
+    assert response['FailedEntryCount'] == 0
+    assert all('EventId' in result for result in response['Entries'])
+    assert sum(len(call) for call in client.calls) == entry_count + 2
+
+def test_emit_process_completed_fails_after_max_attempts():
+    client = FakeEventBridgeClient(always_fail=True)
+    bus = EventBus(client, sleep=lambda seconds: None)
+
+    with pytest.raises(Exception) as raised:
+        bus.emit_process_completed([{'foo': 'bar'}])
+
+    assert str(raised.value) == '1 of 1 events failed to be emitted: InternalFailure'
+    assert len(client.calls) == EventBus.MAX_ATTEMPTS
+
+def test_emit_process_completed_with_summary():
+    updates = build_updates(3000) + [dict(build_updates(1)[0], Type='EventBridgeRule')]
+    failures = [{'ResourceName': 'rule', 'Error': 'Boom'}]
+    client = FakeEventBridgeClient()
+    bus = EventBus(client, summary=True)
+
+    bus.emit_process_completed(updates, failures)
+
+    entries = [entry for call in client.calls for entry in call]
+    assert entries[0]['DetailType'] == 'ProcessCompletedSummary'
+    assert json.loads(entries[0]['Detail']) == {
+        'UpdateCount': 3001,
+        'FailureCount': 1,
+        'UpdateCountByType': {'AutoScalingGroupScalingPolicy': 3000, 'EventBridgeRule': 1},
+        'PartCount': len(entries) - 1
+    }
+    assert all(entry['DetailType'] == 'ProcessCompleted' for entry in entries[1:])
+
+def test_emit_process_completed_with_summary_of_regions():
+    regions = {'eu-west-1': {'UpdateCount': 1, 'FailureCount': 0}}
+    client = FakeEventBridgeClient()
+
+    EventBus(client, summary=True).emit_process_completed(build_updates(1), [], regions)
+
+    entries = [entry for call in client.calls for entry in call]
+    assert json.loads(entries[0]['Detail'])['Regions'] == regions
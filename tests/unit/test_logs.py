@@ -0,0 +1,60 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import logging
+import pytest
+from lib import logs
+
+
+@pytest.fixture
+def package_loggers():
+    # configure() replaces the handlers and level of the package loggers, so
+    # they are restored once the test completes.
+    saved = [(logger, logger.level, logger.handlers, logger.propagate)
+             for logger in map(logging.getLogger, logs.LOGGER_NAMES)]
+    yield
+    for logger, level, handlers, propagate in saved:
+        logger.setLevel(level)
+        logger.handlers = handlers
+        logger.propagate = propagate
+
+
+def test_records_are_written_as_json_with_extra_fields(package_loggers, capsys):
+    logs.configure('INFO')
+
+    logging.getLogger('lib.processors.runner').info("Processor '%s' has completed", 'Asg', extra={'UpdateCount': 3})
+
+    record = json.loads(capsys.readouterr().out)
+    assert record['level'] == 'INFO'
+    assert record['logger'] == 'lib.processors.runner'
+    assert record['message'] == "Processor 'Asg' has completed"
+    assert record['UpdateCount'] == 3
+    assert record['timestamp'].endswith('+00:00')
+
+def test_records_below_level_are_not_formatted(package_loggers, capsys, mocker):
+    logs.configure('INFO')
+    argument = mocker.MagicMock()
+
+    logging.getLogger('lib.recurrence').debug("Calculated %s", argument)
+    logging.getLogger('lib.recurrence').warning("Throttled")
+
+    assert not argument.__str__.called
+    assert [json.loads(line)['message'] for line in capsys.readouterr().out.splitlines()] == ['Throttled']
+
+def test_exceptions_are_included(package_loggers, capsys):
+    logs.configure('ERROR')
+
+    try:
+        raise ValueError('Boom')
+    except ValueError:
+        logging.getLogger('lib').error("Failed", exc_info=True)
+
+    record = json.loads(capsys.readouterr().out)
+    assert 'ValueError: Boom' in record['exception']
+
+def test_unknown_level_is_rejected():
+    with pytest.raises(ValueError) as raised:
+        logs.configure('VERBOSE')
+
+    assert str(raised.value) == "Unknown LOG_LEVEL 'VERBOSE'. Supported levels are: DEBUG, INFO, WARNING, ERROR"
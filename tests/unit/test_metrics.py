@@ -0,0 +1,95 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+from lib.metrics import MetricsCollector, NullMetricsCollector
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def build_collector(**kwargs):
+    clock = FakeClock()
+    lines = []
+    collector = MetricsCollector('Adjuster', {'Service': 'adjuster'}, clock=clock, wall_clock=lambda: 1600000000.5,
+                                 output=lines.append, **kwargs)
+    return collector, clock, lines
+
+
+def test_collector_records_counters_and_timers():
+    collector, clock, lines = build_collector()
+
+    collector.increment('put_rule.Calls')
+    collector.increment('put_rule.Calls', 2)
+    with collector.timer('put_rule.Time'):
+        clock.now += 0.25
+    with collector.timer('put_rule.Time'):
+        clock.now += 0.5
+
+    assert collector.get_values() == {'put_rule.Calls': 3, 'put_rule.Time': 750}
+
+def test_timer_records_time_when_an_error_is_raised():
+    collector, clock, lines = build_collector()
+
+    try:
+        with collector.timer('put_rule.Time'):
+            clock.now += 0.1
+            raise ValueError()
+    except ValueError:
+        pass
+
+    assert collector.get_values() == {'put_rule.Time': 100}
+
+def test_flush_writes_emf_document_and_resets():
+    collector, clock, lines = build_collector()
+    collector.increment('EventBridgeRule.Updated', 4)
+    with collector.timer('Recurrences.Time'):
+        clock.now += 0.0015
+
+    documents = collector.flush()
+
+    assert [json.loads(line) for line in lines] == documents == [{
+        '_aws': {
+            'Timestamp': 1600000000500,
+            'CloudWatchMetrics': [{
+                'Namespace': 'Adjuster',
+                'Dimensions': [['Service']],
+                'Metrics': [
+                    {'Name': 'EventBridgeRule.Updated', 'Unit': 'Count'},
+                    {'Name': 'Recurrences.Time', 'Unit': 'Milliseconds'}
+                ]
+            }]
+        },
+        'Service': 'adjuster',
+        'EventBridgeRule.Updated': 4,
+        'Recurrences.Time': 1.5
+    }]
+    assert collector.get_values() == {}
+    assert collector.flush() == []
+
+def test_flush_splits_documents_beyond_metric_limit():
+    collector, clock, lines = build_collector()
+    for i in range(250):
+        collector.increment('metric{:03d}'.format(i))
+
+    documents = collector.flush()
+
+    assert [len(document['_aws']['CloudWatchMetrics'][0]['Metrics']) for document in documents] == [100, 100, 50]
+    assert len(lines) == 3
+    assert all(document['Service'] == 'adjuster' for document in documents)
+
+def test_null_collector_records_nothing():
+    collector = NullMetricsCollector()
+
+    collector.increment('put_rule.Calls')
+    collector.add_time('put_rule.Time', 1)
+    with collector.timer('put_rule.Time'):
+        pass
+
+    assert not collector.enabled
+    assert collector.flush() == []
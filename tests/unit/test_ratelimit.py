@@ -0,0 +1,262 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import collections
+
+from botocore.exceptions import ClientError
+from lib.metrics import MetricsCollector
+from lib.ratelimit import AdaptiveRateLimiter, TokenBucket, UnlimitedRateLimiter, is_throttling_error
+import pytest
+
+
+class FakeClock:
+    """A clock which only moves forward when something sleeps on it."""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ThrottlingClient:
+    """A stand-in for an AWS client whose 'put_rule' operation throttles any
+    call beyond the given number of calls per (sliding) second. Every call
+    takes latency seconds of the fake clock."""
+    def __init__(self, clock, tps, latency=0.001):
+        self._clock = clock
+        self._tps = tps
+        self._latency = latency
+        self._accepted = collections.deque()
+        self.call_count = 0
+        self.throttle_count = 0
+
+    def put_rule(self, **kwargs):
+        self.call_count += 1
+        self._clock.now += self._latency
+        now = self._clock()
+        while self._accepted and self._accepted[0] <= now - 1:
+            self._accepted.popleft()
+        if len(self._accepted) >= self._tps:
+            self.throttle_count += 1
+            raise throttling_error('PutRule')
+        self._accepted.append(now)
+        return {'RuleArn': kwargs['Name']}
+
+
+class FakePaginator:
+    """A paginator over the given pages which throttles the request of the
+    page at throttle_index once, and records the parameters of every
+    pagination."""
+    def __init__(self, pages, throttle_index):
+        self._pages = pages
+        self._throttle_index = throttle_index
+        self.calls = []
+
+    def paginate(self, **params):
+        self.calls.append(params)
+        token = (params.get('PaginationConfig') or {}).get('StartingToken')
+        start = 0 if token is None else int(token)
+        for index in range(start, len(self._pages)):
+            if index == self._throttle_index:
+                self._throttle_index = None
+                raise throttling_error('ListRules')
+            yield self._pages[index]
+
+
+def throttling_error(operation_name, code='ThrottlingException'):
+    return ClientError({'Error': {'Code': code, 'Message': 'Rate exceeded'}}, operation_name)
+
+
+def test_is_throttling_error():
+    assert is_throttling_error(throttling_error('PutRule'))
+    assert is_throttling_error(throttling_error('PutRule', 'Throttling'))
+    assert not is_throttling_error(throttling_error('PutRule', 'ValidationError'))
+    assert not is_throttling_error(ValueError('foo'))
+
+
+def test_token_bucket_paces_to_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(2, clock, clock.sleep)
+
+    for _ in range(5):
+        bucket.acquire()
+
+    # The first two tokens are available straight away; the rest are paced.
+    assert clock.sleeps == [0.5, 0.5, 0.5]
+
+
+def test_token_bucket_without_rate_does_not_pace():
+    clock = FakeClock()
+    bucket = TokenBucket(None, clock, clock.sleep)
+
+    for _ in range(100):
+        bucket.acquire()
+
+    assert clock.sleeps == []
+    assert bucket.get_recent_rate() == 100
+
+
+def test_limiter_does_not_pace_until_throttled():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+
+    for _ in range(50):
+        limiter.call('put_rule', lambda: None)
+
+    assert clock.sleeps == []
+    assert limiter.get_rate('put_rule') is None
+
+
+def test_limiter_slows_down_after_throttle_and_retries():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(increase_rate=0, decrease_factor=0.5, clock=clock, sleep=clock.sleep)
+    responses = iter([None] * 9 + [throttling_error('PutRule'), 'ok'])
+
+    def put_rule():
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    for _ in range(9):
+        limiter.call('put_rule', put_rule)
+    assert limiter.call('put_rule', put_rule) == 'ok'
+
+    # Ten calls were made within the last second, so pacing starts at half
+    # that rate, and the retry waits for a fresh token.
+    assert limiter.get_rate('put_rule') == 5
+    assert limiter.get_throttle_count('put_rule') == 1
+    assert limiter.get_throttle_count() == 1
+    assert clock.sleeps == [pytest.approx(0.2)]
+
+
+def test_limiter_grows_rate_per_second_of_success():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(min_rate=1, increase_rate=2, decrease_factor=0.5, clock=clock,
+                                  sleep=clock.sleep)
+    errors = [throttling_error('PutRule')]
+
+    def put_rule():
+        if errors:
+            raise errors.pop()
+
+    # The throttled call slows the operation down to a single call per
+    # second, and its retry waits a second for the next token.
+    limiter.call('put_rule', put_rule)
+    assert clock.now == 1
+    assert limiter.get_rate('put_rule') == 3
+
+    # However many calls are made, the rate only grows with the time that
+    # has passed since the throttle.
+    for _ in range(10):
+        limiter.call('put_rule', put_rule)
+    assert limiter.get_rate('put_rule') == pytest.approx(1 + 2 * clock.now)
+
+
+def test_limiter_raises_after_max_retries():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(max_retries=2, clock=clock, sleep=clock.sleep)
+    calls = []
+
+    def put_rule():
+        calls.append(1)
+        raise throttling_error('PutRule')
+
+    with pytest.raises(ClientError):
+        limiter.call('put_rule', put_rule)
+    assert len(calls) == 3
+
+
+def test_limiter_does_not_retry_other_errors():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+    calls = []
+
+    def put_rule():
+        calls.append(1)
+        raise throttling_error('PutRule', 'ValidationError')
+
+    with pytest.raises(ClientError):
+        limiter.call('put_rule', put_rule)
+    assert len(calls) == 1
+    assert limiter.get_throttle_count() == 0
+
+
+def test_limiter_paginate_resumes_from_last_page():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+    pages = [{'Rules': [i], 'NextToken': str(i + 1)} for i in range(4)]
+    pages[-1] = {'Rules': [3]}
+    paginator = FakePaginator(pages, throttle_index=2)
+
+    result = list(limiter.paginate('list_rules', paginator, 'NextToken', NamePrefix='foo'))
+
+    assert result == pages
+    assert paginator.calls == [
+        {'NamePrefix': 'foo'},
+        {'NamePrefix': 'foo', 'PaginationConfig': {'StartingToken': '2'}},
+    ]
+    assert limiter.get_throttle_count('list_rules') == 1
+
+
+def test_limiter_paginate_restarts_when_first_page_is_throttled():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+    pages = [{'Rules': [0], 'NextToken': '1'}, {'Rules': [1]}]
+    paginator = FakePaginator(pages, throttle_index=0)
+
+    result = list(limiter.paginate('list_rules', paginator, 'NextToken'))
+
+    assert result == pages
+    assert paginator.calls == [{}, {}]
+
+
+def test_limiter_converges_below_throttling_limit():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+    client = ThrottlingClient(clock, tps=10)
+
+    for i in range(500):
+        limiter.call('put_rule', client.put_rule, Name='rule-{}'.format(i))
+
+    # Every call eventually succeeds, with only a small share of them being
+    # throttled, and the overall throughput stays close to the limit.
+    assert client.call_count - client.throttle_count == 500
+    assert client.throttle_count < 50
+    assert 500 / clock.now > 10 * 0.7
+
+
+def test_unlimited_limiter_passes_calls_through():
+    limiter = UnlimitedRateLimiter()
+    paginator = FakePaginator([{'Rules': [0]}], throttle_index=None)
+
+    assert limiter.call('put_rule', lambda **kwargs: kwargs, Name='foo') == {'Name': 'foo'}
+    assert list(limiter.paginate('list_rules', paginator, 'NextToken', NamePrefix='foo')) == [{'Rules': [0]}]
+    with pytest.raises(ClientError):
+        limiter.call('put_rule', lambda: (_ for _ in ()).throw(throttling_error('PutRule')))
+
+
+def test_limiter_records_calls_time_and_throttles():
+    clock = FakeClock()
+    metrics = MetricsCollector('Adjuster')
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep, metrics=metrics)
+    errors = [throttling_error('PutRule')]
+    pages = [{'Rules': [0], 'NextToken': '1'}, {'Rules': [1]}]
+
+    def put_rule():
+        if errors:
+            raise errors.pop()
+
+    limiter.call('put_rule', put_rule)
+    list(limiter.paginate('list_rules', FakePaginator(pages, throttle_index=None), 'NextToken'))
+
+    values = metrics.get_values()
+    assert values['put_rule.Calls'] == 2
+    assert values['put_rule.Throttles'] == 1
+    assert values['list_rules.Calls'] == 2
+    assert 'put_rule.Time' in values and 'list_rules.Time' in values
@@ -1,38 +1,23 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytest
-from lib.recurrence import parse_cron_expression, RecurrenceCalculator, TimeSource
+import pytz
+import random
+from lib import timezones
+from lib.metrics import MetricsCollector
+from lib.recurrence import parse_local_times, CachingRecurrenceCalculator, RecurrenceCalculator, TimeSource
 
-def get_valid_expressions():
-    return [
-        ('30 15 * * * *', {'minute': '30', 'hour': '15', 'rest': '* * * *'}),
-        ('30 15 * * *', {'minute': '30', 'hour': '15', 'rest': '* * *'})
-    ]
-
-
-def get_invalid_expressions():
-    return [
-        '30 15 * *',
-        '30 15 * * * * *',
-        'foo',
-        None,
-        False
-    ]
-
-
-@pytest.mark.parametrize('expression,expected', get_valid_expressions())
-def test_parse_cron_expression(expression, expected):
-    parsed = parse_cron_expression(expression)
 
-    assert parsed == expected
-
-
-@pytest.mark.parametrize('expression', get_invalid_expressions())
-def test_parse_cron_expression_with_invalid_expression(expression):
-    with pytest.raises(Exception):
-        parse_cron_expression(expression)
+@pytest.mark.parametrize('expected_time,expected', [
+    ('08:00', (480,)),
+    ('8:05', (485,)),
+    ('08:00, 12:30,18:00', (480, 750, 1080)),
+    ('6pm', (1080,))
+])
+def test_parse_local_times(expected_time, expected):
+    assert parse_local_times(expected_time) == expected
 
 
 def get_calculate_recurrence_inputs():
@@ -70,18 +55,213 @@ def test_calculate_recurrence(tz,
     assert calculated_recurrence == expected_recurrence
 
 
-@pytest.mark.parametrize('recurrence', [
-    '0 6-9 * * *',
-    '0 6,7 * * *',
-    '0-3 0 * * *',
-    '0,1 0 * * *'
+@pytest.mark.parametrize('tz,lt,now,current_recurrence,expected_recurrence', [
+    # Lists, ranges and steps are shifted as a whole
+    ('Europe/Madrid', '09:00,13:00,19:00', datetime(2020, 6, 1), '0 8,12,18 * * ? *', '0 7,11,17 * * ? *'),
+    ('Europe/Madrid', '10:00', datetime(2020, 6, 1), '*/30 9-17 * * *', '*/30 8-16 * * *'),
+    ('Europe/Madrid', '09:00', datetime(2020, 1, 1), '0 8-18/2 * * *', '0 8-18/2 * * *'),
+    ('Europe/Madrid', '09:00', datetime(2020, 6, 1), '0 8-18/2 * * ? *', '0 7-17/2 * * ? *'),
+    ('Europe/Madrid', '09:00', datetime(2020, 6, 1), '0 */2 * * ? *', '0 1/2 * * ? *'),
+    ('Asia/Kolkata', '00:00,01:00,02:00,03:00', datetime(2020, 1, 1), '0 6-9 * * *', '30 18-21 * * *'),
+    ('Europe/Madrid', '00:00', datetime(2020, 1, 1), '0-3 0 * * *', '0-3 23 * * *'),
+    # Runs which move to another day shift the weekdays too
+    ('Europe/Madrid', '01:30', datetime(2020, 6, 1), '30 0 ? * MON-FRI *', '30 23 ? * SUN-THU *'),
+    ('Europe/Madrid', '01:30', datetime(2020, 1, 1), '30 23 ? * SUN-THU *', '30 0 ? * MON-FRI *'),
+    ('Europe/Madrid', '01:30', datetime(2020, 6, 1), '30 0 * * 1,3,5', '30 23 * * 0,2,4'),
 ])
-def test_calculate_recurrence_with_unsupported_recurrences(recurrence):
-    calculator = RecurrenceCalculator()
+def test_calculate_recurrence_with_multiple_runs(tz, lt, now, current_recurrence, expected_recurrence):
+    calculator = RecurrenceCalculator(FixedTimeSource(pytz.utc.localize(now)))
+
+    assert calculator.calculate_recurrence(current_recurrence, lt, tz) == expected_recurrence
+    assert calculator.calculate_recurrences([(current_recurrence, lt, tz)]) == [expected_recurrence]
 
 
+@pytest.mark.parametrize('tz,lt,now,recurrence', [
+    # The shifted runs are not every combination of some hours and minutes
+    ('Australia/Lord_Howe', '17:00,17:30,18:00,18:30', datetime(2020, 6, 1), '0,30 6-7 * * *'),
+    # The runs move to another day of the month
+    ('Europe/Madrid', '01:00', datetime(2020, 6, 1), '0 0 1 * ? *'),
+])
+def test_calculate_recurrence_with_unsupported_recurrences(tz, lt, now, recurrence):
+    calculator = RecurrenceCalculator(FixedTimeSource(pytz.utc.localize(now)))
+
     with pytest.raises(NotImplementedError):
-        calculated_recurrence = calculator.calculate_recurrence(current_recurrence=recurrence,
-                                                                expected_time='00:00',
-                                                                timezone='Europe/Madrid',
-                                                                start_time=datetime(2020, 1, 1))
+        calculator.calculate_recurrence(recurrence, lt, tz)
+
+
+def test_calculate_recurrence_with_local_times_that_do_not_match_the_runs():
+    calculator = RecurrenceCalculator(FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1))))
+
+    with pytest.raises(ValueError):
+        calculator.calculate_recurrence('0 8,12 * * *', '09:00,10:00', 'Europe/Madrid')
+
+
+def get_outcome(function, *args):
+    """Returns the result of the function, or the type of the exception it
+    raises (or returns, for batch results)."""
+    try:
+        result = function(*args)
+    except Exception as e:
+        return type(e)
+    return type(result) if isinstance(result, Exception) else result
+
+
+class FixedTimeSource:
+    def __init__(self, now):
+        self.now = now
+
+    def get_current_utc_datetime(self):
+        return self.now
+
+
+def test_caching_calculator_counts_hits_and_misses():
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1)))
+    calculator = CachingRecurrenceCalculator(time_source)
+
+    first = calculator.calculate_recurrence('30 0 * * ? *', '11:00', 'Europe/Madrid')
+    second = calculator.calculate_recurrence('30 0 * * ? *', '11:00', 'Europe/Madrid')
+    calculator.calculate_recurrence('30 0 * * ? *', '12:00', 'Europe/Madrid')
+
+    assert first == second == '0 10 * * ? *'
+    assert calculator.cache_info() == (1, 2, CachingRecurrenceCalculator.DEFAULT_MAXSIZE, 2)
+
+def test_caching_calculator_evicts_least_recently_used_entries():
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1)))
+    calculator = CachingRecurrenceCalculator(time_source, maxsize=2)
+
+    calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid')
+    calculator.calculate_recurrence('0 11 * * ? *', '12:00', 'Europe/Madrid')
+    calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid')
+    calculator.calculate_recurrence('0 12 * * ? *', '13:00', 'Europe/Madrid')
+    calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid')
+    calculator.calculate_recurrence('0 11 * * ? *', '12:00', 'Europe/Madrid')
+
+    assert calculator.cache_info() == (2, 4, 2, 2)
+
+def test_caching_calculator_invalidates_results_across_offset_changes():
+    # Europe/Madrid moved from UTC+1 to UTC+2 on 2020-03-29 at 01:00 UTC.
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 3, 20)))
+    calculator = CachingRecurrenceCalculator(time_source)
+
+    assert calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid') == '0 10 * * ? *'
+    time_source.now = pytz.utc.localize(datetime(2020, 3, 27, 12))
+    assert calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid') == '0 10 * * ? *'
+    time_source.now = pytz.utc.localize(datetime(2020, 3, 28, 12))
+    assert calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid') == '0 9 * * ? *'
+
+    assert calculator.cache_info().hits == 1
+    assert calculator.cache_info().misses == 2
+
+def test_caching_calculator_does_not_cache_calculations_with_start_time():
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1)))
+    calculator = CachingRecurrenceCalculator(time_source)
+
+    calculator.calculate_recurrence('0 10 * * ? *', '11:00', 'Europe/Madrid', pytz.utc.localize(datetime(2020, 1, 5)))
+
+    assert calculator.cache_info() == (0, 0, CachingRecurrenceCalculator.DEFAULT_MAXSIZE, 0)
+
+def test_caching_calculator_matches_uncached_calculator():
+    rng = random.Random(20201025)
+    zones = ['Europe/Madrid', 'America/New_York', 'Australia/Sydney', 'Australia/Lord_Howe',
+             'America/St_Johns', 'Asia/Kolkata', 'Asia/Tokyo', 'America/Santiago', 'UTC']
+    rests = ['* * ? *', '* * *', '? * MON-FRI *', '1 * ? *', '? * SUN *']
+    inputs = [
+        ('{} {} {}'.format(rng.choice([0, 15, 30, 45]), rng.randrange(24), rng.choice(rests)),
+         '{:02d}:{:02d}'.format(rng.randrange(24), rng.choice([0, 30])),
+         rng.choice(zones))
+        for i in range(40)
+    ]
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1)))
+    cached = CachingRecurrenceCalculator(time_source, maxsize=32)
+    uncached = RecurrenceCalculator(time_source)
+
+    for i in range(3000):
+        time_source.now += timedelta(minutes=rng.choice([1, 7, 60, 390, 1440, 2 * 1440]))
+        recurrence, expected_time, timezone = rng.choice(inputs)
+
+        assert get_outcome(cached.calculate_recurrence, recurrence, expected_time, timezone) == \
+            get_outcome(uncached.calculate_recurrence, recurrence, expected_time, timezone)
+
+    assert cached.cache_info().hits > 0
+
+def test_calculate_recurrences_matches_calculate_recurrence():
+    rng = random.Random(20210328)
+    zones = ['Europe/Madrid', 'America/New_York', 'Australia/Lord_Howe', 'America/St_Johns',
+             'Asia/Kolkata', 'Asia/Kathmandu', 'Pacific/Chatham', 'UTC']
+    rests = ['* * ? *', '* * *', '? * MON-FRI *', '1 * ? *', '? * SUN *']
+    time_source = FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1)))
+    calculator = RecurrenceCalculator(time_source)
+
+    for i in range(100):
+        time_source.now += timedelta(minutes=rng.randrange(1, 10 * 1440))
+        batch = [
+            ('{} {} {}'.format(rng.choice([0, 15, 30, 45]), rng.randrange(24), rng.choice(rests)),
+             '{:02d}:{:02d}'.format(rng.randrange(24), rng.choice([0, 30, 45])),
+             rng.choice(zones))
+            for j in range(20)
+        ]
+
+        assert [get_outcome(lambda: result) for result in calculator.calculate_recurrences(batch)] == \
+            [get_outcome(calculator.calculate_recurrence, *item) for item in batch]
+
+def test_calculate_recurrences_returns_errors_in_place():
+    calculator = RecurrenceCalculator(FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1))))
+
+    results = calculator.calculate_recurrences([
+        ('30 0 * * ? *', '11:00', 'Europe/Madrid'),
+        ('0 0 1 * ? *', '00:00', 'Europe/Madrid'),
+        ('0 10 * * ? *', '11:00', 'Not/AZone'),
+        ('0 10 * * ? *', '11:00', 'Europe/Madrid')
+    ])
+
+    assert results[0] == '0 10 * * ? *'
+    assert isinstance(results[1], NotImplementedError)
+    assert isinstance(results[2], pytz.UnknownTimeZoneError)
+    assert results[3] == '0 10 * * ? *'
+
+def test_caching_calculator_calculates_only_missing_recurrences_in_batches(mocker):
+    calculator = CachingRecurrenceCalculator(FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1))))
+    calculator.calculate_recurrence('30 0 * * ? *', '11:00', 'Europe/Madrid')
+    spy = mocker.spy(calculator, '_calculate_recurrences_at')
+
+    results = calculator.calculate_recurrences([
+        ('30 0 * * ? *', '11:00', 'Europe/Madrid'),
+        ('0 8 * * ? *', '08:00', 'Asia/Tokyo')
+    ])
+
+    assert results == ['0 10 * * ? *', '0 23 * * ? *']
+    assert spy.call_args[0][0] == [('0 8 * * ? *', '08:00', 'Asia/Tokyo')]
+    assert calculator.cache_info().hits == 1
+
+def test_calculate_recurrences_with_zoneinfo_provider_matches_pytz_provider(mocker):
+    zoneinfo = pytest.importorskip('zoneinfo')
+    rng = random.Random(20211031)
+    zones = ['Europe/Madrid', 'America/New_York', 'Australia/Lord_Howe', 'Asia/Kolkata', 'Pacific/Chatham', 'UTC']
+    batch = [
+        ('{} {} * * ? *'.format(rng.choice([0, 15, 30, 45]), rng.randrange(24)),
+         '{:02d}:{:02d}'.format(rng.randrange(24), rng.choice([0, 30, 45])),
+         rng.choice(zones))
+        for i in range(50)
+    ]
+    calculator = RecurrenceCalculator(FixedTimeSource(pytz.utc.localize(datetime(2021, 10, 20))))
+
+    mocker.patch.object(timezones, '_provider', timezones.PytzProvider())
+    expected = calculator.calculate_recurrences(batch)
+    mocker.patch.object(timezones, '_provider', timezones.ZoneInfoProvider(
+        lambda name: zoneinfo.ZoneInfo.from_file(pytz.open_resource(name), key=name)))
+
+    assert calculator.calculate_recurrences(batch) == expected
+    assert [calculator.calculate_recurrence(*item) for item in batch] == expected
+
+def test_caching_calculator_records_metrics():
+    metrics = MetricsCollector('Adjuster')
+    calculator = CachingRecurrenceCalculator(FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 1))), metrics=metrics)
+
+    calculator.calculate_recurrences([('30 0 * * ? *', '11:00', 'Europe/Madrid'), ('0 8 * * ? *', '08:00', 'Asia/Tokyo')])
+    calculator.calculate_recurrences([('30 0 * * ? *', '11:00', 'Europe/Madrid')])
+
+    values = metrics.get_values()
+    assert values['Recurrences.Calculated'] == 2
+    assert values['RecurrenceCache.Hits'] == 1
+    assert values['RecurrenceCache.Misses'] == 2
+    assert values['Recurrences.Time'] > 0
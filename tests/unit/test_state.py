@@ -0,0 +1,163 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime
+import boto3
+from botocore.stub import Stubber
+from lib.state import DynamoDBStateStore, ResourceState, SQLiteStateStore, get_fingerprint
+import pytest
+import pytz
+
+
+class FixedTimeSource:
+    def __init__(self, now):
+        self.now = now
+
+    def get_current_utc_datetime(self):
+        return self.now
+
+
+def build_record(resource_id, **kwargs):
+    record = {
+        'ResourceType': 'AutoScalingGroup',
+        'ResourceId': resource_id,
+        'Fingerprint': 'fingerprint',
+        'UtcOffset': 60,
+        'VerifiedAt': '2020-01-01T00:00:00'
+    }
+    record.update(kwargs)
+    return record
+
+
+def test_get_fingerprint():
+    assert get_fingerprint('a', 'b') == get_fingerprint('a', 'b')
+    assert get_fingerprint('a', 'b') != get_fingerprint('ab')
+    assert get_fingerprint('a', 'b') != get_fingerprint('b', 'a')
+
+def test_sqlite_state_store(tmpdir):
+    path = str(tmpdir.join('state.db'))
+    store = SQLiteStateStore(path)
+    store.batch_put([
+        build_record('AsgOne', ValidUntil='2020-03-22T01:00:00'),
+        build_record('AsgTwo'),
+        build_record('RuleOne', ResourceType='EventBridgeRule')
+    ])
+    store.batch_put([build_record('AsgTwo', Fingerprint='other')])
+
+    records = sorted(SQLiteStateStore(path).query('AutoScalingGroup'), key=lambda record: record['ResourceId'])
+
+    assert records == [
+        build_record('AsgOne', ValidUntil='2020-03-22T01:00:00'),
+        build_record('AsgTwo', Fingerprint='other')
+    ]
+
+def test_dynamodb_state_store_query_reads_every_page():
+    client = boto3.client('dynamodb')
+    stubber = Stubber(client)
+    expected_params = {
+        'TableName': 'state',
+        'KeyConditionExpression': 'ResourceType = :resource_type',
+        'ExpressionAttributeValues': {':resource_type': {'S': 'AutoScalingGroup'}}
+    }
+    item = {
+        'ResourceType': {'S': 'AutoScalingGroup'},
+        'ResourceId': {'S': 'AsgOne'},
+        'Fingerprint': {'S': 'fingerprint'},
+        'UtcOffset': {'N': '60'},
+        'VerifiedAt': {'S': '2020-01-01T00:00:00'}
+    }
+    last_key = {'ResourceType': {'S': 'AutoScalingGroup'}, 'ResourceId': {'S': 'AsgOne'}}
+    stubber.add_response('query', {'Items': [item], 'LastEvaluatedKey': last_key}, expected_params)
+    stubber.add_response('query', {'Items': [dict(item, ResourceId={'S': 'AsgTwo'})]},
+                         dict(expected_params, ExclusiveStartKey=last_key))
+    store = DynamoDBStateStore('state', client)
+
+    with stubber:
+        records = list(store.query('AutoScalingGroup'))
+
+    assert records == [build_record('AsgOne'), build_record('AsgTwo')]
+
+def test_dynamodb_state_store_batch_put_retries_unprocessed_items():
+    client = boto3.client('dynamodb')
+    stubber = Stubber(client)
+    records = [build_record('Asg{}'.format(i)) for i in range(30)]
+    requests = [{'PutRequest': {'Item': {
+        'ResourceType': {'S': 'AutoScalingGroup'},
+        'ResourceId': {'S': record['ResourceId']},
+        'Fingerprint': {'S': 'fingerprint'},
+        'UtcOffset': {'N': '60'},
+        'VerifiedAt': {'S': '2020-01-01T00:00:00'}
+    }}} for record in records]
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {'state': requests[3:4]}},
+                         {'RequestItems': {'state': requests[:25]}})
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': {'state': requests[3:4]}})
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {'RequestItems': {'state': requests[25:]}})
+    store = DynamoDBStateStore('state', client)
+
+    with stubber:
+        store.batch_put(records)
+        stubber.assert_no_pending_responses()
+
+def build_state(records, now=datetime(2020, 1, 15)):
+    store = SQLiteStateStore()
+    store.batch_put(records)
+    state = ResourceState(store, FixedTimeSource(pytz.utc.localize(now)))
+    state.start_run()
+    state.load('AutoScalingGroup')
+    return state
+
+def test_resource_state_is_unchanged_with_same_fingerprint_and_offset():
+    state = build_state([build_record('AsgOne', ValidUntil='2020-03-22T01:00:00')])
+
+    assert state.is_unchanged('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Europe/Madrid')
+    assert not state.is_unchanged('AutoScalingGroup', 'AsgOne', 'other', 'Europe/Madrid')
+    assert not state.is_unchanged('AutoScalingGroup', 'AsgTwo', 'fingerprint', 'Europe/Madrid')
+    assert not state.is_unchanged('EventBridgeRule', 'AsgOne', 'fingerprint', 'Europe/Madrid')
+    assert state.get_unchanged_count() == 1
+
+def test_resource_state_is_changed_when_offset_has_moved():
+    state = build_state([build_record('AsgOne')], now=datetime(2020, 6, 1))
+
+    assert not state.is_unchanged('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Europe/Madrid')
+    assert state.is_unchanged('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Africa/Lagos')
+
+def test_resource_state_is_changed_once_record_expires():
+    state = build_state([build_record('AsgOne', ValidUntil='2020-01-15T00:00:00')])
+
+    assert not state.is_unchanged('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Europe/Madrid')
+
+def test_resource_state_is_changed_in_forced_runs():
+    state = build_state([build_record('AsgOne')])
+    state.start_run(force=True)
+    state.load('AutoScalingGroup')
+
+    assert not state.is_unchanged('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Europe/Madrid')
+
+def test_resource_state_reads_each_type_once_per_run(mocker):
+    store = SQLiteStateStore()
+    store.batch_put([build_record('AsgOne')])
+    query = mocker.spy(store, 'query')
+    state = ResourceState(store, FixedTimeSource(pytz.utc.localize(datetime(2020, 1, 15))))
+
+    state.start_run()
+    state.load('AutoScalingGroup')
+    state.load('AutoScalingGroup')
+    state.start_run()
+    state.load('AutoScalingGroup')
+
+    assert query.call_count == 2
+    assert state.is_unchanged('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Europe/Madrid')
+
+def test_resource_state_saves_verified_resources():
+    store = SQLiteStateStore()
+    state = ResourceState(store, FixedTimeSource(pytz.utc.localize(datetime(2020, 6, 1, 12))))
+    state.start_run()
+    state.record('AutoScalingGroup', 'AsgOne', 'fingerprint', 'Europe/Madrid', datetime(2020, 10, 18, 1, 0, 0, 5))
+    state.record('AutoScalingGroup', 'AsgTwo', 'fingerprint', 'UTC', None)
+
+    assert state.save() == 2
+    assert state.save() == 0
+    assert sorted(store.query('AutoScalingGroup'), key=lambda record: record['ResourceId']) == [
+        build_record('AsgOne', UtcOffset=120, ValidUntil='2020-10-18T01:00:00', VerifiedAt='2020-06-01T12:00:00'),
+        build_record('AsgTwo', UtcOffset=0, VerifiedAt='2020-06-01T12:00:00')
+    ]
@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from lib import timezones
+
+
+def test_get_next_transition():
+    assert timezones.get_next_transition('Europe/Madrid', datetime(2020, 1, 1)) == datetime(2020, 3, 29, 1)
+    assert timezones.get_next_transition('Europe/Madrid', datetime(2020, 3, 29, 1)) == datetime(2020, 10, 25, 1)
+
+def test_get_next_transition_with_aware_datetime():
+    after = pytz.timezone('America/New_York').localize(datetime(2020, 3, 1))
+
+    assert timezones.get_next_transition('America/New_York', after) == datetime(2020, 3, 8, 7)
+
+def test_get_next_transition_without_future_transitions():
+    assert timezones.get_next_transition('UTC', datetime(2020, 1, 1)) is None
+    assert timezones.get_next_transition('Asia/Kolkata', datetime(2020, 1, 1)) is None
+
+def test_pytz_provider_ignores_name_only_changes():
+    transitions = timezones.PytzProvider().get_offset_transitions('Europe/London')
+
+    assert all(a < b for a, b in zip(transitions, transitions[1:]))
+    # In 1968-1971, British Standard Time kept UTC+1 all year round.
+    assert datetime(1968, 10, 26, 23) not in transitions
+
+def test_transition_window_includes_timezones_with_nearby_transitions():
+    window = timezones.TransitionWindow.around(datetime(2020, 3, 25), timedelta(days=7))
+
+    assert window.includes('Europe/Madrid')
+    assert not window.includes('America/New_York')
+    assert not window.includes('UTC')
+
+def test_transition_window_includes_past_transitions_within_horizon():
+    window = timezones.TransitionWindow.around(datetime(2020, 3, 10), timedelta(days=2))
+
+    assert window.includes('America/New_York')
+    assert not window.includes('Europe/Madrid')
+
+def test_transition_window_includes_unknown_timezones():
+    window = timezones.TransitionWindow.around(datetime(2020, 6, 1), timedelta(days=1))
+
+    assert window.includes('Not/AZone')
+
+def get_providers():
+    # The zoneinfo provider reads the tz database bundled with pytz, so that
+    # differences between database versions do not get in the way.
+    zoneinfo = pytest.importorskip('zoneinfo')
+    return timezones.PytzProvider(), timezones.ZoneInfoProvider(
+        lambda name: zoneinfo.ZoneInfo.from_file(pytz.open_resource(name), key=name))
+
+def get_transitions(provider, timezone, since, until):
+    result = []
+    transition = provider.get_next_transition(timezone, since)
+    while transition is not None and transition <= until:
+        result.append(transition)
+        transition = provider.get_next_transition(timezone, transition)
+    return result
+
+def test_providers_agree_on_every_timezone_for_a_year():
+    pytz_provider, zoneinfo_provider = get_providers()
+    since, until = datetime(2025, 1, 1), datetime(2026, 1, 1)
+    mismatches = []
+
+    for timezone in pytz.all_timezones:
+        transitions = get_transitions(pytz_provider, timezone, since, until)
+        moments = [since + timedelta(days=day, hours=12) for day in range(365)]
+        moments += [moment + timedelta(seconds=delta) for moment in transitions for delta in (-1, 0)]
+        if transitions != get_transitions(zoneinfo_provider, timezone, since, until) or \
+                any(pytz_provider.get_utc_offset(timezone, moment) != zoneinfo_provider.get_utc_offset(timezone, moment)
+                    for moment in moments):
+            mismatches.append(timezone)
+
+    assert mismatches == []
+
+@pytest.mark.parametrize('provider_name', ['pytz', 'zoneinfo'])
+def test_module_functions_use_the_configured_provider(provider_name, mocker):
+    provider = dict((provider.name, provider) for provider in get_providers())[provider_name]
+    mocker.patch.object(timezones, '_provider', provider)
+
+    assert timezones.get_provider() is provider
+    assert timezones.get_next_transition('Europe/Madrid', datetime(2020, 1, 1)) == datetime(2020, 3, 29, 1)
+    assert timezones.get_utc_offset('Asia/Kolkata', datetime(2020, 1, 1)) == timedelta(hours=5, minutes=30)
+    assert timezones.get_next_transition('Asia/Kolkata', datetime(2020, 1, 1)) is None
+
+def test_providers_cache_zones():
+    for provider in get_providers():
+        assert provider.get_zone('Europe/Madrid') is provider.get_zone('Europe/Madrid')
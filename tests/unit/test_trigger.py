@@ -0,0 +1,125 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime, timedelta
+from lib import timezones
+from lib.cron import compile_cron_expression
+from lib.trigger import TransitionTriggerScheduler
+import pytz
+
+
+class FakeEventBridgeService:
+    """Records the schedule of the rule, as EventBridge would keep it."""
+    def __init__(self):
+        self.schedules = {}
+
+    def update_rule_schedule(self, rule_name, schedule):
+        self.schedules[rule_name] = schedule
+
+    def disable_rule(self, rule_name):
+        self.schedules[rule_name] = None
+
+
+def test_get_schedule_expression_only_matches_trigger_time():
+    expression = TransitionTriggerScheduler.get_schedule_expression(datetime(2021, 3, 28, 0, 5))
+
+    assert expression == 'cron(5 0 28 3 ? 2021)'
+    cron = compile_cron_expression(expression[len('cron('):-1])
+    assert cron.get_next_run(datetime(2021, 1, 1)) == datetime(2021, 3, 28, 0, 5)
+    assert cron.get_next_run(datetime(2021, 3, 28, 0, 5)) is None
+
+def test_get_next_trigger_time_runs_before_and_after_transition():
+    # Europe/Madrid moves from UTC+1 to UTC+2 at 2021-03-28 01:00 UTC.
+    scheduler = TransitionTriggerScheduler(FakeEventBridgeService(), 'trigger')
+
+    assert scheduler.get_next_trigger_time(['Europe/Madrid'], datetime(2021, 3, 1)) == datetime(2021, 3, 28, 0, 0)
+    assert scheduler.get_next_trigger_time(['Europe/Madrid'], datetime(2021, 3, 28, 0, 0)) == \
+        datetime(2021, 3, 28, 1, 5)
+    assert scheduler.get_next_trigger_time(['Europe/Madrid'], datetime(2021, 3, 28, 1, 5)) == \
+        datetime(2021, 10, 31, 0, 0)
+
+def test_get_next_trigger_time_is_never_earlier_than_next_minute():
+    scheduler = TransitionTriggerScheduler(FakeEventBridgeService(), 'trigger')
+    now = pytz.utc.localize(datetime(2021, 3, 28, 0, 30, 15))
+
+    # The run before the transition was missed, but the one after it is not.
+    assert scheduler.get_next_trigger_time(['Europe/Madrid'], now) == datetime(2021, 3, 28, 1, 5)
+
+def test_get_next_trigger_time_picks_earliest_timezone():
+    scheduler = TransitionTriggerScheduler(FakeEventBridgeService(), 'trigger')
+
+    # America/New_York moves to UTC-4 at 2021-03-14 07:00 UTC.
+    assert scheduler.get_next_trigger_time(['Europe/Madrid', 'America/New_York', 'Asia/Tokyo'],
+                                           datetime(2021, 3, 1)) == datetime(2021, 3, 14, 6, 0)
+
+def test_get_next_trigger_time_skips_unknown_timezones():
+    scheduler = TransitionTriggerScheduler(FakeEventBridgeService(), 'trigger')
+
+    assert scheduler.get_next_trigger_time(['Foo/Bar', 'Europe/Madrid'], datetime(2021, 3, 1)) == \
+        datetime(2021, 3, 28, 0, 0)
+    assert scheduler.get_next_trigger_time(['Foo/Bar'], datetime(2021, 3, 1)) is None
+
+def test_schedule_next_run_updates_rule():
+    service = FakeEventBridgeService()
+    scheduler = TransitionTriggerScheduler(service, 'trigger')
+
+    assert scheduler.schedule_next_run({'Europe/Madrid'}, datetime(2021, 3, 1)) == datetime(2021, 3, 28, 0, 0)
+    assert service.schedules == {'trigger': 'cron(0 0 28 3 ? 2021)'}
+
+def test_schedule_next_run_disables_rule_without_transitions():
+    service = FakeEventBridgeService()
+    scheduler = TransitionTriggerScheduler(service, 'trigger')
+
+    assert scheduler.schedule_next_run({'Asia/Tokyo', 'UTC'}, datetime(2021, 3, 1)) is None
+    assert service.schedules == {'trigger': None}
+
+def test_one_year_of_invocations():
+    """Simulates a year of invocations under both trigger modes, and checks
+    that following the transitions takes far fewer runs, while still
+    running shortly before and after every transition."""
+    zones = ['Europe/Madrid', 'America/New_York', 'Australia/Sydney', 'America/Santiago', 'Asia/Tokyo']
+    start = datetime(2021, 1, 1)
+    end = datetime(2022, 1, 1)
+    fixed_trigger = compile_cron_expression('0 0,12 * * ? *')
+    safety_net_trigger = compile_cron_expression('0 0 ? * SUN *')
+
+    fixed_runs = []
+    now = start - timedelta(minutes=1)
+    while True:
+        now = fixed_trigger.get_next_run(now)
+        if now >= end:
+            break
+        fixed_runs.append(now)
+
+    service = FakeEventBridgeService()
+    scheduler = TransitionTriggerScheduler(service, 'trigger')
+    scheduler.schedule_next_run(zones, start)
+    transition_runs = []
+    now = start
+    while True:
+        next_runs = [safety_net_trigger.get_next_run(now)]
+        if service.schedules['trigger'] is not None:
+            rule_run = compile_cron_expression(service.schedules['trigger'][len('cron('):-1]).get_next_run(now)
+            if rule_run is not None:
+                next_runs.append(rule_run)
+        now = min(next_runs)
+        if now >= end:
+            break
+        transition_runs.append(now)
+        scheduler.schedule_next_run(zones, now)
+
+    transitions = []
+    for zone in zones:
+        transition = timezones.get_next_transition(zone, start)
+        while transition is not None and transition < end:
+            transitions.append(transition)
+            transition = timezones.get_next_transition(zone, transition)
+
+    assert len(fixed_runs) == 730
+    assert len(transitions) == 8
+    # A weekly run, plus one before and one after every transition (fewer
+    # when some of them coincide with the weekly run).
+    assert len(transition_runs) <= 52 + 2 * len(transitions)
+    for transition in transitions:
+        assert any(transition - timedelta(hours=1) <= run <= transition for run in transition_runs)
+        assert any(transition < run <= transition + timedelta(minutes=5) for run in transition_runs)
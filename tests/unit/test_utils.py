@@ -10,3 +10,28 @@ def test_get_tag_by_key():
 
     assert utils.get_tag_by_key(tags, 'foo') == 'bar'
     assert utils.get_tag_by_key(tags, 'nope') == None
+
+def test_tag_index():
+    tags = [
+        {'Key': 'foo', 'Value': 'bar'},
+        {'Key': 'foo', 'Value': 'baz'},
+        {'Key': 'pre:local-time', 'Value': '09:00'},
+        {'Key': 'pre:local-time:ActionOne', 'Value': '10:00'},
+        {'Key': 'pre:local-time:Action:Two', 'Value': '11:00'}
+    ]
+
+    index = utils.TagIndex(tags, 'pre:local-time:')
+
+    assert index.get('foo') == utils.get_tag_by_key(tags, 'foo') == 'bar'
+    assert index.get('pre:local-time') == '09:00'
+    assert index.get('nope') == None
+    assert index.get_local_time('ActionOne') == '10:00'
+    assert index.get_local_time('Action:Two') == '11:00'
+    assert index.get_local_time('nope') == None
+    assert index.get_local_times() == {'ActionOne': '10:00', 'Action:Two': '11:00'}
+
+def test_tag_index_without_local_time_prefix():
+    index = utils.TagIndex([{'Key': 'pre:local-time:ActionOne', 'Value': '10:00'}])
+
+    assert index.get('pre:local-time:ActionOne') == '10:00'
+    assert index.get_local_times() == {}